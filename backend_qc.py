@@ -0,0 +1,350 @@
+# backend_qc.py
+# 界面提取所依赖的 UI 后端接口。
+# extractor_qc 只通过这里定义的少量方法访问窗口，因此同一套提取逻辑既可以驱动
+# 真实的 pywinauto 窗口，也可以在 Linux 上驱动内存中的模拟窗口树（用于性能测试）。
+import time
+import threading
+from collections import Counter, OrderedDict
+
+
+class ControlNotFoundError(Exception):
+    """后端无关的“控件未找到”异常。"""
+
+
+class WindowAmbiguousError(Exception):
+    """后端无关的“匹配到多个窗口”异常。"""
+
+
+def spec_key(spec):
+    """将 CONTROLS_QC 中的定位信息转换为索引键 (class_name, found_index)。"""
+    return (spec.get("class_name"), spec.get("found_index", 0))
+
+
+def build_control_index(controls):
+    """
+    对一次枚举得到的后代控件建立 (class_name, found_index) -> 控件 的索引。
+
+    pywinauto 的 child_window(class_name=..., found_index=N) 就是在后代控件的枚举
+    顺序中取第 N 个同类控件，因此按枚举顺序对每个类名单独计数即可得到相同的结果。
+
+    :param controls: 按枚举顺序排列的控件序列，每个控件需提供 class_name() 方法
+    :return: 字典，键为 (class_name, found_index)，值为控件对象
+    """
+    index = {}
+    counters = {}
+    for ctrl in controls:
+        cls = ctrl.class_name()
+        n = counters.get(cls, 0)
+        counters[cls] = n + 1
+        index[(cls, n)] = ctrl
+    return index
+
+
+def fingerprint_from_class_names(class_names):
+    """由类名序列计算布局指纹：各类名的控件数量（排序后的元组，可哈希）。"""
+    return tuple(sorted(Counter(class_names).items()))
+
+
+class UIBackend:
+    """
+    UI 后端的基类。提取逻辑只使用以下方法：
+
+    - connect(title, timeout): 连接标题为 title 的顶层窗口并返回窗口对象
+    - descendants(dlg): 一次性枚举窗口的全部后代控件（按枚举顺序）
+    - window_handle(dlg): 顶层窗口句柄
+    - layout_fingerprint(dlg): 廉价的布局指纹，用于判断缓存的控件是否仍然有效
+    - find(dlg, spec, timeout): 按 CONTROLS_QC 中的定位信息查找单个控件
+    - resolve(dlg, spec): 查找并固定单个控件，之后重复读取时不再重新定位
+    - send_keys(keys): 向当前焦点发送按键
+
+    返回的窗口对象需提供 exists()、is_visible()、is_minimized()、restore()、set_focus()、wait()，
+    控件对象需提供 class_name()、window_text()、click_input()、set_focus()。
+    connect() 找不到窗口时抛出 ControlNotFoundError，匹配到多个窗口时抛出 WindowAmbiguousError。
+    """
+    # 子类可以追加各自的“未找到”异常类型，供调用方统一捕获
+    not_found_errors = (ControlNotFoundError,)
+
+    def connect(self, title, timeout=10):
+        raise NotImplementedError
+
+    def descendants(self, dlg):
+        raise NotImplementedError
+
+    def window_handle(self, dlg):
+        return dlg.handle
+
+    def layout_fingerprint(self, dlg):
+        return fingerprint_from_class_names(c.class_name() for c in self.descendants(dlg))
+
+    def find(self, dlg, spec, timeout=2):
+        raise NotImplementedError
+
+    def resolve(self, dlg, spec):
+        return self.find(dlg, spec, timeout=0)
+
+    def send_keys(self, keys):
+        raise NotImplementedError
+
+
+class PywinautoBackend(UIBackend):
+    """基于 pywinauto 的真实后端。pywinauto 在首次使用时才导入，便于在非 Windows 环境下加载本模块。"""
+
+    def __init__(self):
+        from pywinauto.findwindows import ElementNotFoundError
+        from pywinauto.keyboard import send_keys
+        self._send_keys = send_keys
+        self.not_found_errors = (ControlNotFoundError, ElementNotFoundError)
+
+    def connect(self, title, timeout=10):
+        from pywinauto import Application
+        from pywinauto.findwindows import ElementNotFoundError, ElementAmbiguousError
+        from pywinauto.timings import TimeoutError as PywinautoTimeoutError
+        try:
+            app = Application(backend="win32").connect(title=title, timeout=timeout)
+            return app.window(title=title)
+        except ElementAmbiguousError as e:
+            raise WindowAmbiguousError(str(e)) from e
+        except (ElementNotFoundError, PywinautoTimeoutError) as e:
+            raise ControlNotFoundError(str(e)) from e
+
+    def descendants(self, dlg):
+        return dlg.descendants()
+
+    def layout_fingerprint(self, dlg):
+        # 只读取句柄的类名，不为每个控件构造包装对象，比 descendants() 便宜得多
+        return fingerprint_from_class_names(
+            elem.class_name for elem in dlg.element_info.descendants()
+        )
+
+    def find(self, dlg, spec, timeout=2):
+        control = dlg.child_window(**spec)
+        if timeout:
+            control.wait('exists', timeout=timeout)
+        return control
+
+    def resolve(self, dlg, spec):
+        # WindowSpecification 每次访问都会重新查找，转换为包装对象后只按句柄读取
+        return dlg.child_window(**spec).wrapper_object()
+
+    def send_keys(self, keys):
+        self._send_keys(keys)
+
+
+# ================= 内存中的模拟窗口树 =================
+
+class FakeControl:
+    """内存中的模拟控件，接口与 pywinauto 的控件包装对象保持一致。"""
+
+    def __init__(self, class_name, text="", window=None):
+        self._class_name = class_name
+        self._text = text
+        self._window = window
+
+    def class_name(self):
+        return self._class_name
+
+    def window_text(self):
+        return self._text
+
+    def set_text(self, text):
+        self._text = text
+
+    def click_input(self):
+        if self._window is not None:
+            self._window.focused = self
+
+    def set_focus(self):
+        if self._window is not None:
+            self._window.focused = self
+
+
+class FakeWindow:
+    """
+    内存中的模拟窗口树。控件按枚举顺序保存，同类控件的序号即 found_index。
+
+    :param texts: 字典，键为 (class_name, found_index)，值为控件文本。
+                  每个类名会补齐到最大序号，未指定的控件文本为空。
+    :param title: 窗口标题
+    :param handle: 模拟的窗口句柄
+    """
+
+    def __init__(self, texts=None, title="首页录入", handle=1):
+        self.title = title
+        self.handle = handle
+        self.focused = None
+        self._controls = []
+        max_index = {}
+        for (cls, idx) in (texts or {}):
+            max_index[cls] = max(max_index.get(cls, -1), idx)
+        for cls, top in max_index.items():
+            for idx in range(top + 1):
+                self._controls.append(FakeControl(cls, (texts or {}).get((cls, idx), ""), self))
+
+    def descendants(self):
+        return list(self._controls)
+
+    def window_text(self):
+        return self.title
+
+    def exists(self, timeout=None):
+        return True
+
+    def is_visible(self):
+        return True
+
+    def is_minimized(self):
+        return False
+
+    def restore(self):
+        pass
+
+    def set_focus(self):
+        self.focused = None
+
+    def wait(self, state, timeout=None):
+        return self
+
+
+class FakeBackend(UIBackend):
+    """
+    驱动 FakeWindow 的后端。find() 与 pywinauto 一样在每次调用时重新遍历整棵控件树，
+    以便与单次枚举的索引模式做对比。
+
+    :param enum_delay: 每枚举一个控件所模拟的耗时（秒）
+    """
+
+    def __init__(self, enum_delay=0.0, windows=None):
+        self.enum_delay = enum_delay
+        self.enumerated = 0  # 累计枚举过的控件数，用于衡量遍历开销
+        self.windows = list(windows or [])
+
+    def connect(self, title, timeout=10):
+        matches = [w for w in self.windows if w.title == title]
+        if not matches:
+            raise ControlNotFoundError(f"找不到标题为 '{title}' 的窗口")
+        if len(matches) > 1:
+            raise WindowAmbiguousError(f"存在多个标题为 '{title}' 的窗口")
+        return matches[0]
+
+    def _walk(self, dlg):
+        for ctrl in dlg.descendants():
+            self.enumerated += 1
+            if self.enum_delay:
+                time.sleep(self.enum_delay)
+            yield ctrl
+
+    def descendants(self, dlg):
+        return list(self._walk(dlg))
+
+    def layout_fingerprint(self, dlg):
+        # pywinauto 中只读取类名的路径同样要遍历窗口的全部控件，按枚举计入开销
+        return fingerprint_from_class_names(c.class_name() for c in self._walk(dlg))
+
+    def find(self, dlg, spec, timeout=2):
+        cls, wanted = spec_key(spec)
+        n = 0
+        for ctrl in self._walk(dlg):
+            if ctrl.class_name() != cls:
+                continue
+            if n == wanted:
+                return ctrl
+            n += 1
+        raise ControlNotFoundError(f"未找到控件 {spec}")
+
+    def send_keys(self, keys):
+        for window in self.windows:
+            if window.focused is not None and hasattr(window, "send_keys"):
+                window.send_keys(keys)
+
+
+# ================= 控件句柄缓存 =================
+
+class ControlIndexCache:
+    """
+    跨多次质控复用的控件索引缓存。
+
+    以顶层窗口句柄为键，保存该窗口的布局指纹与 (class_name, found_index) -> 控件 索引。
+    “首页录入”窗口保持打开时布局不会变化，因此连续的病案可以跳过控件解析；
+    窗口重新打开（句柄变化）或布局指纹变化时自动重新建立索引。
+
+    :param max_windows: 最多缓存的窗口数量，超出时淘汰最久未使用的窗口
+    """
+
+    def __init__(self, max_windows=4):
+        self.max_windows = max_windows
+        self._entries = OrderedDict()  # {handle: (fingerprint, index)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_index(self, dlg, backend):
+        """返回窗口的控件索引，缓存有效时直接复用，否则重新枚举。"""
+        handle = backend.window_handle(dlg)
+        fingerprint = backend.layout_fingerprint(dlg)
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                if entry[0] == fingerprint:
+                    self.hits += 1
+                    self._entries.move_to_end(handle)
+                    return entry[1]
+                self.invalidations += 1
+                del self._entries[handle]
+            self.misses += 1
+
+        index = build_control_index(backend.descendants(dlg))
+        with self._lock:
+            self._entries[handle] = (fingerprint, index)
+            self._entries.move_to_end(handle)
+            while len(self._entries) > self.max_windows:
+                self._entries.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回命中统计，形如 {'hits': int, 'misses': int, 'invalidations': int, 'windows': int}。"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'windows': len(self._entries),
+            }
+
+
+_CONTROL_CACHE = ControlIndexCache()
+
+
+def get_control_index(dlg, backend):
+    """通过全局缓存获取窗口的控件索引。"""
+    return _CONTROL_CACHE.get_index(dlg, backend)
+
+
+def get_cache_stats():
+    """返回全局控件缓存的命中/未命中计数。"""
+    return _CONTROL_CACHE.stats()
+
+
+def clear_control_cache():
+    _CONTROL_CACHE.clear()
+
+
+_DEFAULT_BACKEND = None
+
+
+def get_backend():
+    """返回默认后端（pywinauto），首次调用时创建。"""
+    global _DEFAULT_BACKEND
+    if _DEFAULT_BACKEND is None:
+        _DEFAULT_BACKEND = PywinautoBackend()
+    return _DEFAULT_BACKEND
+
+
+def set_backend(backend):
+    """替换默认后端，例如在性能测试中换成模拟后端。"""
+    global _DEFAULT_BACKEND
+    _DEFAULT_BACKEND = backend
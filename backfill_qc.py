@@ -0,0 +1,269 @@
+# backfill_qc.py
+# 历史回填：新增或修改校验规则后，用当前规则重新校验历史中保存的全部记录，并改写各字段的“质控”状态列，
+# 使科室统计与当前规则一致，而不必在 HIS 中重新打开每份病案。
+# 记录由进程池分块校验（与 batch_qc 相同），每写完一块就保存检查点，中断后再次运行会从检查点继续。
+# 回填 CSV 时会替换 records.csv，因此质控程序正在运行（占用着历史文件）时拒绝回填，回填期间质控程序的保存会等待回填完成。
+#
+#   python backfill_qc.py                    # 回填 %AppData%\Roaming\autoqc 下的历史（CSV 或 SQLite，见 history_qc.HISTORY_BACKEND）
+#   python backfill_qc.py --workers 8 --chunk-size 1000
+#   python backfill_qc.py --restart          # 忽略已有的检查点，从头开始
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+from output import set_quiet
+import history_qc
+from history_qc import build_header, format_row, record_from_row, get_csv_path, flush_history
+from history_index_qc import BOM, encode_rows, scan_rows, parse_line
+from columnar_qc import validate_batch
+from batch_qc import init_worker
+from rollup_qc import rebuild_rollups
+import validator_qc
+
+DEFAULT_CHUNK_SIZE = 1000
+CHECKPOINT_SUFFIX = '.backfill.json'
+OUTPUT_SUFFIX = '.backfill'
+
+
+def revalidate_rows(rows, header):
+    """
+    用当前规则重新校验若干历史行，返回改写后的数据行（使用当前表头，保留原来的病案号与运行日期）。
+    状态为“未读取”的字段还原为 NOT_READ，validate_batch 对这些记录逐条校验并跳过读取它们的规则，
+    因此未读取的字段和依赖它们的规则保持原来的状态。
+
+    :param rows: 历史数据行
+    :param header: 这些行对应的表头
+    """
+    records = [record_from_row(row, header) for row in rows]
+    new_rows = []
+    for row, record, (validation_results, case_number, _) in zip(rows, records, validate_batch(records)):
+        _, new_row = format_row(record, validation_results, case_number)
+        new_row[1] = row[1] if len(row) > 1 else new_row[1]
+        new_rows.append(new_row)
+    return new_rows
+
+
+def _revalidate_chunk(task):
+    """工作进程：task 为 (块标识, 表头, 数据行列表)，返回 (块标识, 改写后的数据行)。"""
+    key, header, rows = task
+    return key, revalidate_rows(rows, header)
+
+
+def _map_chunks(tasks, workers):
+    """按顺序返回各块的处理结果；workers 为 1 时在当前进程中执行。"""
+    if workers <= 1:
+        previous = set_quiet(True)
+        try:
+            for task in tasks:
+                yield _revalidate_chunk(task)
+        finally:
+            set_quiet(previous)
+        return
+    disabled = {rule.name for rule in validator_qc.RULES if not rule.enabled}
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(disabled,)) as pool:
+        yield from pool.imap(_revalidate_chunk, tasks)
+
+
+class Checkpoint:
+    """回填进度，保存为 JSON 文件；每处理完一块写入一次（先写临时文件再替换）。"""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.state = {}
+        return self.state
+
+    def save(self, **state):
+        self.state.update(state)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.state = {}
+
+
+class _Progress:
+    def __init__(self, done=0, interval=2.0):
+        self.start = time.perf_counter()
+        self.done = 0
+        self.resumed = done
+        self.interval = interval
+        self._last = self.start
+
+    def add(self, count, total=None):
+        self.done += count
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report(total)
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed else 0.0
+
+    def report(self, total=None, final=False):
+        finished = self.resumed + self.done
+        total_text = f"/{total}" if total else ""
+        prefix = "回填完成" if final else "回填中"
+        print(f"{prefix}：{finished}{total_text} 条，本次 {self.done} 条，{self.rate():.0f} 条/秒。", flush=True)
+
+
+def backfill_csv(path=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, restart=False):
+    """
+    回填 records.csv：改写后的记录写入 records.csv.backfill，全部完成后替换原文件。
+    检查点记录已处理到原文件的哪个字节位置、输出文件写到多长，中断后从该位置继续。
+    回填期间本进程追加到原文件的新记录（已按当前规则校验）在最后原样接到输出文件末尾。
+    历史文件被其他进程（正在运行的质控程序）占用时不回填。
+
+    :return: 本次回填的记录数
+    """
+    path = path or get_csv_path()
+    flush_history()
+    if not history_qc.acquire_history_lock(path, wait=False):
+        print("历史文件正被质控程序使用，请先关闭质控程序再回填。")
+        return 0
+    try:
+        return _backfill_csv(path, workers or os.cpu_count() or 1, chunk_size, restart)
+    finally:
+        history_qc.release_history_lock(path)
+
+
+def _backfill_csv(path, workers, chunk_size, restart):
+    """backfill_csv 的主体，调用时已占用历史文件。"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        print("没有可回填的历史记录。")
+        return 0
+
+    out_path = path + OUTPUT_SUFFIX
+    checkpoint = Checkpoint(path + CHECKPOINT_SUFFIX)
+    state = {} if restart else checkpoint.load()
+    source_size = os.path.getsize(path)
+    if state and (state.get('source_size', 0) > source_size or not os.path.exists(out_path)
+                  or os.path.getsize(out_path) < state.get('out_bytes', 0)):
+        print("检查点与历史文件不一致，从头开始回填。")
+        state = {}
+
+    new_header = build_header()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        header_row = next(scan_rows(buf, len(BOM) if buf[:len(BOM)] == BOM else 0, source_size), None)
+        if header_row is None:
+            print("没有可回填的历史记录。")
+            return 0
+        header = parse_line(buf[header_row[0]:header_row[1]])
+
+        if state:
+            source_size = state['source_size']
+            position = state['in_offset']
+            out = open(out_path, 'r+b')
+            out.truncate(state['out_bytes'])
+            out.seek(state['out_bytes'])
+            print(f"从检查点继续：已回填 {state['rows_done']} 条。")
+        else:
+            position = header_row[1]
+            out = open(out_path, 'wb')
+            out.write(BOM + encode_rows([new_header])[0])
+            state = {'source_size': source_size, 'rows_done': 0}
+            checkpoint.save(**state, in_offset=position, out_bytes=out.tell())
+
+        def tasks():
+            chunk = []
+            for start, end in scan_rows(buf, position, source_size):
+                chunk.append(parse_line(buf[start:end]))
+                if len(chunk) >= chunk_size:
+                    yield end, header, chunk
+                    chunk = []
+            if chunk:
+                yield source_size, header, chunk
+
+        progress = _Progress(state['rows_done'])
+        try:
+            for end, rows in _map_chunks(tasks(), workers):
+                out.write(b''.join(encode_rows(rows)))
+                out.flush()
+                os.fsync(out.fileno())
+                state['rows_done'] += len(rows)
+                checkpoint.save(in_offset=end, out_bytes=out.tell(), rows_done=state['rows_done'])
+                progress.add(len(rows))
+        finally:
+            out.close()
+
+    # 回填期间新追加的记录原样保留
+    flush_history()
+    with open(out_path, 'ab') as out, open(path, 'rb') as f:
+        f.seek(source_size)
+        out.write(f.read())
+    os.replace(out_path, path)
+    history_qc.reload_history(path)
+    checkpoint.clear()
+    progress.report(final=True)
+    return progress.done
+
+
+def backfill_sqlite(workers=None, chunk_size=DEFAULT_CHUNK_SIZE, restart=False):
+    """
+    回填 SQLite 历史记录库：按记录编号顺序逐块改写，检查点为已处理到的最大记录编号。
+
+    :return: 本次回填的记录数
+    """
+    workers = workers or os.cpu_count() or 1
+    flush_history()
+    store = history_qc.get_history_store()
+    checkpoint = Checkpoint(store.path + CHECKPOINT_SUFFIX)
+    state = {} if restart else checkpoint.load()
+    after_id = state.get('last_id', 0)
+    if after_id:
+        print(f"从检查点继续：已回填 {state.get('rows_done', 0)} 条。")
+    header = build_header()
+    total = store.count()
+
+    def tasks():
+        for batch in store.iter_rows(after_id, chunk_size):
+            yield [run_id for run_id, _ in batch], header, [row for _, row in batch]
+
+    progress = _Progress(state.get('rows_done', 0))
+    rows_done = state.get('rows_done', 0)
+    for ids, rows in _map_chunks(tasks(), workers):
+        store.replace_rows([(run_id, header, row) for run_id, row in zip(ids, rows)])
+        rows_done += len(rows)
+        checkpoint.save(last_id=ids[-1], rows_done=rows_done)
+        progress.add(len(rows), total)
+    checkpoint.clear()
+    progress.report(total, final=True)
+    return progress.done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用当前规则重新校验全部历史记录并改写质控状态")
+    parser.add_argument("--path", help="历史 CSV 文件，默认为 autoqc 目录下的 records.csv")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认使用全部 CPU 核心")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每块的记录数（也是检查点的间隔）")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点，从头开始")
+    args = parser.parse_args(argv)
+
+    if history_qc.HISTORY_BACKEND == "sqlite" and not args.path:
+        backfill_sqlite(args.workers, args.chunk_size, args.restart)
+    else:
+        backfill_csv(args.path, args.workers, args.chunk_size, args.restart)
+    if history_qc.ROLLUPS_ENABLED and not args.path:
+        # 质控状态已改写，汇总统计随之重建
+        rebuild_rollups()
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# batch_qc.py
+# 批量校验：对 HIS 导出的大量首页记录（例如一个月的出院病案）做回顾性质控。
+# 记录按块分发到进程池，每个工作进程只在启动时加载一次校验规则，逐条日志在批量模式下关闭。
+#
+#   python batch_qc.py records.jsonl --workers 8 --output results.jsonl
+#   python batch_qc.py export.csv --workers 4
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from output import set_quiet
+from extractor_qc import FRIENDLY_CONTROL_NAMES
+from columnar_qc import validate_batch
+import validator_qc
+
+DEFAULT_CHUNK_SIZE = 2048
+
+# 计入问题统计的级别（“注意”不计入，与报告一致）
+ISSUE_LEVELS = ("错误", "逻辑错误", "警告")
+
+
+def compact_result(validation_results, case_number, check_count):
+    """
+    把单条记录的校验结果压缩为便于跨进程传输的元组。
+
+    :return: (病案号, 检查项数量, [(级别, 字段, 说明), ...])
+    """
+    issues = [(item['level'], item['field'], item['message']) for item in validation_results]
+    return (case_number, check_count, issues)
+
+
+def _validate_chunk(chunk):
+    """在当前进程中校验一块记录（列式引擎，未安装 NumPy 时逐条校验），返回压缩后的结果列表。"""
+    return [compact_result(*result) for result in validate_batch(chunk)]
+
+
+def init_worker(disabled_rules):
+    """工作进程初始化：关闭逐条日志，并同步主进程中停用的规则（spawn 方式启动时规则状态不会继承）。"""
+    set_quiet(True)
+    for rule in validator_qc.RULES:
+        rule.enabled = rule.name not in disabled_rules
+
+
+def _chunks(records, size):
+    iterator = iter(records)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_validate_many(records, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    分块校验大量记录，按输入顺序逐块返回结果。
+
+    :param records: 记录字典的可迭代对象（可以是生成器，不需要一次性载入内存）
+    :param workers: 工作进程数，None 表示使用全部 CPU 核心，1 表示在当前进程中执行
+    :param chunk_size: 每块的记录数，块越大进程间通信的开销越小
+    :return: 生成器，每次产出一块记录的压缩结果列表（见 compact_result）
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunks(records, chunk_size)
+    if workers <= 1:
+        previous = set_quiet(True)
+        try:
+            for chunk in chunks:
+                yield _validate_chunk(chunk)
+        finally:
+            set_quiet(previous)
+        return
+
+    disabled = {rule.name for rule in validator_qc.RULES if not rule.enabled}
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(disabled,)) as pool:
+        # imap 按顺序返回，同时只在内存中保留有限的块
+        for results in pool.imap(_validate_chunk, chunks):
+            yield results
+
+
+def validate_many(records, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    批量校验记录，返回与输入顺序一致的压缩结果列表。参数同 iter_validate_many。
+
+    每条结果与对同一记录调用 validator_qc.validate_data() 得到的问题、病案号和检查项数量一致。
+    """
+    results = []
+    for chunk_results in iter_validate_many(records, workers, chunk_size):
+        results.extend(chunk_results)
+    return results
+
+
+# ================= 命令行 =================
+
+def _field_key(column):
+    """CSV 表头可以是字段键名，也可以是界面显示的中文名称。"""
+    if column in FRIENDLY_CONTROL_NAMES or column == 'case_number_verify':
+        return column
+    return _FRIENDLY_TO_KEY.get(column, column)
+
+
+_FRIENDLY_TO_KEY = {}
+for _key, _name in FRIENDLY_CONTROL_NAMES.items():
+    _FRIENDLY_TO_KEY.setdefault(_name, _key)
+
+
+def load_records(path):
+    """
+    逐条读取导出的记录。支持：
+    - .jsonl：每行一个 JSON 对象
+    - .json：JSON 数组
+    - .csv：第一行为表头（字段键名或中文名称），每行一条记录（不含手术列表）
+    """
+    lower = path.lower()
+    if lower.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    elif lower.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            yield from json.load(f)
+    elif lower.endswith('.csv'):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                record = {_field_key(k): v for k, v in row.items() if k}
+                if 'case_number_verify' not in record and 'case_number' in record:
+                    record['case_number_verify'] = record['case_number']
+                yield record
+    else:
+        raise ValueError(f"不支持的文件格式: {path}（支持 .jsonl / .json / .csv）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="首页记录批量质控")
+    parser.add_argument("input", help="导出的记录文件（.jsonl / .json / .csv）")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认使用全部 CPU 核心")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每块的记录数")
+    parser.add_argument("--output", help="把每条记录的结果写入 JSONL 文件")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = 0
+    issue_count = 0
+    records_with_issues = 0
+    out = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for chunk_results in iter_validate_many(load_records(args.input), args.workers, args.chunk_size):
+            for case_number, check_count, issues in chunk_results:
+                count += 1
+                serious = sum(1 for level, _, _ in issues if level in ISSUE_LEVELS)
+                issue_count += serious
+                records_with_issues += 1 if serious else 0
+                if out:
+                    out.write(json.dumps({'case_number': case_number, 'checks': check_count,
+                                          'issues': issues}, ensure_ascii=False) + '\n')
+    finally:
+        if out:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"共校验 {count} 条记录，其中 {records_with_issues} 条存在问题（错误/警告共 {issue_count} 个），"
+          f"耗时 {elapsed:.2f} 秒，{count / elapsed if elapsed else 0:.0f} 条/秒。")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,286 @@
+# bench_qc.py
+# 离线提取性能测试：在模拟的“首页录入”窗口上测量提取吞吐量与尾延迟，可在 Linux CI 上运行。
+#
+#   python bench_qc.py --runs 20 --call-latency 0.0005 --enum-latency 0.00002
+#   python bench_qc.py --compare                     # 对比逐字段定位与索引模式
+#   python bench_qc.py --max-p95-ms 800 --check      # 作为回归测试：超时、数据不一致或下方的回归检查失败时返回非零
+#   python bench_qc.py --replay pages/*.json.gz --speed 10 --check   # 回放录制的界面快照（见 replay_qc）
+import argparse
+import sys
+import time
+
+from ui_map_qc import CONTROLS_QC
+from backend_qc import clear_control_cache
+from sim_qc import Latency, SimulatedBackend, SimulatedWindow, OPERATION_KEYS
+import extractor_qc
+
+
+def load_records():
+    """测试记录：主测试数据集加上额外测试用例。"""
+    from test_data import get_test_data, get_additional_test_cases
+    return [get_test_data()] + get_additional_test_cases()
+
+
+def expected_value(record, key):
+    value = record.get(key)
+    return "" if value is None else str(value).strip()
+
+
+def diff_extracted(record, extracted):
+    """返回提取结果与源记录不一致的字段列表。"""
+    mismatches = []
+    for key, spec in CONTROLS_QC.items():
+        if key in OPERATION_KEYS or key == "case_number":
+            continue
+        # 与其他字段共用同一控件的键（如其他诊断）以先定义者为准，不做比较
+        owner = next(k for k, s in CONTROLS_QC.items() if s == spec)
+        if owner != key:
+            continue
+        if (extracted.get(key) or "") != expected_value(record, key):
+            mismatches.append(key)
+    expected_ops = [
+        {k: expected_value(op, k) for k in OPERATION_KEYS}
+        for op in (record.get("operations") or [])
+    ]
+    # 键盘遍历以“整行为空”或“与上一行相同”判断结束，源数据中的此类行无法区分
+    trimmed = []
+    for op in expected_ops:
+        if not any(op.values()) or (trimmed and op == trimmed[-1]):
+            break
+        trimmed.append(op)
+    if extracted.get("operations") != trimmed:
+        mismatches.append("operations")
+    return mismatches
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def run_benchmark(records, runs, use_index, call_latency, enum_latency, key_latency, seed=0):
+    """
+    对每条记录重复提取 runs 次，返回 (每次耗时列表, 不一致的字段集合)。
+    同一窗口的连续提取会命中控件缓存，与自动模式下窗口保持打开的情形一致。
+    """
+    timings = []
+    mismatches = set()
+    clear_control_cache()
+    for i, record in enumerate(records):
+        window = SimulatedWindow(
+            record,
+            call_latency=Latency(**call_latency, seed=seed + i),
+            enum_latency=Latency(**enum_latency, seed=seed + 1000 + i),
+            key_latency=key_latency,
+            handle=i + 1,
+        )
+        backend = SimulatedBackend([window])
+        for _ in range(runs):
+            window.in_grid = False
+            window._row = 0
+            start = time.perf_counter()
+            extracted = extractor_qc.extract_all_data(window, backend=backend, use_index=use_index)
+            timings.append(time.perf_counter() - start)
+            mismatches.update(diff_extracted(record, extracted))
+    return timings, mismatches
+
+
+def run_replay(paths, runs, speed):
+    """
+    回放录制的界面快照，端到端测量提取与校验，返回 (提取耗时列表, 端到端耗时列表, 提取结果与录制时不一致的快照)。
+    """
+    from replay_qc import load_replay
+    from validator_qc import validate_data
+    extract_timings = []
+    total_timings = []
+    changed = []
+    clear_control_cache()
+    for i, path in enumerate(paths):
+        window, backend, snapshot = load_replay(path, speed=speed, handle=i + 1)
+        expected = snapshot.get("extracted")
+        for _ in range(runs):
+            window.in_grid = False
+            window._row = 0
+            start = time.perf_counter()
+            extracted = extractor_qc.extract_all_data(window, backend=backend)
+            extracted_at = time.perf_counter()
+            validate_data(extracted)
+            extract_timings.append(extracted_at - start)
+            total_timings.append(time.perf_counter() - start)
+            normalized = {k: (None if v is extractor_qc.NOT_READ else v) for k, v in extracted.items()}
+            if expected is not None and normalized != expected and path not in changed:
+                changed.append(path)
+    return extract_timings, total_timings, changed
+
+
+# ================= 回归检查（--check 时运行） =================
+# 每个检查返回失败说明的列表，空列表表示通过。
+
+def with_not_read(records):
+    """在测试记录的基础上构造部分字段为 NOT_READ 的记录（手术列表、麻醉费、身份证号轮流未读取）。"""
+    variants = []
+    for i, record in enumerate(records * 3):
+        record = dict(record)
+        if i % 3 == 0:
+            record["operations"] = extractor_qc.NOT_READ
+        if i % 4 == 0:
+            record["anesthesia_fee"] = extractor_qc.NOT_READ
+        if i % 5 == 0:
+            record["id_card_number"] = extractor_qc.NOT_READ
+        variants.append(record)
+    return variants
+
+
+def check_batch_not_read():
+    """含 NOT_READ 字段的记录，批量校验与逐条校验的结果相同。"""
+    from validator_qc import validate_data
+    from columnar_qc import validate_batch
+    records = with_not_read(load_records())
+    expected = [validate_data(r) for r in records]
+    actual = validate_batch(records)
+    return [f"批量校验第 {i + 1} 条记录与 validate_data 不一致" for i, (a, e) in enumerate(zip(actual, expected)) if a != e]
+
+
+def check_backfill_not_read():
+    """含“未读取”字段的历史行按当前规则回填后，各字段的质控状态不变。"""
+    from validator_qc import validate_data
+    from history_qc import build_header, format_row
+    from backfill_qc import revalidate_rows
+    header = build_header()
+    rows = []
+    for record in with_not_read(load_records()):
+        results, case_number, _ = validate_data(record)
+        rows.append(format_row(record, results, case_number)[1])
+    failures = []
+    for i, (row, new_row) in enumerate(zip(rows, revalidate_rows(rows, header))):
+        changed = [header[j] for j, (old, new) in enumerate(zip(row, new_row)) if old != new]
+        if changed:
+            failures.append(f"回填后第 {i + 1} 行的 {', '.join(changed)} 发生变化")
+    return failures
+
+
+def check_many_operations():
+    """默认提取预算下，8 条与 12 条手术（每次按键 0.1 秒后刷新）都能完整读取。"""
+    record = load_records()[0]
+    operation = record["operations"][0]
+    failures = []
+    clear_control_cache()
+    for count in (8, 12):
+        case = dict(record, operations=[dict(operation, operation_code=f"X{i:03d}") for i in range(count)])
+        window = SimulatedWindow(case, key_latency=0.1, handle=9000 + count)
+        extracted = extractor_qc.extract_all_data(window, backend=SimulatedBackend([window]))
+        operations = extracted["operations"]
+        if operations is extractor_qc.NOT_READ or len(operations) != count:
+            failures.append(f"{count} 条手术只读取到 {operations if operations is extractor_qc.NOT_READ else len(operations)}")
+    return failures
+
+
+def check_fingerprint_fields():
+    """修改任一启用的规则读取的界面字段（手术列表除外）都会改变页面指纹。"""
+    from validator_qc import checked_fields
+    record = load_records()[0]
+    clear_control_cache()
+    window = SimulatedWindow(record, handle=9100)
+    baseline = extractor_qc.page_fingerprint(window, SimulatedBackend([window]))
+    failures = []
+    owners = {}
+    for key in sorted(checked_fields()):
+        if key in CONTROLS_QC and key not in OPERATION_KEYS:
+            # 与其他字段共用同一控件的键，修改的是先定义者的控件
+            spec = CONTROLS_QC[key]
+            owners.setdefault(next(k for k, s in CONTROLS_QC.items() if s == spec), key)
+    for handle, (owner, key) in enumerate(sorted(owners.items()), start=9101):
+        edited = dict(record, **{owner: expected_value(record, owner) + "改"})
+        window = SimulatedWindow(edited, handle=handle)
+        if extractor_qc.page_fingerprint(window, SimulatedBackend([window])) == baseline:
+            failures.append(f"修改规则字段 {key} 后页面指纹不变")
+    return failures
+
+
+REGRESSION_CHECKS = [
+    check_batch_not_read,
+    check_backfill_not_read,
+    check_many_operations,
+    check_fingerprint_fields,
+]
+
+
+def run_regression_checks():
+    """运行全部回归检查并打印失败项，返回是否全部通过。"""
+    passed = True
+    for check in REGRESSION_CHECKS:
+        failures = check()
+        for message in failures:
+            print(f"{check.__name__}: {message}")
+        passed = passed and not failures
+    return passed
+
+
+def summarize(label, timings):
+    total = sum(timings)
+    print(f"{label}: {len(timings)} 次提取，吞吐量 {len(timings) / total if total else 0:.2f} 条/秒，"
+          f"p50 {percentile(timings, 50) * 1000:.1f} ms，p95 {percentile(timings, 95) * 1000:.1f} ms，"
+          f"p99 {percentile(timings, 99) * 1000:.1f} ms，最大 {max(timings) * 1000:.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="首页提取离线性能测试")
+    parser.add_argument("--runs", type=int, default=5, help="每条记录的提取次数")
+    parser.add_argument("--call-latency", type=float, default=0.0, help="每次读取控件的固定延迟（秒）")
+    parser.add_argument("--call-jitter", type=float, default=0.0, help="读取控件延迟的平均抖动（秒）")
+    parser.add_argument("--stall-prob", type=float, default=0.0, help="读取控件时出现停顿的概率")
+    parser.add_argument("--stall", type=float, default=0.0, help="停顿的时长（秒）")
+    parser.add_argument("--enum-latency", type=float, default=0.0, help="枚举每个控件的延迟（秒）")
+    parser.add_argument("--key-latency", type=float, default=0.0, help="按键后界面刷新所需时间（秒）")
+    parser.add_argument("--compare", action="store_true", help="同时测试逐字段定位模式")
+    parser.add_argument("--check", action="store_true", help="提取结果与源记录不一致时返回非零")
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="p95 超过该值时返回非零")
+    parser.add_argument("--replay", nargs="+", metavar="FILE", help="回放录制的界面快照，代替内置测试数据")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数（1 为录制时的速度，0 为不加延迟）")
+    parser.add_argument("--verbose", action="store_true", help="显示提取过程日志")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        from output import logger
+        logger.disabled = True
+
+    if args.replay:
+        extract_timings, total_timings, changed = run_replay(args.replay, args.runs, args.speed)
+        summarize("回放提取", extract_timings)
+        summarize("回放提取+校验", total_timings)
+        failed = False
+        if changed:
+            print(f"以下快照的提取结果与录制时不一致: {', '.join(changed)}")
+            failed = args.check
+        if args.max_p95_ms is not None and percentile(total_timings, 95) * 1000 > args.max_p95_ms:
+            print(f"回放: p95 超过上限 {args.max_p95_ms} ms")
+            failed = True
+        return 1 if failed else 0
+
+    call_latency = dict(base=args.call_latency, jitter=args.call_jitter,
+                        stall_prob=args.stall_prob, stall=args.stall)
+    enum_latency = dict(base=args.enum_latency)
+    records = load_records()
+
+    modes = [(False, "逐字段定位"), (True, "索引模式")] if args.compare else [(True, "索引模式")]
+    failed = False
+    for use_index, label in modes:
+        timings, mismatches = run_benchmark(records, args.runs, use_index, call_latency,
+                                            enum_latency, args.key_latency)
+        summarize(label, timings)
+        if mismatches:
+            print(f"{label}: 以下字段的提取结果与源记录不一致: {', '.join(sorted(mismatches))}")
+            failed = failed or args.check
+        if args.max_p95_ms is not None and percentile(timings, 95) * 1000 > args.max_p95_ms:
+            print(f"{label}: p95 超过上限 {args.max_p95_ms} ms")
+            failed = True
+    if args.check and not run_regression_checks():
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# cache_qc.py
+# 自动模式的已质控病案缓存：{病案号: 页面指纹}。
+# 容量有上限（超过后淘汰最久未出现的病案），超过有效期未再出现的病案自动失效；
+# 缓存保存在 autoqc 目录下（与 records.csv 相同），程序重启后首次使用时再读取。
+import json
+import os
+import time
+from collections import OrderedDict
+
+from output import warning
+from history_qc import get_csv_path
+
+CACHE_FILE_NAME = 'checked_cases.json'
+DEFAULT_MAX_SIZE = 500
+DEFAULT_TTL = 12 * 3600  # 一个班次
+
+
+def get_cache_path():
+    """返回缓存文件的完整路径（%AppData%\\Roaming\\autoqc\\checked_cases.json）。"""
+    return os.path.join(os.path.dirname(get_csv_path()), CACHE_FILE_NAME)
+
+
+class CheckedCaseCache:
+    """
+    带容量上限和有效期的 LRU 缓存，查找、写入均为 O(1)。
+
+    条目按最近出现的时间排序：每次命中或写入都把条目移到末尾并刷新时间，
+    因此过期的条目总是集中在开头，淘汰时只需从开头依次弹出。
+
+    :param path: 持久化文件路径，None 表示使用 get_cache_path()，空字符串表示不持久化
+    :param max_size: 最多保存的病案数
+    :param ttl: 有效期（秒），超过这么久未再出现的病案视为未质控
+    """
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.path = get_cache_path() if path is None else path
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {病案号: (页面指纹, 最近出现的时间)}
+        self._loaded = False
+        self._dirty = False
+
+    def __len__(self):
+        self._load()
+        self._evict(time.time())
+        return len(self._entries)
+
+    def get(self, case_number):
+        """返回病案上次质控时的页面指纹；未质控或已过期时返回 None。命中时刷新该病案的时间。"""
+        self._load()
+        now = time.time()
+        self._evict(now)
+        entry = self._entries.get(case_number)
+        if entry is None:
+            return None
+        self._entries[case_number] = (entry[0], now)
+        self._entries.move_to_end(case_number)
+        self._dirty = True
+        return entry[0]
+
+    def put(self, case_number, fingerprint):
+        """记录病案的页面指纹并立即保存。"""
+        self._load()
+        now = time.time()
+        self._entries[case_number] = (fingerprint, now)
+        self._entries.move_to_end(case_number)
+        self._evict(now)
+        self._dirty = True
+        self.save()
+
+    def _evict(self, now):
+        while self._entries:
+            _, (_, seen) = next(iter(self._entries.items()))
+            if now - seen <= self.ttl and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+            self._dirty = True
+
+    # ---- 持久化 ----
+
+    def _load(self):
+        """首次使用时从文件读取缓存；文件不存在或损坏时从空缓存开始。"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            # 文件中按时间先后保存
+            for case_number, fingerprint, seen in entries:
+                self._entries[case_number] = (fingerprint, float(seen))
+        except Exception as e:
+            warning(f"读取已质控病案缓存失败，将重新开始记录: {e}")
+            self._entries.clear()
+        self._evict(time.time())
+
+    def save(self):
+        """把缓存写入文件（先写临时文件再替换，避免中途退出留下损坏的文件）。"""
+        if not self.path or not self._dirty:
+            return
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump([[k, fp, seen] for k, (fp, seen) in self._entries.items()], f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._dirty = False
+        except Exception as e:
+            warning(f"保存已质控病案缓存失败: {e}")
@@ -0,0 +1,549 @@
+# columnar_qc.py
+# 列式校验引擎：批量质控时把一批记录按字段转换为（字典编码的）NumPy 数组，取值集合类规则用向量化的掩码
+# 一次算完整批记录，得到每条记录的问题位图；只有命中的 (记录, 规则) 才调用原规则函数生成报告文本，
+# 因此问题内容与逐条校验（validator_qc.validate_data）完全一致。
+# 其余只依赖输入字段的规则按输入取值的组合分组，每种组合只调用一次规则函数（见 validate_batch）。
+#
+# NumPy 为可选依赖：未安装时 validate_batch() 自动退回逐条校验。
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+import time
+
+from history_qc import MAIN_FIELDS
+from validator_qc import (RULES, REQUIRED_FIELDS, PHONE_REGEX, ZIP_CODE_REGEX, ID_CARD_REGEX, ID_CARD_WEIGHTS,
+                          ID_CARD_CHECK_CHARS, GENDER_PARITY, get_rule, validate_data,
+                          is_simple_sequence, id_card_check_char)
+from extractor_qc import get_friendly_name, NOT_READ
+
+
+class _Encoder(dict):
+    """为每个新出现的取值分配一个递增的编码。"""
+
+    def __missing__(self, key):
+        code = self[key] = len(self)
+        return code
+
+
+class _Unhashable:
+    """不可哈希的取值（例如列表）统一编码为这个标记，这类记录一律逐条校验。"""
+
+
+_UNHASHABLE = _Unhashable()
+
+
+def _hashable_key(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return _UNHASHABLE
+
+
+class Column:
+    """
+    字典编码的一列：codes[i] 为第 i 条记录的取值在 uniques 中的序号。
+    首页字段的取值高度重复（代码、是/否、医师姓名），判断只需对每个不同取值做一次，
+    再按 codes 展开到整列。None 与空串在所有列式规则中含义相同，统一按空串判断。
+    """
+
+    def __init__(self, codes, uniques):
+        self.codes = codes
+        self.uniques = uniques
+        self.texts = ["" if u is None else u for u in uniques]
+
+    def mask(self, predicate):
+        """对每个不同取值求一次 predicate(text)，返回整列的布尔数组。"""
+        table = np.fromiter((bool(predicate(t)) for t in self.texts), dtype=bool, count=len(self.texts))
+        return table[self.codes]
+
+    def batch_mask(self, func):
+        """func 接收全部不同取值组成的字符串数组并返回布尔数组（例如 simple_sequence_mask），结果展开到整列。"""
+        texts = np.array([t if type(t) is str else "" for t in self.texts], dtype=str)
+        return np.asarray(func(texts), dtype=bool)[self.codes]
+
+    def isin(self, values):
+        values = frozenset(values)
+        return self.mask(lambda t: type(t) is str and t in values)
+
+    def invalid(self):
+        """取值既不是字符串也不是 None 的记录（例如 NOT_READ、数字）。"""
+        return self.mask(lambda t: type(t) is not str)
+
+
+class ColumnBatch:
+    """
+    一批记录的列式视图。字段在第一次使用时才转换为编码数组（Column），
+    MAIN_FIELDS 中的任意字段都可以按需加载。
+
+    记录中的值不是字符串或 None 时（例如 NOT_READ 或数字），该记录标记为 fallback，
+    由调用方改用逐条校验，以保证结果与标量引擎一致。
+
+    :param records: 记录字典列表
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.size = len(records)
+        self.fallback = np.zeros(self.size, dtype=bool)
+        self._columns = {}
+        self._floats = {}
+
+    def load(self, fields=None):
+        """一次加载多个字段，默认加载 history_qc.MAIN_FIELDS。"""
+        for field in (MAIN_FIELDS if fields is None else fields):
+            self.column(field)
+        return self
+
+    def column(self, field):
+        """返回字段的编码列。"""
+        col = self._columns.get(field)
+        if col is None:
+            encoder = _Encoder()
+            try:
+                codes = [encoder[r.get(field)] for r in self.records]
+            except TypeError:
+                encoder = _Encoder()
+                codes = [encoder[_hashable_key(r.get(field))] for r in self.records]
+            col = Column(np.fromiter(codes, dtype=np.int32, count=self.size), list(encoder))
+            self.fallback |= col.invalid()
+            self._columns[field] = col
+        return col
+
+    def loaded_fields(self):
+        """已加载为编码列的字段。"""
+        return set(self._columns)
+
+    def floats(self, field):
+        """
+        把字段解析为浮点数组（每个不同的取值只解析一次），返回 (数值, 是否为有效数字)。
+        解析规则与 float() 相同，无效的数字记为 NaN 且 valid 为 False。
+        """
+        cached = self._floats.get(field)
+        if cached is None:
+            col = self.column(field)
+            parsed = np.full(len(col.texts), np.nan)
+            ok = np.zeros(len(col.texts), dtype=bool)
+            for k, text in enumerate(col.texts):
+                if type(text) is not str:
+                    continue
+                try:
+                    parsed[k] = float(text)
+                    ok[k] = True
+                except ValueError:
+                    pass
+            cached = (parsed[col.codes], ok[col.codes])
+            self._floats[field] = cached
+        return cached
+
+    def isin(self, field, values):
+        return self.column(field).isin(values)
+
+    def is_empty(self, field):
+        return self.isin(field, [""])
+
+
+# ================= 批量简单序列检测 =================
+
+def simple_sequence_mask(values, threshold=6):
+    """
+    is_simple_sequence 的批量版本：一次检查整个字符串数组，返回布尔数组，结果与逐个调用完全一致。
+
+    把字符串视为码点矩阵，只在数字位置上计算与前一个数字的差值（非数字位置被跳过，
+    相当于先去掉非数字），再用累计最大值求出以每个数字结尾的重复/升序/降序连续段长度。
+    含有非 ASCII 字符（可能是全角等 Unicode 数字）或非字符串的元素逐个调用 is_simple_sequence。
+
+    :param values: 字符串序列或 NumPy 数组（None 视为空串）
+    :param threshold: 同 is_simple_sequence
+    :return: 与 values 等长的布尔数组
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind == "U":
+        arr = values.ravel()
+        items = None
+    else:
+        items = list(values)
+        if all(type(v) is str for v in items):
+            arr = np.array(items, dtype=str)
+        else:
+            arr = np.array([v if type(v) is str else "" for v in items], dtype=str)
+    n = len(arr)
+    result = np.zeros(n, dtype=bool)
+    if n == 0:
+        return result
+    if threshold < 2:
+        source = items if items is not None else arr.tolist()
+        for i, v in enumerate(source):
+            result[i] = is_simple_sequence(v, threshold)
+        return result
+
+    width = arr.dtype.itemsize // 4
+    if width >= threshold:
+        wide = arr.view(np.uint32).reshape(n, width)
+        # 含非 ASCII 字符的元素可能包含其他 Unicode 数字，稍后逐个检查
+        slow = np.nonzero((wide > 127).any(axis=1))[0]
+        codes = wide.astype(np.int16)
+        is_digit = (codes >= 48) & (codes <= 57)
+        columns = np.arange(width, dtype=np.int16)
+        # 每个位置之前最近的一个数字所在的列（没有时为 -1）
+        last_digit = np.maximum.accumulate(np.where(is_digit, columns, -1), axis=1)
+        previous = np.concatenate([np.full((n, 1), -1, dtype=np.int16), last_digit[:, :-1]], axis=1)
+        has_previous = is_digit & (previous >= 0)
+        steps = codes - np.take_along_axis(codes, np.maximum(previous, 0), axis=1)
+        ordinal = np.cumsum(is_digit, axis=1, dtype=np.int16)  # 第几个数字（从 1 开始）
+        for wanted in (0, 1, -1):
+            # 连续段在“不满足条件的数字”处重新开始，段长 = 当前序号 - 段首序号 + 1
+            starts = is_digit & ~(has_previous & (steps == wanted))
+            first = np.maximum.accumulate(np.where(starts, ordinal, 0), axis=1)
+            result |= (is_digit & (ordinal - first + 1 >= threshold)).any(axis=1)
+
+        for i in slow.tolist():
+            result[i] = is_simple_sequence(str(arr[i]), threshold)
+    return result
+
+
+# ================= 批量身份证校验码 =================
+
+def _checksum_mismatch(value):
+    return (type(value) is str and ID_CARD_REGEX.match(value) is not None
+            and value[17].upper() != id_card_check_char(value))
+
+
+def id_card_checksum_mask(values):
+    """
+    批量检查身份证号校验码：格式正确（ID_CARD_REGEX）但校验码与前17位不符的元素为 True，
+    结果与逐个调用 validator_qc 的校验码规则一致。
+
+    长度为18的纯 ASCII 字符串视为码点矩阵，前17列减去 '0' 后与权重做一次整数矩阵乘法，
+    模11后查表得到应有的校验字符，再与第18位（小写 x 按 X 处理）比较；
+    其他元素（非 ASCII、非字符串）逐个检查。未安装 NumPy 时全部逐个检查，返回列表。
+
+    :param values: 字符串序列或 NumPy 数组（None 视为空串）
+    :return: 与 values 等长的布尔数组
+    """
+    if not NUMPY_AVAILABLE:
+        return [_checksum_mismatch(v) for v in values]
+    if isinstance(values, np.ndarray) and values.dtype.kind == "U":
+        arr = values.ravel()
+    else:
+        arr = np.array([v if type(v) is str else "" for v in values], dtype=str)
+    n = len(arr)
+    result = np.zeros(n, dtype=bool)
+    if n == 0 or arr.dtype.itemsize // 4 < 18:
+        return result
+
+    wide = arr.view(np.uint32).reshape(n, arr.dtype.itemsize // 4)
+    length = np.char.str_len(arr)
+    candidates = length == 18
+    slow = np.nonzero(candidates & (wide > 127).any(axis=1))[0]
+    codes = wide[:, :18].astype(np.int64)
+    body = codes[:, :17] - ord("0")
+    last = codes[:, 17]
+    last = np.where(last == ord("x"), ord("X"), last)
+    well_formed = (candidates & ((body >= 0) & (body <= 9)).all(axis=1)
+                   & (((last >= ord("0")) & (last <= ord("9"))) | (last == ord("X"))))
+    check_chars = np.frombuffer(ID_CARD_CHECK_CHARS.encode("ascii"), dtype=np.uint8).astype(np.int64)
+    expected = check_chars[(body @ np.asarray(ID_CARD_WEIGHTS, dtype=np.int64)) % 11]
+    result = well_formed & (expected != last)
+
+    for i in slow.tolist():
+        result[i] = _checksum_mismatch(str(arr[i]))
+    return result
+
+
+# ================= 向量化规则 =================
+# 每个函数返回 (适用掩码或检查项数量数组, 问题掩码)，与 validator_qc 中同名规则的返回值和判断条件一一对应。
+
+_EMPTY_MARKERS = ["", "-", "无"]
+_SPOUSE = ["配偶", "2"]
+_YES_MARKERS = ["是", "1", "true", "True"]
+
+
+def _required_columnar(field):
+    def evaluate(batch):
+        issue = batch.isin(field, _EMPTY_MARKERS)
+        return np.ones(batch.size, dtype=np.int64), issue
+    return evaluate
+
+
+def _nationality_columnar(batch):
+    issue = ~batch.is_empty("nationality") & ~batch.isin("nationality", ["中国", "156"])
+    return issue.astype(np.int64), issue
+
+
+def _spouse_marriage_columnar(batch):
+    applies = batch.isin("contact_relationship", _SPOUSE)
+    issue = applies & ~batch.is_empty("marriage_status") & ~batch.isin("marriage_status", ["已婚", "2"])
+    return applies.astype(np.int64), issue
+
+
+def _unmarried_spouse_columnar(batch):
+    applies = batch.isin("marriage_status", ["未婚", "1"])
+    issue = applies & batch.isin("contact_relationship", _SPOUSE)
+    return applies.astype(np.int64), issue
+
+
+def _death_autopsy_columnar(batch):
+    applies = batch.isin("discharge_method", ["死亡", "5"])
+    issue = applies & batch.isin("autopsy", ["", "-", "3"])
+    return applies.astype(np.int64), issue
+
+
+def _blood_fee_columnar(batch):
+    applies = ~batch.is_empty("blood_fee")
+    fee, valid = batch.floats("blood_fee")
+    with np.errstate(invalid="ignore"):
+        positive = applies & valid & (fee > 0)
+    missing = batch.isin("blood_type", ["", "-", "未查", "6"]) | batch.isin("rh", ["", "-", "未查", "4"])
+    return applies.astype(np.int64), positive & missing
+
+
+def _rescue_columnar(batch):
+    value, valid = batch.floats("rescue_times")
+    counted = valid & ~batch.isin("rescue_times", _EMPTY_MARKERS)
+    with np.errstate(invalid="ignore"):
+        # 与标量规则的 “rescue_num <= 0 时不适用” 一致：NaN 视为适用
+        applies = counted & ~(value <= 0)
+    yes_markers = frozenset(_YES_MARKERS)
+
+    def is_yes(text):
+        return type(text) is str and text.strip() in yes_markers
+
+    yes = batch.column("critical_condition").mask(is_yes) | batch.column("emergency_case").mask(is_yes)
+    return applies.astype(np.int64), applies & ~yes
+
+
+def _phone_columnar(field):
+    def evaluate(batch):
+        col = batch.column(field)
+        applies = ~col.isin([""])
+        if field == "work_unit_phone":
+            applies &= ~col.isin(["不详", "无"])
+        bad_format = col.mask(lambda t: type(t) is str and not PHONE_REGEX.match(t))
+        issue = applies & (bad_format | col.batch_mask(simple_sequence_mask))
+        return applies.astype(np.int64), issue
+    return evaluate
+
+
+def _id_card_checksum_columnar(batch):
+    col = batch.column("id_card_number")
+    applies = col.mask(lambda t: type(t) is str and ID_CARD_REGEX.match(t) is not None)
+    return applies.astype(np.int64), applies & col.batch_mask(id_card_checksum_mask)
+
+
+def _id_card_gender_columnar(batch):
+    # 第17位的奇偶（-1 表示不适用）与性别对应的奇偶比较
+    def parity(text):
+        return int(text[16]) % 2 if type(text) is str and ID_CARD_REGEX.match(text) else -1
+
+    col = batch.column("id_card_number")
+    id_parity = np.fromiter((parity(t) for t in col.texts), dtype=np.int8, count=len(col.texts))[col.codes]
+    gender = batch.column("gender")
+    wanted = np.fromiter((GENDER_PARITY.get(t, -1) if type(t) is str else -1 for t in gender.texts),
+                         dtype=np.int8, count=len(gender.texts))[gender.codes]
+    applies = (id_parity >= 0) & (wanted >= 0)
+    return applies.astype(np.int64), applies & (id_parity != wanted)
+
+
+def _zip_columnar(field):
+    def evaluate(batch):
+        col = batch.column(field)
+        applies = ~col.isin([""])
+        bad_format = col.mask(lambda t: type(t) is str and not ZIP_CODE_REGEX.match(t))
+        strange = bad_format | col.batch_mask(simple_sequence_mask)
+        issue = applies & strange & ~col.isin(["不详", "无"])
+        return applies.astype(np.int64), issue
+    return evaluate
+
+
+COLUMNAR_RULES = (
+    [(f"必填项:{get_friendly_name(k)}", _required_columnar(k)) for k in REQUIRED_FIELDS]
+    + [(f"电话号码:{get_friendly_name(k)}", _phone_columnar(k))
+       for k in ["current_address_phone", "contact_phone", "household_address_phone", "work_unit_phone"]]
+    + [(f"邮编:{get_friendly_name(k)}", _zip_columnar(k))
+       for k in ["current_address_zip", "household_address_zip", "work_unit_zip"]]
+    + [
+        ("国籍", _nationality_columnar),
+        ("身份证号校验码", _id_card_checksum_columnar),
+        ("身份证号与性别", _id_card_gender_columnar),
+        ("联系人为配偶时婚姻状况", _spouse_marriage_columnar),
+        ("未婚时联系人关系", _unmarried_spouse_columnar),
+        ("死亡患者尸检", _death_autopsy_columnar),
+        ("血费与血型/RH", _blood_fee_columnar),
+        ("抢救与危重/急症", _rescue_columnar),
+    ]
+)
+
+# 规则名称 -> 位图中的位序号；导入时检查名称都在注册表中，避免规则改名后静默失效
+COLUMNAR_BITS = {name: bit for bit, (name, _) in enumerate(COLUMNAR_RULES)}
+for _name in COLUMNAR_BITS:
+    get_rule(_name)
+
+
+def columnar_fields():
+    """列式规则读取的全部字段。"""
+    fields = set()
+    for name, _ in COLUMNAR_RULES:
+        fields.update(get_rule(name).fields)
+    return fields
+
+
+def issue_bitmap(batch):
+    """
+    对一批记录计算列式规则的问题位图。
+
+    :param batch: ColumnBatch
+    :return: tuple (bitmap, checks)
+        - bitmap: uint64 数组，第 i 条记录命中 COLUMNAR_RULES 中第 j 条规则时第 j 位为 1
+        - checks: 形状为 (记录数, 规则数) 的检查项数量数组
+    """
+    bitmap = np.zeros(batch.size, dtype=np.uint64)
+    checks = np.zeros((batch.size, len(COLUMNAR_RULES)), dtype=np.int64)
+    for bit, (_, evaluate) in enumerate(COLUMNAR_RULES):
+        rule_checks, issue = evaluate(batch)
+        checks[:, bit] = rule_checks
+        bitmap |= issue.astype(np.uint64) << np.uint64(bit)
+    return bitmap, checks
+
+
+# 按取值组合分组执行的规则不能读取这些字段：手术列表不可哈希，病案号几乎各不相同
+_UNGROUPED_FIELDS = frozenset(["operations", "case_number_verify"])
+
+
+def groupable(rule):
+    """
+    规则能否按输入取值的组合分组执行：结果只取决于声明的输入字段（reusable），且不读取手术列表等字段。
+    同一组合只调用一次规则函数，结果复制给组内所有记录。
+    """
+    return rule.reusable and not _UNGROUPED_FIELDS.intersection(rule.fields)
+
+
+def group_rows(batch, fields, rows):
+    """
+    按 fields 的取值组合对 rows（记录序号数组）分组。
+
+    :return: (各组第一条记录在 rows 中的位置, 每条记录所属的组号)
+    """
+    key = np.zeros(len(rows), dtype=np.int64)
+    for field in fields:
+        col = batch.column(field)
+        key = key * len(col.uniques) + col.codes[rows]
+        # 每合并一个字段就重新编号，避免多个字段的编码相乘后溢出
+        _, key = np.unique(key, return_inverse=True)
+        key = key.reshape(-1).astype(np.int64)
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
+
+
+def validate_batch(records):
+    """
+    批量校验，返回与逐条调用 validate_data() 相同的 [(validation_results, case_number, check_count), ...]。
+
+    每条规则对整批记录执行一次（按规则而不是按记录循环）：
+      - COLUMNAR_RULES 中的规则用向量化掩码一次算完，只对命中的记录调用原函数生成问题文本；
+      - 其他只依赖输入字段的规则（groupable）按输入取值的组合分组，每种组合只执行一次；
+      - 读取手术列表或外部状态的规则逐条执行。
+    最后按 (记录, 规则) 的顺序拼接问题，与逐条校验的顺序一致。
+    含有非字符串值的记录（包括任一规则输入为 NOT_READ 的记录）整条改用逐条校验，
+    由 validate_data 按未读取的字段跳过相应规则。未安装 NumPy 时全部逐条校验。
+    规则的执行统计（Rule.runs/checks/issues/elapsed）与逐条校验一样累计。
+    """
+    records = list(records)
+    if not NUMPY_AVAILABLE or not records:
+        return [validate_data(r) for r in records]
+
+    plan = [rule for rule in RULES if rule.enabled]
+    batch = ColumnBatch(records)
+    unloaded = set()
+    for rule in plan:
+        if rule.name in COLUMNAR_BITS or groupable(rule):
+            for field in rule.fields:
+                batch.column(field)
+        else:
+            unloaded.update(rule.fields)
+    # 未加载为列的输入字段（例如手术列表）不经过 ColumnBatch 的检查，单独查找 NOT_READ
+    unloaded = sorted(unloaded.difference(batch.loaded_fields()))
+    fallback = batch.fallback | np.fromiter(
+        (any(r.get(f) is NOT_READ for f in unloaded) for r in records), dtype=bool, count=batch.size)
+    rows = np.nonzero(~fallback)[0]
+    row_list = rows.tolist()
+
+    check_count = np.zeros(batch.size, dtype=np.int64)
+    issues = np.zeros((batch.size, len(plan)), dtype=bool)
+    # 每条规则的问题来源：(每条记录的组号, 各组的问题列表)；逐条执行的规则每条有问题的记录单独成组
+    sources = []
+
+    def run_groups(rule, subset):
+        first, group_of = group_rows(batch, rule.fields, subset)
+        group_items = []
+        group_checks = np.zeros(len(first), dtype=np.int64)
+        for g, position in enumerate(first.tolist()):
+            items = []
+            group_checks[g] = rule.func(records[int(subset[position])], items)
+            group_items.append(items)
+        full = np.full(batch.size, -1, dtype=np.int64)
+        full[subset] = group_of
+        return group_checks, group_of, (full.tolist(), group_items)
+
+    for r, rule in enumerate(plan):
+        start = time.perf_counter()
+        bit = COLUMNAR_BITS.get(rule.name)
+        if bit is not None:
+            rule_checks, issue = COLUMNAR_RULES[bit][1](batch)
+            rule_checks = np.asarray(rule_checks, dtype=np.int64)[rows]
+            issue = np.asarray(issue, dtype=bool)[rows]
+            # 只对命中的记录按取值组合调用原函数生成问题文本
+            _, group_of, source = run_groups(rule, rows[issue])
+            issue_count = sum(len(source[1][g]) for g in group_of.tolist())
+        elif groupable(rule):
+            group_checks, group_of, source = run_groups(rule, rows)
+            sizes = np.fromiter((len(items) for items in source[1]), dtype=np.int64, count=len(source[1]))
+            rule_checks = group_checks[group_of]
+            issue = sizes[group_of] > 0
+            issue_count = int(sizes[group_of].sum())
+        else:
+            group_of = [-1] * batch.size
+            group_items = []
+            rule_checks = np.zeros(len(rows), dtype=np.int64)
+            issue = np.zeros(len(rows), dtype=bool)
+            for k, i in enumerate(row_list):
+                items = []
+                rule_checks[k] = rule.func(records[i], items)
+                if items:
+                    group_of[i] = len(group_items)
+                    group_items.append(items)
+                    issue[k] = True
+            source = (group_of, group_items)
+            issue_count = sum(len(items) for items in group_items)
+        sources.append(source)
+        check_count[rows] += rule_checks
+        issues[rows, r] = issue
+        rule.runs += len(rows)
+        rule.checks += int(rule_checks.sum())
+        rule.issues += issue_count
+        rule.elapsed += time.perf_counter() - start
+
+    # 只遍历有问题的 (记录, 规则)：np.nonzero 按行优先返回，即每条记录内按规则顺序。
+    # 各组的问题字典复制给每条记录，记录之间不共用同一个字典
+    report = {}
+    current, items = -1, None
+    hit_rows, hit_rules = np.nonzero(issues)
+    for i, r in zip(hit_rows.tolist(), hit_rules.tolist()):
+        if i != current:
+            current, items = i, []
+            report[i] = items
+        group_of, group_items = sources[r]
+        items.extend(map(dict, group_items[group_of[i]]))
+
+    check_count = check_count.tolist()
+    fallback = fallback.tolist()
+    results = []
+    for i, record in enumerate(records):
+        if fallback[i]:
+            results.append(validate_data(record))
+        else:
+            results.append((report.get(i, []), record.get("case_number_verify", ""), check_count[i]))
+    return results
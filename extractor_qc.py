@@ -1,9 +1,50 @@
 # extractor_qc.py
+import hashlib
 import time
-from pywinauto.findwindows import ElementNotFoundError
-from pywinauto.keyboard import send_keys
+from collections.abc import Mapping
 from ui_map_qc import CONTROLS_QC
 from output import info, warning
+from backend_qc import get_backend, build_control_index, get_control_index, get_cache_stats, spec_key
+
+# 整页提取的默认时间预算（秒），所有字段共享；为 None 时不限时。
+# 手术列表的键盘遍历不计入该预算，使用单独的 OPERATIONS_BUDGET（见下方手术列表的等待参数）
+EXTRACTION_BUDGET = 1.5
+
+
+class _NotRead:
+    """
+    表示字段因提取预算耗尽而未读取。
+    与 None（控件不存在或读取出错）区分，校验时只跳过依赖未读取字段的规则。
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "NOT_READ"
+
+    def __str__(self):
+        return "未读取"
+
+    def __reduce__(self):
+        # 跨进程传递时仍还原为同一个单例
+        return "NOT_READ"
+
+
+NOT_READ = _NotRead()
+
+
+def _remaining(deadline):
+    """距离截止时间的剩余秒数；deadline 为 None 时返回 None。"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
 
 # 友好名称映射已根据最新的 ui_map_qc.py
 FRIENDLY_CONTROL_NAMES = {
@@ -125,6 +166,7 @@ FRIENDLY_CONTROL_NAMES = {
     "quality_control_date": "质控日期",
     
     # ================= 手术信息 =================
+    "operations": "手术操作",
     "operation_code": "手术及操作编码",
     "operation_name": "手术及操作名称",
     "operation_date": "手术及操作日期",
@@ -159,116 +201,384 @@ FRIENDLY_CONTROL_NAMES = {
     "admission_times": "住院次数",
 }
 
+# 手术列表中循环提取的字段
+OPERATION_KEYS = [
+    "operation_code", "operation_name", "operation_date", "operation_level", "surgeon",
+    "first_assistant", "second_assistant", "incision_healing", "anesthesia_method",
+    "anesthesiologist", "operation_department", "is_dsa", "is_operation"
+]
+
+# 一条提取记录包含的全部键：非循环的静态字段、手术列表、用于校验的病案号
+RECORD_KEYS = [k for k in CONTROLS_QC if k not in OPERATION_KEYS] + ['operations', 'case_number_verify']
+
 def get_friendly_name(control_key):
     """获取控件的友好名称，如果未定义则返回原始键名"""
     return FRIENDLY_CONTROL_NAMES.get(control_key, control_key)
 
-def _extract_operations_by_keyboard(dlg, item_keys):
+def fingerprint_keys():
+    """
+    页面指纹读取的控件：病案号加上启用的规则读取的全部界面字段（按 CONTROLS_QC 的顺序），
+    因此任何规则输入的修改都会改变指纹。
+    手术列表的控件不参与指纹：它们显示的是表格当前所在的一行，质控逐行遍历后停在最后一行，
+    参与指纹会使有两条以上手术的病案在质控后指纹改变、被自动模式重复质控。
+    手术的条数只能逐行按键遍历才能得到，后台扫描不能移动焦点；手术的修改通常伴随麻醉费等字段的变化。
+    """
+    from validator_qc import checked_fields
+    fields = checked_fields() | {"case_number"}
+    return [k for k in CONTROLS_QC if k in fields and k not in OPERATION_KEYS]
+
+def page_fingerprint(dlg, backend=None, index=None):
+    """
+    计算页面的指纹：读取 fingerprint_keys() 中的控件（不遍历手术列表）并做哈希。
+    自动模式用它判断同一病案的页面内容是否变化，变化时才重新提取与校验。
+
+    :param dlg: 窗口对象
+    :param backend: UI 后端，默认为 pywinauto 后端
+    :param index: 可选，已建立的控件索引 {(class_name, found_index): 控件}
+    :return: 十六进制的指纹字符串
+    """
+    backend = backend or get_backend()
+    if index is None:
+        index = get_control_index(dlg, backend)
+    digest = hashlib.sha1()
+    for key in fingerprint_keys():
+        spec = CONTROLS_QC[key]
+        try:
+            control = index.get(spec_key(spec)) if index else None
+            if control is None:
+                control = backend.find(dlg, spec, timeout=0)
+            text = control.window_text().strip()
+        except Exception:
+            text = ""
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+# 手术列表逐行读取时的等待参数（秒）：先快速轮询，再指数退避，超过上限视为界面不再变化。
+# 已观察到界面刷新耗时后，超时按最慢一次刷新的倍数收紧，但不低于 ROW_CHANGE_MIN_TIMEOUT；
+# 收紧后的等待超时不能直接判定为列表末尾，要再等满 ROW_CHANGE_TIMEOUT 确认。
+# 按键进入表格后至少等待 ROW_ENTRY_TIMEOUT（与原来固定等待 0.2 秒一致）。
+ROW_POLL_SPINS = 3
+ROW_POLL_INITIAL_INTERVAL = 0.005
+ROW_POLL_MAX_INTERVAL = 0.05
+ROW_CHANGE_TIMEOUT = 0.3
+ROW_CHANGE_MIN_TIMEOUT = 0.1
+ROW_ENTRY_TIMEOUT = 0.2
+ROW_TIMEOUT_FACTOR = 4
+# 最慢一次刷新超过该耗时，说明界面刷新接近等待上限，提示手术信息可能不完整
+ROW_SLOW_WARNING = ROW_CHANGE_TIMEOUT * 2 / 3
+# 最多读取的手术行数（防止意外的无限循环）
+MAX_OPERATION_ROWS = 25
+# 手术列表键盘遍历单独的时间预算（秒）：每行的等待本身有上限，按最多行数都等满计算，
+# 因此正常的列表总能读完，预算只拦住异常情况；整页预算用完后仍会读取手术列表。为 None 时不限时
+OPERATIONS_BUDGET = 0.1 + ROW_ENTRY_TIMEOUT + MAX_OPERATION_ROWS * ROW_CHANGE_TIMEOUT
+
+def _wait_for_row_change(read_row, previous, timeout=ROW_CHANGE_TIMEOUT):
+    """
+    按键后轮询手术列表当前行，直到行内容与 previous 不同（且连续两次读取一致）或超时。
+
+    :param read_row: 读取当前行并返回签名（元组）的函数
+    :param previous: 按键前的行签名
+    :param timeout: 最长等待时间
+    :return: (当前行签名, 是否发生变化, 等待耗时)
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    interval = ROW_POLL_INITIAL_INTERVAL
+    polls = 0
+    while True:
+        current = read_row()
+        now = time.monotonic()
+        if current != previous:
+            # 界面可能在读取一行的中途刷新，得到新旧混杂的内容；再读一次，两次一致才采用
+            confirm = read_row()
+            if confirm == current:
+                return current, True, time.monotonic() - start
+            if time.monotonic() >= deadline:
+                return confirm, confirm != previous, time.monotonic() - start
+            continue
+        if now >= deadline:
+            return current, False, now - start
+        polls += 1
+        if polls > ROW_POLL_SPINS:
+            time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+            interval = min(interval * 2, ROW_POLL_MAX_INTERVAL)
+
+def _row_timeout(observed):
+    """根据已观察到的刷新耗时计算下一次等待的超时。"""
+    if not observed:
+        return ROW_CHANGE_TIMEOUT
+    return min(ROW_CHANGE_TIMEOUT, max(ROW_CHANGE_MIN_TIMEOUT, ROW_TIMEOUT_FACTOR * max(observed)))
+
+def _extract_operations_by_keyboard(dlg, item_keys, backend, lookup=None, deadline=None):
     """
     通过键盘操作提取手术信息。
     方法：点击“离院方式”，按“上”键进入表格，然后重复按“上”键遍历记录。
+    手术列表中的控件只定位一次；每次按键后轮询当前行，界面刷新后立即读取，
+    而不是固定等待。
+
+    :param lookup: 可选，从控件索引中取控件的函数，找不到时返回 None
+    :param deadline: 可选，time.monotonic() 截止时间；未遍历完就到期时返回 NOT_READ，
+                     因为不完整的手术列表会误导依赖它的规则
     """
     results = []
-    last_data_signature = None
+    observed = []  # 每次按键后界面实际刷新的耗时
+
+    def bounded(timeout):
+        remaining = _remaining(deadline)
+        return timeout if remaining is None else max(0.0, min(timeout, remaining))
+
+    def expired():
+        remaining = _remaining(deadline)
+        return remaining is not None and remaining <= 0
+
+    if expired():
+        warning("  提取时间预算已用完，未读取手术信息。")
+        return NOT_READ
 
     try:
-        # 1. 点击“离院方式”以设置焦点，然后按“上”键进入表格
+        def resolve(spec):
+            control = lookup(spec) if lookup else None
+            return control if control is not None else backend.resolve(dlg, spec)
+
+        # 1. 定位手术列表中的控件（整个遍历过程中复用）
         info("  定位到手术列表...")
-        discharge_method_control = dlg.child_window(**CONTROLS_QC['discharge_method'])
+        row_controls = [resolve(CONTROLS_QC[key]) for key in item_keys]
+
+        def read_row():
+            return tuple(control.window_text().strip() for control in row_controls)
+
+        # 2. 点击“离院方式”以设置焦点，然后按“上”键进入表格
+        discharge_method_control = resolve(CONTROLS_QC['discharge_method'])
         discharge_method_control.click_input()
         discharge_method_control.set_focus()
         time.sleep(0.1)
-        send_keys('{UP}')
-        time.sleep(0.2)  # 等待UI响应
+        before_entry = read_row()
+        backend.send_keys('{UP}')
+        # 进入表格后通常仍显示同一行，等待界面稳定，超时后采用当前内容
+        entry_timeout = bounded(ROW_ENTRY_TIMEOUT)
+        current_signature, changed, elapsed = _wait_for_row_change(read_row, before_entry, entry_timeout)
+        if changed:
+            observed.append(elapsed)
+        elif entry_timeout < ROW_ENTRY_TIMEOUT:
+            # 预算不足以等满进入表格的时间，当前行可能尚未刷新
+            warning("  提取时间预算已用完，无法确认手术列表的第一行，标记为未读取。")
+            return NOT_READ
 
-        # 2. 循环提取数据
+        # 3. 循环提取数据
         info("  开始循环提取手术信息...")
-        for _ in range(25):  # 设置最多25次循环，防止意外的无限循环
-            current_item = {}
-            is_empty_row = True
-            for key in item_keys:
-                spec = CONTROLS_QC[key]
-                control = dlg.child_window(**spec)
-                text_value = control.window_text().strip()
-                current_item[key] = text_value
-                if text_value:
-                    is_empty_row = False
-            
+        for _ in range(MAX_OPERATION_ROWS):
             # 如果整行都是空的，说明已超出列表范围
-            if is_empty_row:
+            if not any(current_signature):
                 info("  检测到空行，停止提取手术信息。")
                 break
 
-            current_signature = tuple(current_item.values())
-            
-            # 如果当前数据与上一条完全相同，说明已到达列表末尾
-            if current_signature == last_data_signature:
+            results.append(dict(zip(item_keys, current_signature)))
+
+            # 按“上”键以移动到下一条记录；超时仍未变化说明已到达列表末尾
+            backend.send_keys('{UP}')
+            timeout = _row_timeout(observed)
+            previous_signature = current_signature
+            current_signature, changed, elapsed = _wait_for_row_change(
+                read_row, previous_signature, bounded(timeout)
+            )
+            if not changed and timeout < ROW_CHANGE_TIMEOUT and not expired():
+                # 收紧的超时内没有变化：可能是列表末尾，也可能是这次刷新较慢，等满上限再确认
+                current_signature, changed, extra = _wait_for_row_change(
+                    read_row, previous_signature, bounded(ROW_CHANGE_TIMEOUT - timeout)
+                )
+                elapsed += extra
+            if not changed and expired():
+                warning(f"  提取时间预算已用完，手术信息只读取到 {len(results)} 条，标记为未读取。")
+                return NOT_READ
+            if not changed:
                 info("  检测到重复数据，已到达列表末尾。")
                 break
-            
-            results.append(current_item)
-            last_data_signature = current_signature
-            
-            # 按“上”键以移动到下一条记录，为下一次循环做准备
-            send_keys('{UP}')
-            time.sleep(0.1)
-
-    except ElementNotFoundError as e:
+            observed.append(elapsed)
+
+        if observed and max(observed) > ROW_SLOW_WARNING:
+            warning(f"  手术列表刷新较慢（最慢 {max(observed):.2f} 秒），读取到的 {len(results)} 条手术信息可能不完整，请核对。")
+
+    except backend.not_found_errors as e:
         warning(f"  提取手术数据时定位控件失败: {e}。将跳过手术信息提取。")
     except Exception as e:
         warning(f"  提取手术数据时发生未知错误: {e}")
         
     return results
 
-def extract_all_data(dlg):
+def _read_control(control_key, lookup, timeout=2):
+    """读取单个控件文本；lookup 返回控件对象，找不到时返回 None 或抛出异常。"""
+    try:
+        control = lookup(CONTROLS_QC[control_key], timeout)
+        if control is None:
+            warning(f"  未找到控件 '{get_friendly_name(control_key)}' (key: {control_key})，跳过。")
+            return None
+        return control.window_text().strip()
+    except Exception as e:
+        warning(f"  提取控件 '{get_friendly_name(control_key)}' (key: {control_key}) 时出错: {e}")
+        return None
+
+class LazyRecord(Mapping):
     """
-    从指定的对话框(dlg)中提取所有在CONTROLS_QC中定义的控件的文本值。
-    包括对“手术”列表数据的循环提取。
+    按需从界面读取字段的记录对象（只读映射，接口与 extract_all_data 返回的字典相同）。
 
-    :param dlg: pywinauto 的窗口对象
-    :return: 一个字典，键为控件的逻辑名称，值为从UI读取到的文本
+    字段只在第一次被访问（例如被某条校验规则或历史记录写入使用）时才从窗口读取，
+    读取结果在本次运行中缓存。可以用 fields 限定读取范围（例如只读取启用的规则需要的字段），
+    范围之外的字段不会访问界面，直接返回 NOT_READ。
+
+    整页提取共享一个时间预算，单个控件的等待不会超过剩余预算。预算用完后尚未读取的字段
+    记为 NOT_READ（而不是 None），校验时只跳过依赖这些字段的规则。
+    手术列表按行逐次等待界面刷新，耗时随手术数增长，因此不占用整页预算，
+    而是在开始遍历时使用单独的 OPERATIONS_BUDGET（整页预算为 None 时同样不限时）。
+
+    :param dlg: 窗口对象（pywinauto 窗口或模拟窗口）
+    :param backend: UI 后端，默认为 pywinauto 后端
+    :param use_index: 是否使用单次枚举的索引模式（枚举失败时自动退回逐个定位）
+    :param use_cache: 索引模式下是否复用已缓存的控件索引
+    :param budget: 整页提取的时间预算（秒），None 表示不限时
+    :param fields: 允许读取的字段集合，None 表示全部字段
     """
-    info("▶ 开始从界面提取数据...")
-    extracted_data = {}
-
-    # 定义需要循环提取的字段
-    operation_keys = [
-        "operation_code", "operation_name", "operation_date", "operation_level", "surgeon", 
-        "first_assistant", "second_assistant", "incision_healing", "anesthesia_method", 
-        "anesthesiologist", "operation_department", "is_dsa", "is_operation"
-    ]
-    
-    # 将循环提取的字段放入一个集合，以便在主循环中跳过
-    skipped_keys = set(operation_keys)
 
-    # 1. 提取所有非循环的静态字段
-    for control_key, spec in CONTROLS_QC.items():
-        if control_key in skipped_keys:
-            continue
+    def __init__(self, dlg, backend=None, use_index=True, use_cache=True,
+                 budget=EXTRACTION_BUDGET, fields=None):
+        self._dlg = dlg
+        self._backend = backend or get_backend()
+        self._budget = budget
+        self._deadline = time.monotonic() + budget if budget is not None else None
+        self._fields = set(fields) if fields is not None else None
+        self._values = {}
+        self.reads = 0     # 实际访问界面读取的字段数
+        self.unread = []   # 因预算用完而未读取的字段
+
+        backend = self._backend
+        index = None
+        if use_index:
+            try:
+                if use_cache:
+                    index = get_control_index(dlg, backend)
+                    stats = get_cache_stats()
+                    info(f"  控件索引 {len(index)} 个（缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次）。")
+                else:
+                    index = build_control_index(backend.descendants(dlg))
+                    info(f"  已枚举窗口控件 {len(index)} 个。")
+            except Exception as e:
+                warning(f"  枚举窗口控件失败: {e}，改为逐个定位控件。")
+        self._index = index
+
+    def _lookup(self, spec, timeout=2):
+        if self._index is not None:
+            return self._index.get(spec_key(spec))
         try:
-            control = dlg.child_window(**spec)
-            control.wait('exists', timeout=2)
-            text_value = control.window_text()
-            extracted_data[control_key] = text_value.strip()
-        except ElementNotFoundError:
-            warning(f"  未找到控件 '{get_friendly_name(control_key)}' (key: {control_key})，跳过。")
-            extracted_data[control_key] = None
-        except Exception as e:
-            warning(f"  提取控件 '{get_friendly_name(control_key)}' (key: {control_key}) 时出错: {e}")
-            extracted_data[control_key] = None
+            return self._backend.find(self._dlg, spec, timeout=timeout)
+        except self._backend.not_found_errors:
+            return None
 
-    # 2. 提取“手术及操作”列表
-    info("  正在提取手术及操作信息...")
-    extracted_data['operations'] = _extract_operations_by_keyboard(
-        dlg, operation_keys
-    )
+    def _mark_unread(self, key):
+        if not self.unread:
+            warning(f"  提取时间预算（{self._budget} 秒）已用完，后续字段将标记为未读取，依赖这些字段的规则将被跳过。")
+        self.unread.append(key)
+        return NOT_READ
 
-    # 3. 单独获取用于校验的病案号
-    try:
-        case_number_control = dlg.child_window(**CONTROLS_QC["case_number"])
-        extracted_data['case_number_verify'] = case_number_control.window_text().strip()
-    except Exception:
-        extracted_data['case_number_verify'] = ""
+    def _load(self, key):
+        if key == 'case_number_verify':
+            # 用于校验的病案号无论预算是否用完都读取
+            try:
+                return self._lookup(CONTROLS_QC["case_number"], 0.5).window_text().strip()
+            except Exception:
+                return ""
+        if self._fields is not None and key not in self._fields:
+            return NOT_READ
 
+        if key == 'operations':
+            info("  正在提取手术及操作信息...")
+            budget = None if self._budget is None else OPERATIONS_BUDGET
+            value = _extract_operations_by_keyboard(
+                self._dlg, OPERATION_KEYS, self._backend,
+                self._lookup if self._index is not None else None,
+                time.monotonic() + budget if budget is not None else None
+            )
+            if value is NOT_READ:
+                return self._mark_unread(key)
+            return value
+
+        remaining = _remaining(self._deadline)
+        if remaining is not None and remaining <= 0:
+            return self._mark_unread(key)
+
+        self.reads += 1
+        timeout = 2 if remaining is None else min(2, remaining)
+        return _read_control(key, self._lookup, timeout)
+
+    def extend_budget(self, budget=None):
+        """
+        为之后的读取重新计时（例如报告生成后为历史记录补读其余字段）：截止时间改为 budget 秒之后，
+        None 表示不限时。已读取或已标记为未读取的字段保持不变，以便与校验结果一致。
+        """
+        self._budget = budget
+        self._deadline = time.monotonic() + budget if budget is not None else None
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        if key not in RECORD_KEYS:
+            raise KeyError(key)
+        value = self._load(key)
+        self._values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(RECORD_KEYS)
+
+    def __len__(self):
+        return len(RECORD_KEYS)
+
+    def materialize(self):
+        """读取所有（允许范围内的）字段，返回普通字典。"""
+        for key in RECORD_KEYS:
+            self[key]
+        return dict(self._values)
+
+    def to_dict(self):
+        """返回已读取字段的普通字典，不再访问界面（未读取的字段不包含在内）。"""
+        return dict(self._values)
+
+def extract_all_data(dlg, backend=None, use_index=True, use_cache=True, budget=EXTRACTION_BUDGET,
+                     snapshot_path=None):
+    """
+    从指定的对话框(dlg)中提取所有在CONTROLS_QC中定义的控件的文本值。
+    包括对“手术”列表数据的循环提取。
+
+    默认使用索引模式：只枚举一次窗口的后代控件，建立 (class_name, found_index) -> 控件
+    的索引后从索引中读取所有字段，避免每个字段都重新遍历整棵控件树。
+    枚举失败时自动退回逐个定位的方式。
+    索引按窗口句柄和布局指纹缓存，窗口不关闭时后续病案直接复用。
+    需要按需读取时请直接使用 LazyRecord。
+
+    :param dlg: 窗口对象（pywinauto 窗口或模拟窗口）
+    :param backend: UI 后端，默认为 pywinauto 后端
+    :param use_index: 是否使用单次枚举的索引模式
+    :param use_cache: 索引模式下是否复用已缓存的控件索引
+    :param budget: 整页提取的时间预算（秒），None 表示不限时
+    :param snapshot_path: 可选，把本次提取看到的控件树与手术列表遍历录制为快照文件
+                          （见 replay_qc，可用于离线回放测试；身份与联系方式字段默认脱敏）
+    :return: 一个字典，键为控件的逻辑名称，值为从UI读取到的文本
+    """
+    info("▶ 开始从界面提取数据...")
+    recorder = None
+    if snapshot_path:
+        from replay_qc import RecordingBackend
+        recorder = RecordingBackend(backend or get_backend())
+        backend = recorder
+        # 缓存中的控件未经录制包装，录制时重新枚举
+        use_cache = False
+    record = LazyRecord(dlg, backend, use_index=use_index, use_cache=use_cache, budget=budget)
+    extracted_data = record.materialize()
     info("✔ 数据提取完成。")
+    if recorder is not None:
+        try:
+            from replay_qc import save_snapshot
+            save_snapshot(recorder.snapshot(dlg, extracted_data), snapshot_path)
+            info(f"  已保存界面快照: {snapshot_path}")
+        except Exception as e:
+            warning(f"  保存界面快照失败: {e}")
     return extracted_data
@@ -2,7 +2,6 @@
 import sys
 import os
 import ctypes
-import time
 
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QTextEdit, QDesktopWidget, QStyleFactory, QProgressBar, 
@@ -12,15 +11,17 @@ from PyQt5.QtGui import QFont, QIcon
 
 # 导入你的核心逻辑和输出模块
 from output import setup_gui_handler, clear_log, info, warning, success, error, reset_counters
-from history_qc import get_csv_path
+from history_qc import export_history_csv, flush_history, get_history_metrics
 import subprocess
 
 # --- 自动模式需要的模块 ---
+from ui_map_qc import CONTROLS_QC
+from backend_qc import get_backend, get_control_index, spec_key, UIBackend
+from extractor_qc import page_fingerprint
+from cache_qc import CheckedCaseCache
+
 try:
-    from pywinauto import Application
-    from pywinauto.findwindows import ElementNotFoundError
-    from pywinauto.timings import TimeoutError as PywinautoTimeoutError
-    from ui_map_qc import CONTROLS_QC
+    import pywinauto  # noqa: F401  仅用于检测自动模式是否可用
     PYWINAUTO_AVAILABLE = True
 except ImportError:
     PYWINAUTO_AVAILABLE = False
@@ -48,33 +49,40 @@ def relaunch_as_admin():
 # --- 新增：轻量级的后台扫描工作者 ---
 class AutoScanWorker(QObject):
     finished = pyqtSignal()
-    case_found = pyqtSignal(str)
+    case_found = pyqtSignal(str, str)  # (病案号, 页面指纹)
     scan_failed = pyqtSignal(str)
 
     def __init__(self, parent=None):
         super().__init__(parent)
 
     def run(self):
-        """在后台执行pywinauto扫描，不阻塞UI"""
+        """在后台通过 UI 后端扫描，不阻塞UI"""
+        # 后端创建之前只能识别通用的“未找到”异常；之后还包括 pywinauto 的 ElementNotFoundError 等
+        not_found_errors = UIBackend.not_found_errors
         try:
+            backend = get_backend()
+            not_found_errors = backend.not_found_errors
             # 使用非常短的超时来连接，避免长时间等待
-            app = Application(backend="win32").connect(title="首页录入", timeout=0.5)
-            dlg = app.window(title="首页录入")
+            dlg = backend.connect("首页录入", timeout=0.5)
             
             if not dlg.exists() or not dlg.is_visible():
                 self.scan_failed.emit("未找到可见的'首页录入'窗口。")
                 self.finished.emit()
                 return
 
-            case_number_ctrl = dlg.child_window(**CONTROLS_QC["case_number"])
+            # 复用按窗口句柄缓存的控件索引，窗口不关闭时无需重新解析控件
+            index = get_control_index(dlg, backend)
+            case_number_ctrl = index.get(spec_key(CONTROLS_QC["case_number"]))
+            if case_number_ctrl is None:
+                case_number_ctrl = backend.find(dlg, CONTROLS_QC["case_number"], timeout=0)
             case_number = case_number_ctrl.window_text().strip()
 
             if case_number:
-                self.case_found.emit(case_number)
+                self.case_found.emit(case_number, page_fingerprint(dlg, backend, index))
             else:
                 self.scan_failed.emit("检测到首页，但无病案号。")
 
-        except (ElementNotFoundError, PywinautoTimeoutError):
+        except not_found_errors:
             self.scan_failed.emit("正在扫描新首页...")
         except Exception as e:
             self.scan_failed.emit(f"扫描时出错: {str(e)[:50]}...")
@@ -110,7 +118,7 @@ class QualityControlApp(QWidget):
         self.auto_mode_enabled = False
         self.is_scanning = False  # 防止并发扫描
         self.is_qc_running = False # 防止在质控时触发新的扫描
-        self.checked_cases = {}  # {case_number: timestamp}
+        self.checked_cases = CheckedCaseCache()  # {case_number: 页面指纹}，首次扫描时从文件读取
         self.auto_qc_timer = QTimer(self)
         self.current_auto_status_message = ""
 
@@ -264,17 +272,14 @@ class QualityControlApp(QWidget):
             self.scan_thread = None
             self.scan_worker = None
 
-    def on_case_found(self, case_number):
-        """当扫描线程发现病案号时的处理逻辑"""
-        current_time = time.time()
-        last_check_time = self.checked_cases.get(case_number)
-
-        if last_check_time and (current_time - last_check_time) < 3600:
-            self.update_auto_status(f"病案号 {case_number} 在1小时内已质控，跳过。")
+    def on_case_found(self, case_number, fingerprint):
+        """当扫描线程发现病案号时的处理逻辑：页面指纹与上次质控时相同则跳过"""
+        if self.checked_cases.get(case_number) == fingerprint:
+            self.update_auto_status(f"病案号 {case_number} 内容未变化，跳过。")
             return
-        
-        # 发现新病案，准备质控
-        self.checked_cases[case_number] = current_time
+
+        # 新病案或内容有修改，准备质控
+        self.checked_cases.put(case_number, fingerprint)
         self.start_qc_process(case_number_hint=case_number)
 
     def start_qc_process(self, case_number_hint=None):
@@ -378,7 +383,7 @@ class QualityControlApp(QWidget):
     
     def on_history_clicked(self):
         try:
-            path = get_csv_path()
+            path = export_history_csv()
             if not os.path.exists(path) or os.path.getsize(path) == 0:
                 with open(path, 'w', newline='', encoding='utf-8-sig') as f:
                     import csv
@@ -402,6 +407,10 @@ class QualityControlApp(QWidget):
         if self.scan_thread and self.scan_thread.isRunning():
             self.scan_thread.quit()
             self.scan_thread.wait()
+        self.checked_cases.save()
+        # 写完后台队列中尚未写入的质控历史
+        if not flush_history(timeout=10):
+            warning(f"部分质控历史未能在关闭前写入: {get_history_metrics()}")
         event.accept()
 
 if __name__ == '__main__':
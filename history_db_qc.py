@@ -0,0 +1,289 @@
+# history_db_qc.py
+"""
+SQLite history store, an optional alternative to the records.csv file.
+
+Each run keeps the same row that history_qc.format_row produces for the CSV (so the
+CSV layout can be exported unchanged), plus indexed columns for lookups that the CSV
+can only answer by scanning every row:
+
+- the latest runs of a case number (index on case_number, run_time)
+- runs in a time range (index on run_time)
+- runs where a given field had a given QC status, e.g. 身份证号 未通过 (index on field, status)
+
+Each run also records the header its row was written under (table headers). Rows are
+read back aligned to the current header by column name, so runs saved before a field was
+added or removed still line up when exported or revalidated. Rows from databases created
+before headers were stored are assumed to use the current header; those whose length
+does not match it are skipped with a warning.
+
+The database uses WAL mode with a single connection shared by all threads; writes are
+serialized by a lock, so there is only ever one writer.
+"""
+from __future__ import annotations
+import csv
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from output import info, warning
+from extractor_qc import get_friendly_name
+
+DB_FILE_NAME = 'records.db'
+
+# 每写入多少条记录检查一次是否需要截断到 max_records 条
+TRIM_INTERVAL = 100
+
+# 运行日期在 CSV 中的格式；数据库中另存一列可排序的 ISO 格式时间
+CSV_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS headers (
+    id INTEGER PRIMARY KEY,
+    header TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_number TEXT NOT NULL,
+    run_time TEXT NOT NULL,
+    row TEXT NOT NULL,
+    header_id INTEGER REFERENCES headers (id)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_case ON runs (case_number, run_time);
+CREATE INDEX IF NOT EXISTS idx_runs_time ON runs (run_time);
+CREATE TABLE IF NOT EXISTS field_status (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_status_field ON field_status (field, status, run_id);
+CREATE INDEX IF NOT EXISTS idx_status_run ON field_status (run_id);
+"""
+
+
+def get_db_path() -> str:
+    """返回数据库文件的完整路径（与 records.csv 在同一 autoqc 目录下）。"""
+    from history_qc import get_csv_path
+    return os.path.join(os.path.dirname(get_csv_path()), DB_FILE_NAME)
+
+
+def _current_header() -> List[str]:
+    from history_qc import build_header
+    return build_header()
+
+
+def _iso_time(run_time: str) -> str:
+    try:
+        return datetime.strptime(run_time, CSV_TIME_FORMAT).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return run_time
+
+
+def _warn_skipped(skipped: int) -> None:
+    if skipped:
+        warning(f"跳过 {skipped} 条列数与当前表头不符、且未保存表头的旧历史记录。")
+
+
+class SQLiteHistoryStore:
+    """
+    SQLite 历史记录库。
+
+    :param path: 数据库文件路径，默认为 get_db_path()
+    :param max_records: 最多保留的运行记录数，超出的最早记录定期删除
+    """
+
+    def __init__(self, path: Optional[str] = None, max_records: int = 5000):
+        self.path = path or get_db_path()
+        self.max_records = max_records
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        # 早期版本的 runs 表没有 header_id 列，先补上再建索引
+        if self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'runs'").fetchone():
+            columns = {r[1] for r in self._conn.execute('PRAGMA table_info(runs)')}
+            if 'header_id' not in columns:
+                self._conn.execute('ALTER TABLE runs ADD COLUMN header_id INTEGER REFERENCES headers (id)')
+        self._conn.executescript(_SCHEMA)
+        self._header_ids: Dict[tuple, int] = {}      # {表头: 表头编号}
+        self._headers: Dict[int, List[str]] = {}     # {表头编号: 表头}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---- 表头 ----
+
+    def _header_id(self, header: List[str]) -> int:
+        """返回表头的编号，首次出现时写入 headers 表（调用方持有锁并处于事务中）。"""
+        key = tuple(header)
+        header_id = self._header_ids.get(key)
+        if header_id is None:
+            text = json.dumps(list(header), ensure_ascii=False)
+            self._conn.execute('INSERT OR IGNORE INTO headers (header) VALUES (?)', (text,))
+            header_id = self._conn.execute('SELECT id FROM headers WHERE header = ?', (text,)).fetchone()[0]
+            self._header_ids[key] = header_id
+            self._headers[header_id] = list(header)
+        return header_id
+
+    def _align(self, values: List[str], header_id: Optional[int], header: List[str]) -> Optional[List[str]]:
+        """
+        把按 header_id 对应表头保存的数据行按列名对齐到 header；缺少的列为空。
+        没有保存表头的旧记录按 header 处理，长度不符时返回 None。
+        """
+        if header_id is None:
+            return values if len(values) == len(header) else None
+        stored = self._headers.get(header_id)
+        if stored is None:
+            row = self._conn.execute('SELECT header FROM headers WHERE id = ?', (header_id,)).fetchone()
+            stored = self._headers[header_id] = json.loads(row[0]) if row else []
+        if stored == header:
+            return values
+        columns = {name: i for i, name in enumerate(stored) if i < len(values)}
+        return [values[columns[name]] if name in columns else '' for name in header]
+
+    def _aligned_rows(self, fetched, header: List[str], keep_id: bool = False):
+        """
+        对齐查询结果 (id, row, header_id) 中的各行。
+
+        :return: (对齐后的数据行或 (记录编号, 数据行) 列表, 跳过的旧记录数)
+        """
+        rows = []
+        skipped = 0
+        for run_id, row, header_id in fetched:
+            values = self._align(json.loads(row), header_id, header)
+            if values is None:
+                skipped += 1
+            else:
+                rows.append((run_id, values) if keep_id else values)
+        return rows, skipped
+
+    # ---- 写入 ----
+
+    def save(self, header: List[str], row: List[Any]) -> int:
+        """保存一条 format_row() 生成的记录，返回记录编号。"""
+        return self.save_many([(header, row)])[-1]
+
+    def save_many(self, rows: List[Any]) -> List[int]:
+        """在同一个事务中保存多条 (表头, 数据行)，返回各记录的编号。"""
+        ids = []
+        with self._lock, self._conn:
+            for header, row in rows:
+                values = ['' if v is None else str(v) for v in row]
+                cursor = self._conn.execute(
+                    'INSERT INTO runs (case_number, run_time, row, header_id) VALUES (?, ?, ?, ?)',
+                    (values[0], _iso_time(values[1]), json.dumps(values, ensure_ascii=False), self._header_id(header)))
+                run_id = cursor.lastrowid
+                self._conn.executemany(
+                    'INSERT INTO field_status (run_id, field, status) VALUES (?, ?, ?)',
+                    # 表头为 病案号, 运行日期, 字段, 字段质控, 字段, 字段质控, ...
+                    [(run_id, name, status) for name, status in zip(header[2::2], values[3::2])
+                     if status and status != '未质控'])
+                ids.append(run_id)
+            if ids and ids[-1] // TRIM_INTERVAL != (ids[0] - 1) // TRIM_INTERVAL:
+                self._trim()
+        return ids
+
+    def replace_rows(self, rows: List[Any]) -> None:
+        """在同一个事务中用新的数据行替换已有记录的内容，rows 为 (记录编号, 表头, 数据行)。"""
+        with self._lock, self._conn:
+            for run_id, header, row in rows:
+                values = ['' if v is None else str(v) for v in row]
+                self._conn.execute('UPDATE runs SET row = ?, header_id = ? WHERE id = ?',
+                                   (json.dumps(values, ensure_ascii=False), self._header_id(header), run_id))
+                self._conn.execute('DELETE FROM field_status WHERE run_id = ?', (run_id,))
+                self._conn.executemany(
+                    'INSERT INTO field_status (run_id, field, status) VALUES (?, ?, ?)',
+                    [(run_id, name, status) for name, status in zip(header[2::2], values[3::2])
+                     if status and status != '未质控'])
+
+    def _trim(self) -> None:
+        deleted = self._conn.execute(
+            'DELETE FROM runs WHERE id <= (SELECT MAX(id) FROM runs) - ?', (self.max_records,)).rowcount
+        if deleted:
+            info(f"历史记录超过 {self.max_records} 条，已删除最早的 {deleted} 条。")
+
+    # ---- 查询 ----
+
+    def _rows(self, sql: str, params=()) -> List[List[str]]:
+        """执行查询（选出 id, row, header_id 三列），返回按当前表头对齐的数据行。"""
+        header = _current_header()
+        with self._lock:
+            rows, skipped = self._aligned_rows(self._conn.execute(sql, params), header)
+        _warn_skipped(skipped)
+        return rows
+
+    def last_runs(self, case_number: str, limit: int = 1) -> List[List[str]]:
+        """返回该病案最近的 limit 次运行记录（按当前表头对齐的 CSV 数据行，最新的在前）。"""
+        return self._rows('SELECT id, row, header_id FROM runs WHERE case_number = ? '
+                          'ORDER BY run_time DESC, id DESC LIMIT ?', (case_number, limit))
+
+    def runs_between(self, start: str, end: str) -> List[List[str]]:
+        """返回运行时间在 [start, end] 之间的记录，时间格式为 'YYYY-MM-DD HH:MM:SS'（可只写日期前缀）。"""
+        return self._rows('SELECT id, row, header_id FROM runs WHERE run_time >= ? AND run_time <= ? '
+                          'ORDER BY run_time, id', (start, end + '~'))
+
+    def runs_with_status(self, field: str, status: str = '未通过', limit: Optional[int] = None) -> List[List[str]]:
+        """
+        返回某字段质控状态为 status 的运行记录（最新的在前）。
+
+        :param field: 字段的中文名称（与 CSV 表头一致，例如 '身份证号'、'手术操作'）或内部键名
+        :param status: '通过' / '未通过' / '未读取'
+        """
+        return self._rows('SELECT r.id, r.row, r.header_id FROM field_status s JOIN runs r ON r.id = s.run_id '
+                          'WHERE s.field = ? AND s.status = ? ORDER BY s.run_id DESC LIMIT ?',
+                          (get_friendly_name(field), status, -1 if limit is None else limit))
+
+    def iter_rows(self, after_id: int = 0, batch_size: int = 1000):
+        """
+        按记录编号顺序逐批产出 (记录编号, 数据行) 列表，从编号大于 after_id 的记录开始。
+        数据行按当前表头对齐，无法对齐的旧记录跳过。
+        """
+        header = _current_header()
+        skipped = 0
+        while True:
+            with self._lock:
+                fetched = self._conn.execute(
+                    'SELECT id, row, header_id FROM runs WHERE id > ? ORDER BY id LIMIT ?',
+                    (after_id, batch_size)).fetchall()
+                batch, n = self._aligned_rows(fetched, header, keep_id=True)
+            skipped += n
+            if not fetched:
+                _warn_skipped(skipped)
+                return
+            if batch:
+                yield batch
+            after_id = fetched[-1][0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    # ---- 导出 ----
+
+    def export_csv(self, path: str, header: Optional[List[str]] = None) -> int:
+        """
+        按 records.csv 的格式导出全部记录（可直接用 Excel 打开），返回导出的记录数。
+        各记录按列名对齐到 header（默认为当前表头），无法对齐的旧记录跳过。
+        """
+        header = header or _current_header()
+        tmp = path + '.tmp'
+        count = skipped = 0
+        with self._lock, open(tmp, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            cursor = self._conn.execute('SELECT id, row, header_id FROM runs ORDER BY id')
+            while True:
+                fetched = cursor.fetchmany(1000)
+                if not fetched:
+                    break
+                rows, n = self._aligned_rows(fetched, header)
+                writer.writerows(rows)
+                count += len(rows)
+                skipped += n
+        os.replace(tmp, path)
+        _warn_skipped(skipped)
+        return count
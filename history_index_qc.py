@@ -0,0 +1,317 @@
+# history_index_qc.py
+"""
+Case-number offset index for records.csv, and a memory-mapped reader built on it.
+
+The sidecar file records.csv.idx holds one line per data row of the CSV:
+
+    <start byte offset>\t<end byte offset>\t<case number>
+
+The end offset of the last line is the tail pointer: everything before it is indexed.
+history_qc appends to the sidecar whenever it appends rows to the CSV and rebuilds it
+after compaction, so the index never has to be rebuilt from scratch during a session.
+Rows written without the index (older versions, crashes between the two appends) are
+picked up by scanning only the bytes after the tail pointer.
+
+Another process (backfill_qc) may replace records.csv with a file of any size. Before
+trusting the tail pointer the index therefore checks that the file is still the same
+one (device and inode numbers) and that the last indexed row still ends at the tail
+with the same case number. If either check fails, the index is rebuilt.
+
+Lookups then read just the bytes of the requested rows through mmap, instead of parsing
+the whole file: a case's history is O(k) in the number of its runs, "last N runs" O(N).
+"""
+from __future__ import annotations
+import csv
+import io
+import mmap
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from output import warning
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 'autoqc-index 1'
+BOM = b'\xef\xbb\xbf'
+
+
+def encode_rows(rows: List[List[str]]) -> List[bytes]:
+    """把记录编码为与 csv.writer 写入 records.csv 时相同的字节（每行以 \\r\\n 结尾）。"""
+    encoded = []
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        encoded.append(buffer.getvalue().encode('utf-8'))
+    return encoded
+
+
+def parse_line(data: bytes) -> List[str]:
+    """解析 scan_rows() 定位到的一行。"""
+    return next(csv.reader([data.decode('utf-8')]), [])
+
+
+def _case_number(line: bytes) -> str:
+    """取一行的第一列（病案号）；不带引号时不必解析整行。"""
+    if not line.startswith(b'"'):
+        comma = line.find(b',')
+        return (line[:comma] if comma >= 0 else line.rstrip(b'\r\n')).decode('utf-8')
+    row = parse_line(line)
+    return row[0] if row else ''
+
+
+def scan_rows(buf, start: int, end: int):
+    """
+    从 start 开始逐行扫描 buf[start:end]，产出 (行首偏移, 行尾偏移)。
+    引号内的换行不是行尾：行首到某个换行之间的引号数为偶数时，该换行才结束这一行。
+    """
+    pos = start
+    while pos < end:
+        quotes = 0
+        search = pos
+        while True:
+            nl = buf.find(b'\n', search, end)
+            if nl < 0:
+                return  # 最后一行不完整（正在写入），等下次再索引
+            quotes += buf[search:nl].count(b'"')
+            search = nl + 1
+            if quotes % 2 == 0:
+                break
+        yield pos, search
+        pos = search
+
+
+class HistoryIndex:
+    """
+    records.csv 的病案号偏移索引。
+
+    :param csv_path: 历史 CSV 文件路径，索引保存在 csv_path + '.idx'
+    """
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self.index_path = csv_path + INDEX_SUFFIX
+        self._lock = threading.RLock()
+        self._rows: List[Tuple[int, int, str]] = []     # 每条数据行的 (起始偏移, 结束偏移, 病案号)
+        self._by_case: Dict[str, List[int]] = {}         # {病案号: [行序号, ...]}
+        self._data_start = 0                             # 表头之后第一行数据的偏移
+        self._tail = 0                                   # 已索引到的字节位置
+        self._identity = None                            # 建立索引时 CSV 文件的 (st_dev, st_ino)
+        self._loaded = False
+
+    @property
+    def tail(self) -> int:
+        return self._tail
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.refresh()
+            return len(self._rows)
+
+    # ---- 维护 ----
+
+    def _add(self, start: int, end: int, case_number: str) -> None:
+        self._by_case.setdefault(case_number, []).append(len(self._rows))
+        self._rows.append((start, end, case_number))
+        self._tail = end
+
+    def _reset(self) -> None:
+        self._rows = []
+        self._by_case = {}
+        self._data_start = 0
+        self._tail = 0
+        self._identity = None
+
+    @staticmethod
+    def _file_identity(stat) -> Tuple[int, int]:
+        return stat.st_dev, stat.st_ino
+
+    def _same_file(self) -> bool:
+        try:
+            return self._identity is None or self._file_identity(os.stat(self.csv_path)) == self._identity
+        except OSError:
+            return False
+
+    def _matches_file(self) -> bool:
+        """已索引的最后一行是否仍在原位置（文件被替换或改写后通常不再成立）。"""
+        if not self._rows:
+            return self._ends_with_newline(self._tail)
+        start, end, case_number = self._rows[-1]
+        with open(self.csv_path, 'rb') as f:
+            f.seek(start)
+            line = f.read(end - start)
+        return len(line) == end - start and line.endswith(b'\n') and _case_number(line) == case_number
+
+    def _load(self) -> None:
+        """读取索引文件；与 CSV 文件对不上时（例如 CSV 被替换或截断）重建。"""
+        self._loaded = True
+        self._reset()
+        size = os.path.getsize(self.csv_path) if os.path.exists(self.csv_path) else 0
+        try:
+            with open(self.index_path, 'r', encoding='utf-8', newline='\n') as f:
+                if f.readline().rstrip('\n') != INDEX_VERSION:
+                    raise ValueError('索引版本不符')
+                self._data_start = self._tail = int(f.readline())
+                for line in f:
+                    start, end, case_number = line.rstrip('\n').split('\t', 2)
+                    self._add(int(start), int(end), case_number)
+            if self._tail > size or not self._matches_file():
+                raise ValueError('索引与历史文件不一致')
+            self._identity = self._file_identity(os.stat(self.csv_path))
+        except FileNotFoundError:
+            self.rebuild()
+        except Exception as e:
+            warning(f"历史索引无效，正在重建: {e}")
+            self.rebuild()
+
+    def _ends_with_newline(self, offset: int) -> bool:
+        if offset == 0:
+            return True
+        with open(self.csv_path, 'rb') as f:
+            f.seek(offset - 1)
+            return f.read(1) == b'\n'
+
+    def _write_index(self) -> None:
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(f"{INDEX_VERSION}\n{self._data_start}\n")
+            f.writelines(f"{start}\t{end}\t{case_number}\n" for start, end, case_number in self._rows)
+        os.replace(tmp, self.index_path)
+
+    def rebuild(self) -> None:
+        """扫描整个 CSV 文件重建索引（压缩历史文件之后调用）。"""
+        with self._lock:
+            self._loaded = True
+            self._reset()
+            if os.path.exists(self.csv_path) and os.path.getsize(self.csv_path) > 0:
+                with open(self.csv_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                    self._identity = self._file_identity(os.fstat(f.fileno()))
+                    rows = scan_rows(buf, len(BOM) if buf[:len(BOM)] == BOM else 0, len(buf))
+                    header = next(rows, None)
+                    if header is not None:
+                        self._data_start = self._tail = header[1]
+                        for start, end in rows:
+                            self._add(start, end, _case_number(buf[start:end]))
+            self._write_index()
+
+    def refresh(self) -> None:
+        """
+        把尾指针之后新增的行（未经 append 写入的行）补充到索引中。
+        文件被其他进程替换或改写（例如回填）时重建索引。
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            try:
+                stat = os.stat(self.csv_path)
+            except FileNotFoundError:
+                self._reset()
+                return
+            size = stat.st_size
+            if (size < self._tail or (self._tail == 0 and size > 0)
+                    or (self._identity is not None and self._file_identity(stat) != self._identity)):
+                # 文件被截断、替换，或索引建立时文件还不存在（尚未找到表头）
+                self.rebuild()
+                return
+            if size == self._tail:
+                return
+            if not self._matches_file():
+                # 同一文件被原地改写：尾指针之前的内容已经变化
+                self.rebuild()
+                return
+            added = []
+            with open(self.csv_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for start, end in scan_rows(buf, self._tail, size):
+                    added.append((start, end, _case_number(buf[start:end])))
+            self._append_entries(added)
+
+    def append(self, start: int, lines: List[bytes], case_numbers: List[str]) -> None:
+        """
+        记录刚追加到 CSV 文件中的行。
+
+        :param start: 第一行在文件中的起始偏移（追加前的文件大小）
+        :param lines: encode_rows() 编码后的各行
+        :param case_numbers: 各行的病案号
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if start != self._tail or not self._same_file():
+                # 尾指针之前还有未索引的行（例如上次追加后程序异常退出），或文件已被其他进程替换
+                self.refresh()
+                if start != self._tail:
+                    return
+            entries = []
+            for line, case_number in zip(lines, case_numbers):
+                entries.append((start, start + len(line), case_number))
+                start += len(line)
+            self._append_entries(entries)
+
+    def _append_entries(self, entries) -> None:
+        if not entries:
+            return
+        for start, end, case_number in entries:
+            self._add(start, end, case_number)
+        try:
+            with open(self.index_path, 'a', encoding='utf-8', newline='\n') as f:
+                f.writelines(f"{start}\t{end}\t{case_number}\n" for start, end, case_number in entries)
+        except Exception as e:
+            warning(f"更新历史索引失败: {e}")
+
+    # ---- 查询 ----
+
+    def case_offsets(self, case_number: str) -> List[Tuple[int, int]]:
+        """返回该病案各次运行的 (起始偏移, 结束偏移)，按写入顺序排列。"""
+        with self._lock:
+            self.refresh()
+            return [self._rows[i][:2] for i in self._by_case.get(case_number, [])]
+
+    def last_offsets(self, n: int) -> List[Tuple[int, int]]:
+        """返回最后 n 行的偏移，按写入顺序排列。"""
+        with self._lock:
+            self.refresh()
+            return [row[:2] for row in self._rows[-n:]] if n > 0 else []
+
+
+class HistoryReader:
+    """
+    通过 mmap 读取 records.csv 中的指定记录，只解析被请求的行。
+
+    每次查询时才映射文件、查询结束即释放，避免映射期间文件无法被压缩替换（Windows）。
+
+    :param csv_path: 历史 CSV 文件路径
+    :param index: 可选，共用的 HistoryIndex（history_qc 写入时维护的索引）
+    """
+
+    def __init__(self, csv_path: str, index: Optional[HistoryIndex] = None):
+        self.csv_path = csv_path
+        self.index = index if index is not None else HistoryIndex(csv_path)
+
+    def header(self) -> List[str]:
+        with open(self.csv_path, 'rb') as f:
+            line = f.readline()
+        return parse_line(line[len(BOM):] if line.startswith(BOM) else line)
+
+    def _read(self, offsets: List[Tuple[int, int]], as_dict: bool) -> List:
+        if not offsets:
+            return []
+        header = self.header() if as_dict else None
+        rows = []
+        with open(self.csv_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for start, end in offsets:
+                row = parse_line(buf[start:end])
+                rows.append(dict(zip(header, row)) if as_dict else row)
+        return rows
+
+    def case_history(self, case_number: str, limit: Optional[int] = None, as_dict: bool = True) -> List:
+        """返回该病案的历史记录，最新的在前；limit 限制条数。"""
+        offsets = self.index.case_offsets(case_number)
+        if limit is not None:
+            offsets = offsets[-limit:] if limit > 0 else []
+        return self._read(offsets[::-1], as_dict)
+
+    def last_runs(self, n: int, as_dict: bool = True) -> List:
+        """返回最近 n 次运行的记录，最新的在前。"""
+        return self._read(self.index.last_offsets(n)[::-1], as_dict)
@@ -2,16 +2,49 @@
 """
 Manage historical saving of quality-control runs according to the specified format.
 Simple fields are flattened, while complex lists (diagnoses, operations) are serialized
-into single cells. The file is trimmed to the last 5000 records.
+into single cells. Each run appends one row; the file is compacted to the last 5000 records
+on the first save of a session and whenever it grows past the compaction threshold.
+
+Set HISTORY_BACKEND = "sqlite" to keep the history in an indexed SQLite database
+(history_db_qc) instead; export_history_csv() then writes records.csv in the same layout.
 """
 from __future__ import annotations
 import os
 import csv
+import json
+import mmap
+import re
+import atexit
+import queue
+import threading
+import time
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple, Set
 
 from output import info, warning, error
-from extractor_qc import get_friendly_name
+from extractor_qc import get_friendly_name, NOT_READ, OPERATION_KEYS
+from validator_qc import checked_fields
+from history_index_qc import HistoryIndex, HistoryReader, BOM, encode_rows, scan_rows, parse_line
+from rollup_qc import rule_outcomes, update_rollups
+from identity_qc import update_identity_index
+
+# 历史记录的存储方式：
+#   "csv"    - 追加写入 records.csv
+#   "sqlite" - 写入 records.db（按病案号、运行时间、字段质控状态建立索引），需要时导出为 CSV
+HISTORY_BACKEND = "csv"
+
+# 后台写入：质控流程只把格式化好的记录放入队列，由后台线程成批写入磁盘，
+# 网络重定向的 AppData 目录写得慢时也不会拖慢质控。关闭后在质控线程中直接写入。
+ASYNC_HISTORY = True
+HISTORY_QUEUE_SIZE = 256      # 队列上限，写满后 save_run_snapshot 会等待（背压）
+GROUP_COMMIT_MAX = 64         # 每次最多合并写入的记录数
+GROUP_COMMIT_WINDOW = 0.05    # 取到第一条记录后再等待多久收集更多记录（秒）
+
+# 写入历史的同时累加汇总统计（按规则、字段、人员、手术科室、日期，见 rollup_qc）
+ROLLUPS_ENABLED = True
+
+# 写入历史的同时更新身份索引（身份证号、姓名+出生日期，见 identity_qc）
+IDENTITY_INDEX_ENABLED = True
 
 # ================= FIX START: 1. 同步 MAIN_FIELDS 列表 =================
 # 与最新的 extractor_qc.py 保持一致，移除了其他诊断字段
@@ -67,34 +100,9 @@ MAIN_FIELDS = [
 # ================= FIX END: 1. 同步 MAIN_FIELDS 列表 =================
 
 
-# ================= FIX START: 2. 同步 _get_qc_checked_fields 函数 =================
 def _get_qc_checked_fields() -> Set[str]:
-    """返回一个包含所有被 validator_qc.py 检查的字段内部键名的集合。"""
-    # 与最新的 validator_qc.py 保持同步，移除了 other_diagnoses
-    return {
-        # 必填项
-        "name", "gender", "id_card_number", "birth_date", "marriage_status",
-        "nationality", "occupation", "current_address", "contact_name",
-        "contact_relationship", "contact_phone", "tcm_outpatient_syndrome_code",
-        "tcm_discharge_treatment_principle_code", "tcm_discharge_treatment_principle_name",
-        'department_director', 'chief_physician', 'attending_physician',
-        'resident_physician', 'quality_control_physician', 'responsible_nurse', 'quality_control_nurse',
-        # 格式/逻辑检查
-        "current_address_phone", "household_address_phone", "work_unit_phone",
-        "marriage_status", "contact_relationship",
-        "tcm_preparation_fee", "tcm_preparation_usage", "tcm_treatment_fee", "tcm_technique_usage",
-        "discharge_method", "autopsy", "blood_fee", "blood_type", "rh",
-        "current_address_zip", "household_address_zip", "work_unit_zip",
-        "patient_source", "coder", "admission_condition", "tcm_discharge_condition",
-        "anesthesia_fee", "admission_times", "rescue_times", "critical_condition", "emergency_case",
-        "birth_place", "native_place", "work_unit",
-        "transferring_institution", "transferring_institution_Community",
-        # 地址字段本身也会被检查是否奇怪
-        "current_address", "household_address", "contact_address", "work_unit_address",
-        # 复杂字段作为整体被检查
-        "operations"
-    }
-# ================= FIX END: 2. 同步 _get_qc_checked_fields 函数 =================
+    """返回一个包含所有被 validator_qc.py 检查的字段内部键名的集合（由规则注册表中启用的规则得出）。"""
+    return checked_fields()
 
 
 def get_csv_path() -> str:
@@ -108,20 +116,94 @@ def get_csv_path() -> str:
             error(f"无法创建历史记录目录 {base}: {e}")
     return os.path.join(base, 'records.csv')
 
-def _serialize_list_of_dicts(items: List[Dict[str, Any]]) -> str:
-    """将字典列表序列化为紧凑的字符串，例如：'[(名称:xx,编码:yy),...]'"""
+
+# 手术操作列的编码：JSON 数组，每台手术一个对象，键为以下固定的短键名（只能新增，不能修改），
+# 值为空的字段省略。例如 [{"c":"中医操作001","n":"耳针","l":"无"}]
+OPERATION_SHORT_KEYS = {
+    "operation_code": "c", "operation_name": "n", "operation_date": "d", "operation_level": "l",
+    "surgeon": "s", "first_assistant": "a1", "second_assistant": "a2", "incision_healing": "h",
+    "anesthesia_method": "am", "anesthesiologist": "an", "operation_department": "dp",
+    "is_dsa": "dsa", "is_operation": "op",
+}
+_OPERATION_LONG_KEYS = {v: k for k, v in OPERATION_SHORT_KEYS.items()}
+
+# 旧格式 '[(手术及操作编码:xx,手术及操作名称:yy),...]' 中的“名称:”，名称长的优先匹配
+_LEGACY_FIELD_REGEX = re.compile('(?:^|,)(' + '|'.join(
+    re.escape(get_friendly_name(k)) for k in sorted(OPERATION_KEYS, key=lambda k: -len(get_friendly_name(k)))) + '):')
+_LEGACY_NAME_TO_KEY = {get_friendly_name(k): k for k in OPERATION_KEYS}
+
+
+def encode_operations(items: List[Dict[str, Any]]) -> str:
+    """将手术列表编码为紧凑的 JSON 字符串（见 OPERATION_SHORT_KEYS），空列表或未读取时返回空字符串。"""
     if not items:
         return ''
-    
-    serialized_items = []
+    encoded = []
     for item_dict in items:
         if not isinstance(item_dict, dict):
             continue
-        
-        parts = [f"{get_friendly_name(k)}:{v}" for k, v in item_dict.items()]
-        serialized_items.append(f"({','.join(parts)})")
-        
-    return f"[{','.join(serialized_items)}]"
+        encoded.append({OPERATION_SHORT_KEYS.get(k, k): v for k, v in item_dict.items() if v not in (None, '')})
+    return json.dumps(encoded, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_operations(text: str) -> List[Dict[str, str]]:
+    """
+    解析历史记录中的手术操作列，返回手术列表（键为 OPERATION_KEYS 中的键名，缺少的字段为空字符串）。
+    同时支持 JSON 编码和旧版本写入的 '[(名称:值,...),...]' 格式。
+    """
+    text = (text or '').strip()
+    if not text or text == '[]':
+        return []
+    if not text.startswith('[('):
+        return [_complete_operation({_OPERATION_LONG_KEYS.get(k, k): v for k, v in item.items()})
+                for item in json.loads(text)]
+    return [_complete_operation(item) for item in _decode_legacy_operations(text)]
+
+
+def _complete_operation(item: Dict[str, str]) -> Dict[str, str]:
+    operation = {key: '' for key in OPERATION_KEYS}
+    operation.update(item)
+    return operation
+
+
+def _decode_legacy_operations(text: str) -> List[Dict[str, str]]:
+    """解析旧格式。旧格式没有转义，值中含有“,字段名:”时无法区分，按字段名切分是能做到的最好结果。"""
+    body = text[2:-2] if text.endswith(')]') else text[2:]
+    operations = []
+    for chunk in body.split('),('):
+        matches = list(_LEGACY_FIELD_REGEX.finditer(chunk))
+        item = {}
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(chunk)
+            item[_LEGACY_NAME_TO_KEY[match.group(1)]] = chunk[match.end():end]
+        operations.append(item)
+    return operations
+
+
+def record_from_row(row: List[str], header: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    把一行历史记录还原为提取结果字典（与 extractor_qc.extract_all_data() 的格式相同），
+    可直接交给 validator_qc.validate_data() 离线重新校验。
+    状态为“未读取”的字段还原为 NOT_READ；header 默认为当前表头。
+
+    :param row: records.csv 中的一行
+    :param header: 该行对应的表头，列名为中文名称
+    """
+    columns = {name: i for i, name in enumerate(header or build_header())}
+
+    def cell(name):
+        i = columns.get(name)
+        return row[i] if i is not None and i < len(row) else ''
+
+    record = {'case_number_verify': cell('病案号')}
+    for key in MAIN_FIELDS:
+        name = get_friendly_name(key)
+        record[key] = NOT_READ if cell(f"{name}质控") == '未读取' else cell(name)
+    if cell('手术操作质控') == '未读取':
+        record['operations'] = NOT_READ
+    else:
+        record['operations'] = decode_operations(cell('手术操作'))
+    return record
+
 
 def build_header() -> List[str]:
     """根据 MAIN_FIELDS 列表构建固定的表头。"""
@@ -134,6 +216,7 @@ def build_header() -> List[str]:
     header.extend(['手术操作', '手术操作质控'])
     return header
 
+
 def format_row(extracted_data: Dict[str, Any], validation_results: List[Dict[str, Any]], case_number: Optional[str] = None) -> Tuple[List[str], List[str]]:
     """根据新的固定结构格式化表头和数据行。"""
     header = build_header()
@@ -156,17 +239,21 @@ def format_row(extracted_data: Dict[str, Any], validation_results: List[Dict[str
         
         friendly_name = get_friendly_name(key)
         status = '未质控'
-        if friendly_name in field_status_map:
+        if value is NOT_READ:
+            status = '未读取'
+        elif friendly_name in field_status_map:
             status = '未通过'
         elif key in qc_checked_fields:
             status = '通过'
         row.append(status)
 
     operations_data = extracted_data.get('operations', [])
-    row.append(_serialize_list_of_dicts(operations_data))
+    row.append(encode_operations(operations_data))
 
     op_status = '未质控'
-    if any('手术' in f or '操作' in f for f in field_status_map):
+    if operations_data is NOT_READ:
+        op_status = '未读取'
+    elif any('手术' in f or '操作' in f for f in field_status_map):
         op_status = '未通过'
     elif 'operations' in qc_checked_fields:
         op_status = '通过'
@@ -174,46 +261,408 @@ def format_row(extracted_data: Dict[str, Any], validation_results: List[Dict[str
 
     return header, row
 
-def save_run_snapshot(extracted_data: Dict[str, Any], validation_results: List[Dict[str, Any]], case_number: Optional[str] = None, max_records: int = 5000) -> bool:
+
+# 超过 max_records 的比例达到该值时压缩一次，压缩的开销分摊到多次保存上
+COMPACTION_SLACK = 0.2
+
+# {文件路径: 文件中的数据行数}，在本次会话第一次压缩（读取整个文件）后得到，之后每追加一行加 1
+_ROW_COUNTS: Dict[str, int] = {}
+
+# 历史文件的占用锁：records.csv.lock 上的进程级排他锁，进程退出（包括异常退出）时由系统释放
+LOCK_SUFFIX = '.lock'
+LOCK_WAIT_INTERVAL = 1.0
+_LOCK_FILES: Dict[str, Any] = {}
+_LOCK_FILES_LOCK = threading.Lock()
+
+
+def _try_lock(f) -> bool:
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def acquire_history_lock(path: Optional[str] = None, wait: bool = True) -> bool:
     """
-    将运行快照保存到 records.csv，并确保文件只保留最新的 max_records 条记录。
+    占用历史文件，直到本进程退出。写入历史的进程在第一次写入时占用；回填在开始前占用，
+    已被占用时拒绝运行，因此不会替换正在运行的质控程序还在追加的文件。
+
+    :param wait: 被占用时是否等待（写入时等待回填完成；等待后历史文件已被替换，重新加载）
+    :return: 是否已占用
+    """
+    path = path or get_csv_path()
+    with _LOCK_FILES_LOCK:
+        if path in _LOCK_FILES:
+            return True
+        f = open(path + LOCK_SUFFIX, 'a+b')
+        waited = False
+        while not _try_lock(f):
+            if not wait:
+                f.close()
+                return False
+            if not waited:
+                warning("历史文件正被其他进程（回填）占用，等待其完成后再保存质控历史。")
+                waited = True
+            time.sleep(LOCK_WAIT_INTERVAL)
+        _LOCK_FILES[path] = f
+    if waited:
+        reload_history(path)
+    return True
+
+
+def release_history_lock(path: Optional[str] = None) -> None:
+    """释放本进程对历史文件的占用（回填结束时调用；写入历史的进程一直占用到退出）。"""
+    path = path or get_csv_path()
+    with _LOCK_FILES_LOCK:
+        f = _LOCK_FILES.pop(path, None)
+        if f is None:
+            return
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            pass
+        f.close()
+
+
+def compact_history(path: Optional[str] = None, max_records: int = 5000, header: Optional[List[str]] = None) -> int:
+    """
+    压缩历史文件：只保留最新的 max_records 条记录，表头更新为 header（默认为当前表头）。
+    先写入临时文件再替换，压缩中途退出不会损坏原文件。
+
+    :return: 压缩后的数据行数
+    """
+    path = path or get_csv_path()
+    header = header or build_header()
+    acquire_history_lock(path)
+    records = []
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            try:
+                next(reader)
+                for row in reader:
+                    records.append(row)
+            except StopIteration:
+                pass
+
+    if len(records) > max_records:
+        records = records[-max_records:]
+        info(f"历史记录超过 {max_records} 条，已截断为最新的 {len(records)} 条。")
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(records)
+    os.replace(tmp, path)
+    _ROW_COUNTS[path] = len(records)
+    get_history_index(path).rebuild()
+    return len(records)
+
+
+def append_history_row(path: str, header: List[str], row: List[str], max_records: int = 5000) -> None:
+    """
+    向历史文件追加一行，开销与历史长度无关。
+    本次会话第一次写入该文件时，以及行数超过 max_records * (1 + COMPACTION_SLACK) 时先压缩。
+    """
+    append_history_rows(path, header, [row], max_records)
+
+
+def append_history_rows(path: str, header: List[str], rows: List[List[str]], max_records: int = 5000) -> None:
+    """一次追加多行（打开一次文件），压缩规则同 append_history_row。"""
+    acquire_history_lock(path)
+    if (path not in _ROW_COUNTS or not os.path.exists(path)
+            or _ROW_COUNTS[path] + len(rows) > max_records * (1 + COMPACTION_SLACK)):
+        compact_history(path, max_records, header)
+    # 表头只在新建文件或压缩时写入，追加时不能再写 BOM；按字节追加以便记录各行的偏移
+    lines = encode_rows(rows)
+    with open(path, 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        start = f.tell()
+        f.write(b''.join(lines))
+    _ROW_COUNTS[path] += len(rows)
+    get_history_index(path).append(start, lines, [str(row[0]) for row in rows])
+
+
+def save_run_snapshot(extracted_data: Dict[str, Any], validation_results: List[Dict[str, Any]], case_number: Optional[str] = None, max_records: int = 5000, rule_results: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    将运行快照追加到 records.csv；文件定期压缩，只保留最新的 max_records 条记录（见 append_history_row）。
+    rule_results 为 validator_qc.validate_data() 收集的各规则结果，保存在内存快照中供下一次增量校验使用，
+    并用于按规则累加汇总统计。
+    ASYNC_HISTORY 开启时只在当前线程格式化记录（可能需要补读界面字段），写入磁盘由后台线程完成。
     """
     try:
-        path = get_csv_path()
         header, new_row = format_row(extracted_data, validation_results, case_number)
-        
-        records = []
-        if os.path.exists(path) and os.path.getsize(path) > 0:
-            with open(path, 'r', newline='', encoding='utf-8-sig') as f:
-                reader = csv.reader(f)
-                try:
-                    next(reader) 
-                    for row in reader:
-                        records.append(row)
-                except StopIteration:
-                    pass
-        
-        records.append(new_row)
-        
-        if len(records) > max_records:
-            records = records[-max_records:]
-            info(f"历史记录超过 {max_records} 条，已截断为最新的 {len(records)} 条。")
-
-        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
-            writer.writerows(records)
-            
+        outcomes = rule_outcomes(rule_results)
+        if ASYNC_HISTORY:
+            get_history_writer().submit(header, new_row, max_records, outcomes)
+        else:
+            write_history_rows(header, [new_row], max_records, [outcomes])
+
         global _LAST_SNAPSHOT
-        _LAST_SNAPSHOT = {'extracted': extracted_data, 'validation': validation_results, 'case_number': case_number}
+        # 按需读取的记录对象仍引用界面控件，只保存已读取的值
+        to_dict = getattr(extracted_data, 'to_dict', None)
+        extracted = to_dict() if callable(to_dict) else extracted_data
+        _LAST_SNAPSHOT = {'extracted': extracted, 'validation': validation_results, 'case_number': case_number,
+                          'rule_results': rule_results}
         return True
 
     except Exception as e:
         error(f"保存或截断质控历史失败: {e}")
         return False
 
+
 _LAST_SNAPSHOT = None
 
+
 def get_last_snapshot() -> Optional[Dict[str, Any]]:
     """返回最后一次保存的快照。"""
     return _LAST_SNAPSHOT
+
+
+def write_history_rows(header: List[str], rows: List[List[str]], max_records: int = 5000,
+                       outcomes: Optional[List[Optional[Dict[str, bool]]]] = None) -> None:
+    """
+    把已格式化的记录写入当前的历史存储（CSV 或 SQLite），并累加汇总统计。
+
+    :param outcomes: 各行对应的规则结果（rollup_qc.rule_outcomes()），None 表示不统计规则
+    """
+    if HISTORY_BACKEND == "sqlite":
+        get_history_store(max_records).save_many([(header, row) for row in rows])
+    else:
+        append_history_rows(get_csv_path(), header, rows, max_records)
+    if ROLLUPS_ENABLED:
+        try:
+            update_rollups(header, rows, outcomes or [None] * len(rows))
+        except Exception as e:
+            warning(f"更新质控汇总统计失败（可运行 python rollup_qc.py rebuild 重建）: {e}")
+    if IDENTITY_INDEX_ENABLED:
+        try:
+            update_identity_index(header, rows)
+        except Exception as e:
+            warning(f"更新身份索引失败（可运行 python identity_qc.py rebuild 重建）: {e}")
+
+
+class HistoryWriter:
+    """
+    后台历史写入线程。记录经有界队列交给写入线程，每次把队列中已有的记录合并为一次写入
+    （CSV 打开一次文件，SQLite 一个事务）。
+
+    metrics() 返回背压指标：队列深度、因队列已满而等待的次数与时间、每次写入的记录数与耗时。
+    """
+
+    def __init__(self, maxsize: int = HISTORY_QUEUE_SIZE):
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'written': 0, 'failed': 0, 'flushes': 0,
+                       'max_depth': 0, 'blocked': 0, 'blocked_seconds': 0.0,
+                       'last_flush_seconds': 0.0, 'total_flush_seconds': 0.0, 'max_flush_seconds': 0.0,
+                       'max_batch': 0}
+        self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, header: List[str], row: List[str], max_records: int = 5000,
+               outcomes: Optional[Dict[str, bool]] = None) -> None:
+        """放入一条记录；队列已满时等待写入线程腾出空间。"""
+        item = (header, row, max_records, outcomes)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            self._queue.put(item)
+            with self._lock:
+                self._stats['blocked'] += 1
+                self._stats['blocked_seconds'] += time.perf_counter() - start
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待队列中的记录全部写入；超时返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_flush_seconds'] = stats['total_flush_seconds'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + GROUP_COMMIT_WINDOW
+            while len(batch) < GROUP_COMMIT_MAX:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write(self, batch) -> None:
+        start = time.perf_counter()
+        failed = 0
+        # 同一批记录的表头和保留条数相同（除非中途修改了配置），按相邻分组写入
+        i = 0
+        while i < len(batch):
+            header, _, max_records, _ = batch[i]
+            j = i
+            while j < len(batch) and batch[j][0] == header and batch[j][2] == max_records:
+                j += 1
+            try:
+                write_history_rows(header, [item[1] for item in batch[i:j]], max_records,
+                                   [item[3] for item in batch[i:j]])
+            except Exception as e:
+                failed += j - i
+                error(f"保存质控历史失败: {e}")
+            i = j
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            s = self._stats
+            s['flushes'] += 1
+            s['written'] += len(batch) - failed
+            s['failed'] += failed
+            s['max_batch'] = max(s['max_batch'], len(batch))
+            s['last_flush_seconds'] = elapsed
+            s['total_flush_seconds'] += elapsed
+            s['max_flush_seconds'] = max(s['max_flush_seconds'], elapsed)
+
+
+_HISTORY_WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_history_writer() -> HistoryWriter:
+    """返回后台历史写入线程（首次调用时启动，进程退出前自动写完队列中的记录）。"""
+    global _HISTORY_WRITER
+    with _WRITER_LOCK:
+        if _HISTORY_WRITER is None:
+            _HISTORY_WRITER = HistoryWriter()
+            atexit.register(flush_history)
+    return _HISTORY_WRITER
+
+
+def flush_history(timeout: Optional[float] = None) -> bool:
+    """等待后台写入线程写完队列中的历史记录（程序关闭前调用）。未启动后台写入时直接返回 True。"""
+    if _HISTORY_WRITER is None:
+        return True
+    return _HISTORY_WRITER.flush(timeout)
+
+
+def get_history_metrics() -> Dict[str, Any]:
+    """返回后台历史写入的指标（队列深度、写入耗时等），未启动时返回空字典。"""
+    return _HISTORY_WRITER.metrics() if _HISTORY_WRITER is not None else {}
+
+
+_HISTORY_INDEXES: Dict[str, HistoryIndex] = {}
+
+
+def get_history_index(path: Optional[str] = None) -> HistoryIndex:
+    """返回 records.csv 的病案号偏移索引（索引文件 records.csv.idx 随写入增量更新）。"""
+    path = path or get_csv_path()
+    index = _HISTORY_INDEXES.get(path)
+    if index is None:
+        index = _HISTORY_INDEXES.setdefault(path, HistoryIndex(path))
+    return index
+
+
+def reload_history(path: Optional[str] = None) -> None:
+    """历史文件被外部改写（例如回填）后调用：重建偏移索引，下次写入前重新统计行数。"""
+    path = path or get_csv_path()
+    _ROW_COUNTS.pop(path, None)
+    get_history_index(path).rebuild()
+
+
+def iter_history_rows():
+    """逐行产出全部历史记录 (表头, 数据行)，数据来源与 HISTORY_BACKEND 一致。"""
+    flush_history()
+    if HISTORY_BACKEND == "sqlite":
+        header = build_header()
+        for batch in get_history_store().iter_rows():
+            for _, row in batch:
+                yield header, row
+        return
+    path = get_csv_path()
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        rows = scan_rows(buf, len(BOM) if buf[:len(BOM)] == BOM else 0, len(buf))
+        first = next(rows, None)
+        if first is None:
+            return
+        header = parse_line(buf[first[0]:first[1]])
+        for start, end in rows:
+            yield header, parse_line(buf[start:end])
+
+
+def get_history_reader(path: Optional[str] = None) -> HistoryReader:
+    """
+    返回 records.csv 的随机访问读取器，例如：
+      get_history_reader().case_history('2025123456', limit=3)   # 该病案最近 3 次质控
+      get_history_reader().last_runs(20)                         # 最近 20 次质控
+    """
+    flush_history()
+    path = path or get_csv_path()
+    return HistoryReader(path, get_history_index(path))
+
+
+_HISTORY_STORE = None
+
+
+def get_history_store(max_records: int = 5000):
+    """返回 SQLite 历史记录库（首次调用时打开）。"""
+    global _HISTORY_STORE
+    if _HISTORY_STORE is None:
+        from history_db_qc import SQLiteHistoryStore
+        _HISTORY_STORE = SQLiteHistoryStore(max_records=max_records)
+    return _HISTORY_STORE
+
+
+def get_last_run(case_number: str) -> Optional[Dict[str, str]]:
+    """
+    返回该病案最近一次质控的历史记录（{表头: 值}），没有记录时返回 None。
+    SQLite 存储与 CSV 存储都通过索引直接定位，不解析其他病案的记录。
+    """
+    flush_history()
+    if HISTORY_BACKEND == "sqlite":
+        rows = get_history_store().last_runs(case_number, 1)
+        return dict(zip(build_header(), rows[0])) if rows else None
+
+    if not os.path.exists(get_csv_path()):
+        return None
+    rows = get_history_reader().case_history(case_number, limit=1)
+    return rows[0] if rows else None
+
+
+def export_history_csv(path: Optional[str] = None) -> str:
+    """
+    确保 records.csv 反映最新的历史记录并返回其路径：SQLite 存储时按 CSV 格式导出，CSV 存储时直接返回。
+    """
+    path = path or get_csv_path()
+    flush_history()
+    if HISTORY_BACKEND == "sqlite":
+        count = get_history_store().export_csv(path, build_header())
+        info(f"已导出 {count} 条历史记录到 {path}")
+    return path
@@ -0,0 +1,291 @@
+# identity_qc.py
+"""
+Persistent identity index over QC history, for cross-record checks that a single record
+cannot catch:
+
+- the same ID card number registered with a different name, birth date or gender
+- the same person (ID card number, or name + birth date) with the same admission count
+  (住院次数) under two different case numbers, i.e. a duplicate record
+
+The index is kept as two hash maps, keyed by ID card number and by (name, birth date).
+Looking up a record is O(1) and never scans the history. It is stored as an append-only
+log (identity.log in the autoqc directory). A later line for a case number replaces the
+earlier one. The log is loaded on first use and compacted once it is mostly superseded
+lines.
+
+History writing updates the index (history_qc.write_history_rows). During interactive QC,
+main_qc attaches the index to the validator (validator_qc.set_identity_index) so the
+身份一致性 rule can query it. Rebuild the index from the stored history with:
+
+    python identity_qc.py rebuild
+"""
+from __future__ import annotations
+import os
+import re
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from output import info, warning
+from extractor_qc import get_friendly_name, NOT_READ
+
+LOG_FILE_NAME = 'identity.log'
+
+# 索引使用的字段；身份一致性规则读取这些字段
+IDENTITY_FIELDS = ("case_number_verify", "id_card_number", "name", "birth_date", "gender", "admission_times")
+
+# 日志中被覆盖的行超过该数量（且超过有效条目数）时重写日志
+COMPACT_MIN_STALE = 1000
+
+# 冲突信息中最多列出的病案号个数
+MAX_LISTED_CASES = 3
+
+_EMPTY_VALUES = ('', '-', '无', '不详', '未读取')
+_NON_DIGIT_REGEX = re.compile(r'\D')
+
+
+def _clean(value) -> str:
+    if value is None or value is NOT_READ:
+        return ''
+    text = str(value).strip()
+    return '' if text in _EMPTY_VALUES else text
+
+
+def normalize_identity(data) -> Tuple[str, str, str, str, str, str]:
+    """
+    从记录（字典或 LazyRecord）中取出并规范化索引字段。
+
+    :return: (病案号, 身份证号, 姓名, 出生日期(YYYYMMDD), 性别, 住院次数)
+    """
+    birth = _clean(data.get("birth_date"))
+    digits = _NON_DIGIT_REGEX.sub('', birth)
+    return (
+        _clean(data.get("case_number_verify")),
+        _clean(data.get("id_card_number")).upper(),
+        _clean(data.get("name")),
+        digits if len(digits) == 8 else birth,
+        _clean(data.get("gender")),
+        _clean(data.get("admission_times")),
+    )
+
+
+def get_identity_log_path() -> str:
+    from history_qc import get_csv_path
+    return os.path.join(os.path.dirname(get_csv_path()), LOG_FILE_NAME)
+
+
+class IdentityIndex:
+    """
+    身份哈希索引。
+
+    :param path: 日志文件路径，默认为 get_identity_log_path()；空字符串表示只在内存中保存
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = get_identity_log_path() if path is None else path
+        self._lock = threading.RLock()
+        self._cases: Dict[str, Tuple[str, ...]] = {}          # {病案号: normalize_identity() 的结果}
+        self._by_id: Dict[str, Dict[str, None]] = {}          # {身份证号: {病案号, ...}}（有序集合）
+        self._by_name_birth: Dict[Tuple[str, str], Dict[str, None]] = {}
+        self._log_lines = 0
+        self._loaded = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._cases)
+
+    # ---- 维护 ----
+
+    def _index(self, entry) -> None:
+        case_number, id_card, name, birth = entry[:4]
+        old = self._cases.pop(case_number, None)
+        if old is not None:
+            self._unlink(self._by_id, old[1], case_number)
+            self._unlink(self._by_name_birth, (old[2], old[3]), case_number)
+        self._cases[case_number] = entry
+        if id_card:
+            self._by_id.setdefault(id_card, {})[case_number] = None
+        if name and birth:
+            self._by_name_birth.setdefault((name, birth), {})[case_number] = None
+
+    @staticmethod
+    def _unlink(mapping, key, case_number) -> None:
+        cases = mapping.get(key)
+        if cases is not None:
+            cases.pop(case_number, None)
+            if not cases:
+                del mapping[key]
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8', newline='\n') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 6 and parts[0]:
+                        self._index(tuple(parts))
+                        self._log_lines += 1
+        except Exception as e:
+            warning(f"读取身份索引失败，可运行 python identity_qc.py rebuild 重建: {e}")
+
+    @staticmethod
+    def _format(entry) -> str:
+        return '\t'.join(v.replace('\t', ' ').replace('\n', ' ').replace('\r', ' ') for v in entry) + '\n'
+
+    def add(self, records) -> None:
+        """
+        把若干次质控的记录加入索引并追加到日志。同一病案号的新记录替换旧记录。
+
+        :param records: 记录字典（或任何带 get() 的对象）的可迭代对象
+        """
+        entries = [normalize_identity(data) for data in records]
+        entries = [e for e in entries if e[0] and (e[1] or (e[2] and e[3]))]
+        if not entries:
+            return
+        with self._lock:
+            self._load()
+            changed = [e for e in entries if self._cases.get(e[0]) != e]
+            for entry in changed:
+                self._index(entry)
+            if not changed or not self.path:
+                return
+            try:
+                with open(self.path, 'a', encoding='utf-8', newline='\n') as f:
+                    f.writelines(self._format(e) for e in changed)
+                self._log_lines += len(changed)
+                stale = self._log_lines - len(self._cases)
+                if stale > COMPACT_MIN_STALE and stale > len(self._cases):
+                    self._compact()
+            except Exception as e:
+                warning(f"更新身份索引失败: {e}")
+
+    def _compact(self) -> None:
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+            f.writelines(self._format(e) for e in self._cases.values())
+        os.replace(tmp, self.path)
+        self._log_lines = len(self._cases)
+
+    def rebuild(self, records) -> int:
+        """清空索引并根据 records 重新建立，返回索引中的病案数。"""
+        with self._lock:
+            self._loaded = True
+            self._cases.clear()
+            self._by_id.clear()
+            self._by_name_birth.clear()
+            for data in records:
+                entry = normalize_identity(data)
+                if entry[0] and (entry[1] or (entry[2] and entry[3])):
+                    self._index(entry)
+            if self.path:
+                self._compact()
+            return len(self._cases)
+
+    # ---- 查询 ----
+
+    def _others(self, mapping, key, case_number) -> List[Tuple[str, ...]]:
+        # 最近登记的病案在前
+        return [self._cases[c] for c in reversed(list(mapping.get(key, ()))) if c != case_number]
+
+    def conflicts(self, data) -> List[Dict[str, str]]:
+        """
+        返回记录与索引中其他病案的身份冲突问题（格式同 validate_data 的问题列表）。
+        只查找身份证号、姓名+出生日期相同的病案，不扫描历史。
+        """
+        case_number, id_card, name, birth, gender, admission = normalize_identity(data)
+        issues = []
+        with self._lock:
+            self._load()
+            same_id = self._others(self._by_id, id_card, case_number) if id_card else []
+            same_person = self._others(self._by_name_birth, (name, birth), case_number) if name and birth else []
+
+        # 1. 同一身份证号，姓名/出生日期/性别不一致
+        labels = (("name", 2, name), ("birth_date", 3, birth), ("gender", 4, gender))
+        mismatched = []
+        for other in same_id:
+            diffs = [f"{get_friendly_name(key)}为“{other[i]}”" for key, i, mine in labels
+                     if mine and other[i] and other[i] != mine]
+            if diffs:
+                mismatched.append(f"病案 {other[0]}（{'，'.join(diffs)}）")
+        if mismatched:
+            issues.append({
+                'level': '警告',
+                'field': get_friendly_name("id_card_number"),
+                'message': f"身份证号 '{id_card}' 在其他病案中登记的信息与本病案不一致："
+                           f"{'；'.join(mismatched[:MAX_LISTED_CASES])}，请核实患者身份。"
+            })
+
+        # 2. 姓名、出生日期相同但身份证号不同（可能是同名同生日的不同患者）
+        different_id = [o[0] for o in same_person if id_card and o[1] and o[1] != id_card]
+        if different_id:
+            issues.append({
+                'level': '注意',
+                'field': f"{get_friendly_name('name')}/{get_friendly_name('birth_date')}",
+                'message': f"姓名与出生日期相同的病案 {'、'.join(different_id[:MAX_LISTED_CASES])} "
+                           f"登记的身份证号与本病案不同，请确认是否为同一患者。"
+            })
+
+        # 3. 同一患者、同一住院次数登记为不同病案号（重复建档）
+        if admission:
+            same_patient = {o[0]: o for o in same_id}
+            for o in same_person:
+                if not (id_card and o[1]) or o[1] == id_card:
+                    same_patient.setdefault(o[0], o)
+            duplicates = [c for c, o in same_patient.items() if o[5] == admission]
+            if duplicates:
+                issues.append({
+                    'level': '警告',
+                    'field': get_friendly_name("admission_times"),
+                    'message': f"同一患者第 {admission} 次住院已登记为病案 {'、'.join(duplicates[:MAX_LISTED_CASES])}，"
+                               f"请核实是否重复建档。"
+                })
+        return issues
+
+
+_IDENTITY_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_identity_index() -> IdentityIndex:
+    """返回持久化的身份索引（首次使用时读取日志）。"""
+    global _IDENTITY_INDEX
+    with _INDEX_LOCK:
+        if _IDENTITY_INDEX is None:
+            _IDENTITY_INDEX = IdentityIndex()
+    return _IDENTITY_INDEX
+
+
+def _row_records(header, rows):
+    """把历史数据行转换为只含索引字段的记录。"""
+    columns = {name: i for i, name in enumerate(header)}
+    keys = [(key, columns.get('病案号' if key == 'case_number_verify' else get_friendly_name(key)))
+            for key in IDENTITY_FIELDS]
+    for row in rows:
+        yield {key: (row[i] if i is not None and i < len(row) else '') for key, i in keys}
+
+
+def update_identity_index(header, rows) -> None:
+    """把刚写入历史的若干行加入身份索引（由 history_qc 在写入历史后调用）。"""
+    get_identity_index().add(_row_records(header, rows))
+
+
+def rebuild_identity_index() -> int:
+    """根据全部历史重新建立身份索引，返回索引中的病案数。"""
+    from history_qc import iter_history_rows
+    count = get_identity_index().rebuild(
+        record for header, row in iter_history_rows() for record in _row_records(header, [row]))
+    info(f"身份索引已重建：共 {count} 个病案。")
+    return count
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild"]:
+        rebuild_identity_index()
+    else:
+        print("用法: python identity_qc.py rebuild")
+        sys.exit(2)
@@ -1,28 +1,41 @@
 # main_qc.py
 import sys
 from output import info, success, warning, error, step, print_exception
-from validator_qc import validate_data
-from reporter_qc import generate_report
-from history_qc import save_run_snapshot
+from validator_qc import validate_data, rule_input_fields, StreamingValidator, summarize_reuse, set_identity_index
+from reporter_qc import generate_report, begin_report, report_issue, finish_report
+import history_qc
+from history_qc import save_run_snapshot, get_last_snapshot
+from identity_qc import get_identity_index
+from backend_qc import get_backend, ControlNotFoundError, WindowAmbiguousError
+from extractor_qc import get_friendly_name
 
-# 仅在非测试模式下导入 pywinauto 相关模块
 TEST_MODE = 0  # 切换测试模式
 
+# 提取方案：
+#   "full" - 按需读取：校验只读取规则需要的字段，报告生成后再由历史记录补读其余字段
+#   "qc"   - 仅质控：只读取启用的规则需要的字段，其余字段不访问界面（历史中记为“未读取”）
+EXTRACTION_PROFILE = "full"
+
+# "full" 方案下报告生成后为历史记录补读其余字段的时间预算（秒），None 表示不限时。
+# 校验使用的提取预算此时通常已用完，补读另行计时，否则历史中的这些字段都会记为“未读取”。
+HISTORY_READ_BUDGET = None
+
+# 流式质控：边读取边校验，规则的输入字段一到齐就执行并立即输出问题，
+# 不必等全部字段读取完毕。关闭后按“提取 → 校验 → 报告”顺序执行。
+STREAMING = True
+
 if not TEST_MODE:
-    from pywinauto import Application
-    from pywinauto.findwindows import ElementNotFoundError, ElementAmbiguousError
-    import time
-    from extractor_qc import extract_all_data
+    from extractor_qc import LazyRecord
 else:
     from test_data import get_test_data, get_additional_test_cases
 
-def activate_window(app, window_title):
+def activate_window(backend, window_title):
     """
-    连接并激活目标窗口。
+    通过 UI 后端连接并激活目标窗口。
     """
     try:
         info(f"正在连接窗口: '{window_title}'")
-        dlg = app.connect(title=window_title, timeout=10).window(title=window_title)
+        dlg = backend.connect(window_title, timeout=10)
         success("窗口连接成功。")
         
         if dlg.is_minimized():
@@ -35,27 +48,29 @@ def activate_window(app, window_title):
         
         return dlg
 
-    except ElementAmbiguousError:
+    except WindowAmbiguousError:
         error(f"检测到多个标题为 '{window_title}' 的窗口。请只保留一个目标窗口后重试。")
         return None
-    except ElementNotFoundError:
+    except ControlNotFoundError:
         error(f"找不到窗口标题为 '{window_title}' 的应用。请确保程序正在运行且标题匹配。")
         return None
     except Exception as e:
         print_exception(e, "连接或激活窗口时发生未知错误")
         return None
 
-def run_quality_control(test_case_index=None, progress_callback=None):
+def run_quality_control(test_case_index=None, progress_callback=None, backend=None):
     """
     执行首页质控的主流程。
 
     :param test_case_index: 在测试模式下，指定要使用的测试用例索引。
     :param progress_callback: 用于传递进度的回调或 PyQt 信号。
+    :param backend: UI 后端，默认为 pywinauto 后端（可替换为 sim_qc 中的模拟后端）。
     :return: (case_number, total_checks, num_issues) on success, None on failure.
     """
     import time
 
-    def report_progress(percent, message):
+    def report_progress(percent, message, pause=True):
+        # pause：短暂休眠以便界面刷新。开始读取界面之后不能休眠，否则会占用提取时间预算（LazyRecord）
         if not progress_callback:
             return
         try:
@@ -65,7 +80,11 @@ def run_quality_control(test_case_index=None, progress_callback=None):
                 progress_callback(int(percent), str(message))
             except Exception:
                 pass
-        time.sleep(0.18)
+        if pause:
+            time.sleep(0.18)
+
+    def report_reading(percent, message):
+        report_progress(percent, message, pause=False)
 
     try:
         report_progress(5, "正在初始化...")
@@ -83,28 +102,49 @@ def run_quality_control(test_case_index=None, progress_callback=None):
         else:
             report_progress(15, "正在连接目标窗口...")
             window_title = "首页录入"
-            app = Application(backend="win32")
-            dlg = activate_window(app, window_title)
+            backend = backend or get_backend()
+            dlg = activate_window(backend, window_title)
             if not dlg:
                 error("未能获取到目标窗口，程序退出。")
                 report_progress(100, "错误：未找到目标窗口")
                 return None
 
             report_progress(40, "正在提取界面数据...")
-            extracted_data = extract_all_data(dlg)
+            info("▶ 开始从界面提取数据（按需读取）...")
+            fields = rule_input_fields() if EXTRACTION_PROFILE == "qc" else None
+            extracted_data = LazyRecord(dlg, backend=backend, fields=fields)
             if not extracted_data:
                 warning("未能从界面提取到任何数据，无法进行校验。")
                 report_progress(100, "警告：未提取到数据")
                 return None
 
-        report_progress(70, "正在校验数据逻辑...")
-        validation_results, case_number, total_checks = validate_data(extracted_data)
-
-        report_progress(90, "正在生成质控报告...")
-        generate_report(validation_results, case_number, total_checks)
+        # 跨病案身份一致性检查：查询由历史记录维护的身份索引（开关在运行时读取，关闭后不再查询）
+        set_identity_index(get_identity_index() if history_qc.IDENTITY_INDEX_ENABLED else None)
 
+        # 增量校验：同一病案号再次质控时，输入字段未变化的规则沿用上一次的结果
+        previous = get_last_snapshot()
+        rule_results = {}
+        if STREAMING:
+            validation_results, case_number, total_checks = stream_quality_control(
+                extracted_data, report_reading, previous=previous, rule_results=rule_results)
+        else:
+            report_reading(70, "正在校验数据逻辑...")
+            skipped_rules = []
+            validation_results, case_number, total_checks = validate_data(
+                extracted_data, skipped_rules, previous, rule_results)
+
+            report_reading(90, "正在生成质控报告...")
+            generate_report(validation_results, case_number, total_checks, skipped_rules,
+                            _rule_reuse(previous, case_number, rule_results))
+        ui_reads = getattr(extracted_data, 'reads', None)
+        if ui_reads is not None:
+            info(f"校验共读取界面字段 {ui_reads} 个。")
+
+        extend_budget = getattr(extracted_data, 'extend_budget', None)
+        if EXTRACTION_PROFILE == "full" and callable(extend_budget):
+            extend_budget(HISTORY_READ_BUDGET)
         try:
-            save_run_snapshot(extracted_data, validation_results, case_number)
+            save_run_snapshot(extracted_data, validation_results, case_number, rule_results=rule_results)
         except Exception as e:
             print_exception(e, "保存质控历史时发生错误")
 
@@ -116,6 +156,52 @@ def run_quality_control(test_case_index=None, progress_callback=None):
         report_progress(100, f"错误: {e}")
         return None
 
+def _rule_reuse(previous, case_number, rule_results):
+    """上一次运行是同一病案号时返回增量校验的统计，否则返回 None（不输出统计）。"""
+    if previous and previous.get('rule_results') and previous.get('case_number') == case_number:
+        return summarize_reuse(rule_results)
+    return None
+
+def stream_quality_control(record, report_progress=None, start=40, end=90, previous=None, rule_results=None):
+    """
+    流式执行校验与报告：按规则顺序逐个读取字段，每读取一个字段就把它交给 StreamingValidator，
+    新发现的问题立即输出到报告（以及 GUI 日志）。
+
+    :param record: 记录（LazyRecord 或普通字典），按键读取时才访问界面
+    :param report_progress: 可选的进度回调 report_progress(percent, message)
+    :param start: 读取开始时的进度百分比
+    :param end: 读取结束时的进度百分比
+    :param previous: 可选，上一次运行的快照（history_qc.get_last_snapshot()），用于增量校验
+    :param rule_results: 可选字典，用于收集各规则的结果（见 validate_data）
+    :return: tuple (validation_results, case_number, check_count)，与 validate_data() 一致
+    """
+    stream = StreamingValidator(previous=previous)
+    case_number = record.get("case_number_verify", "")
+    begin_report(case_number)
+    info("▶ 开始数据校验（流式）...")
+
+    order = stream.field_order()
+    stream.feed("case_number_verify", case_number)
+    last_step = None
+    for n, field in enumerate(order, 1):
+        for item in stream.feed(field, record.get(field)):
+            report_issue(item)
+        # 每前进约 10% 才更新一次进度，减少发往界面的信号；回调不应休眠，读取受提取时间预算限制
+        percent = start + (end - start) * n // len(order)
+        if report_progress and percent // 10 != last_step:
+            last_step = percent // 10
+            report_progress(percent, f"正在读取并校验: {get_friendly_name(field)}")
+
+    validation_results, case_number, check_count, new_items = stream.finish(record)
+    for item in new_items:
+        report_issue(item)
+    info("✔ 数据校验完成。")
+    if rule_results is not None:
+        rule_results.update(stream.rule_results)
+    finish_report(validation_results, check_count, stream.skipped_rules(),
+                  _rule_reuse(previous, case_number, stream.rule_results))
+    return validation_results, case_number, check_count
+
 def test_all_cases():
     """
     运行所有测试用例
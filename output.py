@@ -72,10 +72,22 @@ def add_counts(total: int = 0, issues: int = 0) -> None:
     except Exception:
         pass
 
+# --- 静默模式：批量校验时不逐条输出到控制台和 GUI ---
+_quiet = False
+
+def set_quiet(quiet: bool = True) -> bool:
+    """开启或关闭静默模式，返回之前的状态，便于调用方恢复。"""
+    global _quiet
+    previous = _quiet
+    _quiet = bool(quiet)
+    return previous
+
 # --- Public Logging Functions ---
 
 def _log_and_emit(log_level_func, console_message: str, gui_message: Optional[str] = None):
     """Helper to log to console and emit signal for GUI (HTML)."""
+    if _quiet:
+        return
     log_level_func(console_message)
     if QT_AVAILABLE:
         if gui_message is None:
@@ -0,0 +1,318 @@
+# region_qc.py
+# 行政区划索引：把省/市/区县名称（及其简称）编译为 Aho-Corasick 自动机，对每个地址只扫描一遍就能
+# 找出其中出现的全部区划名称，再按 6 位区划代码的层级关系解析出地址所属的区划。
+# “病人来源与现住址”规则和“邮编与地址”规则使用该索引，医院所在的区县/城市在下方配置。
+#
+# 区划数据默认使用内置的省级区划和上海市各区；把完整的区划表保存为 autoqc 目录下的 regions.csv
+# 即可替换内置数据（UTF-8 编码，每行：6位区划代码,名称[,邮编前缀]，多个邮编前缀用 / 分隔）：
+#
+#   320000,江苏省,21/22
+#   320500,苏州市,215
+#   320508,姑苏区,
+from __future__ import annotations
+import csv
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from output import warning
+
+REGION_FILE_NAME = 'regions.csv'
+
+# 医院所在地：病人来源“本区”对应的区县代码，“本市”对应的城市（直辖市为省级）代码
+HOSPITAL_DISTRICT_CODES = ("310104", "310115")   # 上海市徐汇区、浦东新区
+HOSPITAL_CITY_CODE = "310000"                      # 上海市
+
+# 生成简称时去掉的后缀（按顺序尝试，较长的在前）；简称至少保留两个字
+_NAME_SUFFIXES = ("特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区", "自治州", "自治县",
+                  "新区", "地区", "省", "市", "区", "县", "盟", "旗")
+
+# 简称后面紧跟这些字样时是路名（例如 南京市上海路、北京西路），不作为区划名称
+STREET_NAME_REGEX = re.compile(r'[东西南北中]?(大道|路|街|道|巷|弄)')
+
+# 内置区划：省级区划（含各省邮编前两位）与上海市各区
+_BUILTIN_REGIONS = """\
+110000,北京市,10
+120000,天津市,30
+130000,河北省,05/06/07
+140000,山西省,03/04
+150000,内蒙古自治区,01/02
+210000,辽宁省,11/12
+220000,吉林省,13
+230000,黑龙江省,15/16
+310000,上海市,20
+320000,江苏省,21/22
+330000,浙江省,31/32
+340000,安徽省,23/24
+350000,福建省,35/36
+360000,江西省,33/34
+370000,山东省,25/26/27
+410000,河南省,45/46/47
+420000,湖北省,43/44
+430000,湖南省,41/42
+440000,广东省,51/52
+450000,广西壮族自治区,53/54
+460000,海南省,57
+500000,重庆市,40
+510000,四川省,61/62/63/64
+520000,贵州省,55/56
+530000,云南省,65/66/67
+540000,西藏自治区,85
+610000,陕西省,71/72
+620000,甘肃省,73/74
+630000,青海省,81
+640000,宁夏回族自治区,75
+650000,新疆维吾尔自治区,83/84
+710000,台湾省,
+810000,香港特别行政区,
+820000,澳门特别行政区,
+310101,黄浦区,
+310104,徐汇区,
+310105,长宁区,
+310106,静安区,
+310107,普陀区,
+310109,虹口区,
+310110,杨浦区,
+310112,闵行区,
+310113,宝山区,
+310114,嘉定区,
+310115,浦东新区,
+310116,金山区,
+310117,松江区,
+310118,青浦区,
+310120,奉贤区,
+310151,崇明区,
+"""
+
+
+def region_level(code: str) -> int:
+    """区划代码的层级：1-省级，2-地级，3-县级。"""
+    if code.endswith("0000"):
+        return 1
+    if code.endswith("00"):
+        return 2
+    return 3
+
+
+def is_within(code: str, ancestor: str) -> bool:
+    """code 是否为 ancestor 本身或其下级区划（按代码前缀判断）。"""
+    level = region_level(ancestor)
+    return code == ancestor or (region_level(code) > level and code[:2 * level] == ancestor[:2 * level])
+
+
+def short_name(name: str) -> str:
+    """去掉“省”“市”“自治区”等后缀的简称，例如 浦东新区 -> 浦东；去掉后不足两个字时返回原名。"""
+    for suffix in _NAME_SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[:-len(suffix)]
+    return name
+
+
+class AhoCorasick:
+    """
+    多模式字符串匹配自动机：search() 对文本只扫描一遍，找出所有模式的全部出现位置。
+
+    :param patterns: {模式串: 关联的值}
+    """
+
+    def __init__(self, patterns: Dict[str, object]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]   # 每个状态结束的 (模式长度, 值)
+        for pattern, value in patterns.items():
+            if pattern:
+                self._insert(pattern, value)
+        self._link()
+
+    def _insert(self, pattern: str, value) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = self._goto[state][ch] = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(pattern), value))
+
+    def _link(self) -> None:
+        # 按广度优先顺序计算失败指针，并把失败状态的输出并入当前状态
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def search(self, text: str):
+        """产出文本中每个匹配的 (起始位置, 结束位置, 值)，按结束位置排列。"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, value in out[state]:
+                yield i + 1 - length, i + 1, value
+
+
+class RegionIndex:
+    """
+    行政区划索引。
+
+    :param regions: [(6位区划代码, 名称, 邮编前缀元组), ...]
+    """
+
+    def __init__(self, regions):
+        self._names: Dict[str, str] = {}
+        self._zips: Dict[str, Tuple[str, ...]] = {}
+        patterns: Dict[str, List[Tuple[str, bool]]] = {}   # {名称或简称: [(区划代码, 是否为简称), ...]}
+        for code, name, zips in regions:
+            self._names[code] = name
+            if zips:
+                self._zips[code] = tuple(zips)
+            patterns.setdefault(name, []).append((code, False))
+            alias = short_name(name)
+            if alias != name:
+                patterns.setdefault(alias, []).append((code, True))
+        self._automaton = AhoCorasick(patterns)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._names
+
+    # ---- 区划信息 ----
+
+    def name(self, code: str) -> str:
+        return self._names.get(code, code)
+
+    def short_name(self, code: str) -> str:
+        return short_name(self.name(code))
+
+    def ancestors(self, code: str) -> List[str]:
+        """由近及远返回数据中存在的上级区划代码。"""
+        candidates = {3: [code[:4] + "00", code[:2] + "0000"], 2: [code[:2] + "0000"]}.get(region_level(code), [])
+        return [c for c in candidates if c in self._names and c != code]
+
+    def full_name(self, code: str) -> str:
+        """带上级区划的完整名称，例如 上海市徐汇区。"""
+        return "".join(self.name(c) for c in reversed(self.ancestors(code))) + self.name(code)
+
+    def zip_prefixes(self, code: str) -> Tuple[str, ...]:
+        """区划（或最近的有邮编数据的上级区划）的邮编前缀，没有数据时返回空元组。"""
+        for c in [code] + self.ancestors(code):
+            if c in self._zips:
+                return self._zips[c]
+        return ()
+
+    # ---- 解析 ----
+
+    def matches(self, address: str) -> List[Tuple[int, List[Tuple[str, bool]]]]:
+        """
+        地址中出现的区划名称（从左到右，重叠时取较长的名称），返回 [(起始位置, [(区划代码, 是否为简称), ...]), ...]。
+        后面紧跟“路”“街”等字样的简称是路名，不计入。
+        """
+        found = []
+        for start, stop, entries in self._automaton.search(address):
+            if STREET_NAME_REGEX.match(address, stop):
+                entries = [e for e in entries if not e[1]]
+            if entries:
+                found.append((start, stop, entries))
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+        selected = []
+        end = 0
+        for start, stop, entries in found:
+            if start >= end:
+                selected.append((start, entries))
+                end = stop
+        return selected
+
+    def locate(self, address: str, prefer: Optional[str] = None) -> Tuple[Optional[str], bool]:
+        """
+        解析地址所属的区划。
+
+        从左到右逐级向下解析：第一个名称确定起点，之后只接受当前区划的下级区划，
+        因此“上海市徐汇区北京西路”解析为徐汇区，不会被路名中的“北京”干扰。
+
+        :param address: 地址文本
+        :param prefer: 同名区划（例如多个省都有的区县名）无法由上下文区分时，优先选择该区划之内的
+        :return: (区划代码, 是否有带“省/市/区”等后缀的完整名称参与解析)；没有可识别的区划名称时为 (None, False)
+        """
+        if not address:
+            return None, False
+        current = None
+        certain = False
+        for _, entries in self.matches(address):
+            if current is not None:
+                entries = [e for e in entries if e[0] != current and is_within(e[0], current)]
+                if not entries:
+                    continue
+            elif prefer and len(entries) > 1:
+                entries = [e for e in entries if is_within(e[0], prefer)] or entries
+            current, short = min(entries, key=lambda e: region_level(e[0]))
+            certain = certain or not short
+        return current, certain
+
+    def resolve(self, address: str, prefer: Optional[str] = None) -> Optional[str]:
+        """解析地址所属的区划，返回区划代码；地址中没有可识别的区划名称时返回 None（参数见 locate）。"""
+        return self.locate(address, prefer)[0]
+
+
+def load_regions(path: str) -> List[Tuple[str, str, Tuple[str, ...]]]:
+    """读取区划表 CSV（6位区划代码,名称[,邮编前缀]），跳过表头和无效行。"""
+    regions = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not (len(row[0].strip()) == 6 and row[0].strip().isdigit()) or not row[1].strip():
+                continue
+            zips = tuple(z.strip() for z in row[2].split('/') if z.strip()) if len(row) > 2 else ()
+            regions.append((row[0].strip(), row[1].strip(), zips))
+    return regions
+
+
+def builtin_regions() -> List[Tuple[str, str, Tuple[str, ...]]]:
+    regions = []
+    for line in _BUILTIN_REGIONS.splitlines():
+        code, name, zips = line.split(',')
+        regions.append((code, name, tuple(z for z in zips.split('/') if z)))
+    return regions
+
+
+def get_region_file_path() -> str:
+    from history_qc import get_csv_path
+    return os.path.join(os.path.dirname(get_csv_path()), REGION_FILE_NAME)
+
+
+_REGION_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def get_region_index() -> RegionIndex:
+    """返回区划索引（首次使用时编译）；autoqc 目录下有 regions.csv 时使用其中的数据，否则使用内置数据。"""
+    global _REGION_INDEX
+    with _INDEX_LOCK:
+        if _REGION_INDEX is None:
+            regions = None
+            path = get_region_file_path()
+            if os.path.exists(path):
+                try:
+                    regions = load_regions(path) or None
+                except Exception as e:
+                    warning(f"读取区划表 {path} 失败，使用内置区划数据: {e}")
+            _REGION_INDEX = RegionIndex(regions or builtin_regions())
+    return _REGION_INDEX
+
+
+def set_region_index(index: Optional[RegionIndex]) -> Optional[RegionIndex]:
+    """替换区划索引（传入 None 则下次使用时重新加载），返回原来的索引。"""
+    global _REGION_INDEX
+    with _INDEX_LOCK:
+        previous, _REGION_INDEX = _REGION_INDEX, index
+    return previous
@@ -0,0 +1,272 @@
+# replay_qc.py
+# 提取过程的录制与回放。
+#
+# 录制：RecordingBackend 包装任意 UI 后端，记录提取过程中实际看到的控件树（各类名的控件数量、
+# 读取到的文本）以及手术列表的逐行遍历结果和各类调用耗时，保存为紧凑的 JSON 快照。
+# 回放：load_replay() 根据快照构建模拟窗口，按录制时的速度（或加速）把同样的界面交给提取逻辑，
+# 这样可以在 Linux 上用真实（脱敏后的）页面做端到端性能测试，并确认提取逻辑的优化没有改变提取结果。
+#
+# 快照默认脱敏：REDACTED_KEYS 中的身份与联系方式字段（姓名、身份证号、地址、电话、联系人）在保存前
+# 按字符替换（数字替换为 0，其他字符替换为 *，长度不变），提取结果中的同一字段同样替换，回放比对不受影响。
+# 需要保存原文时把 REDACT_SNAPSHOTS 改为 False（快照文件即含患者身份信息，须按病案资料管理）。
+#
+#   extract_all_data(dlg, snapshot_path="page.json.gz")   # 录制
+#   python bench_qc.py --replay page.json.gz --check       # 回放
+import gzip
+import json
+import statistics
+import time
+
+from ui_map_qc import CONTROLS_QC
+from backend_qc import UIBackend, spec_key
+from extractor_qc import OPERATION_KEYS, NOT_READ
+from sim_qc import Latency, SimulatedBackend, SimulatedWindow, NO_LATENCY
+
+SNAPSHOT_VERSION = 1
+
+REDACT_SNAPSHOTS = True
+REDACTED_KEYS = (
+    "name", "id_card_number",
+    "current_address", "current_address_phone", "household_address", "household_address_phone",
+    "work_unit_address", "work_unit_phone",
+    "contact_name", "contact_address", "contact_phone",
+)
+
+
+def redact_text(text):
+    """脱敏：数字替换为 0，其他非空白字符替换为 *，保留长度与空白。"""
+    if not isinstance(text, str):
+        return text
+    return "".join("0" if ch.isdigit() else ch if ch.isspace() else "*" for ch in text)
+
+
+class _RecordedControl:
+    """转发到真实控件的包装对象，记录每次读取的文本与耗时。"""
+
+    def __init__(self, control, key, recorder):
+        self._control = control
+        self._key = key
+        self._recorder = recorder
+
+    def class_name(self):
+        return self._key[0]
+
+    def window_text(self):
+        start = time.perf_counter()
+        text = self._control.window_text()
+        self._recorder._on_read(self._key, text, time.perf_counter() - start)
+        return text
+
+    def click_input(self):
+        return self._control.click_input()
+
+    def set_focus(self):
+        return self._control.set_focus()
+
+
+class RecordingBackend(UIBackend):
+    """
+    录制用的后端包装。所有调用都转发给 inner，同时记录：
+
+    - 读取过的控件文本（以 (class_name, found_index) 标识）
+    - 每次按键后手术列表各控件最后读取到的文本，即手术列表的逐行遍历结果
+    - 读取、枚举与按键后界面刷新的耗时
+
+    录制时应关闭控件索引缓存（extract_all_data 会自动处理），否则缓存中未包装的控件不会被记录。
+
+    :param inner: 被包装的后端（例如 PywinautoBackend）
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.not_found_errors = inner.not_found_errors
+        self.texts = {}           # {(class_name, found_index): 首次读取到的文本}
+        self.grid_reads = {}      # {按键次数: {(class_name, found_index): 最后读取到的文本}}
+        self.read_times = []
+        self.enum_times = []
+        self.key_times = []       # 每次按键的时间点
+        self._grid_keys = {spec_key(CONTROLS_QC[k]) for k in OPERATION_KEYS}
+        self._row_seen = {}       # {(按键次数, 控件键): 首次读到最终文本的时间点}
+
+    # ---- 录制 ----
+
+    def _on_read(self, key, text, elapsed):
+        self.read_times.append(elapsed)
+        if key in self._grid_keys and self.key_times:
+            presses = len(self.key_times)
+            row = self.grid_reads.setdefault(presses, {})
+            if row.get(key) != text:
+                self._row_seen[(presses, key)] = time.perf_counter()
+            row[key] = text
+        else:
+            self.texts.setdefault(key, text)
+
+    def _wrap(self, control, key):
+        return _RecordedControl(control, key, self)
+
+    # ---- UIBackend 接口 ----
+
+    def connect(self, title, timeout=10):
+        return self.inner.connect(title, timeout)
+
+    def descendants(self, dlg):
+        start = time.perf_counter()
+        controls = self.inner.descendants(dlg)
+        if controls:
+            self.enum_times.append((time.perf_counter() - start) / len(controls))
+        wrapped = []
+        counters = {}
+        for ctrl in controls:
+            cls = ctrl.class_name()
+            n = counters.get(cls, 0)
+            counters[cls] = n + 1
+            wrapped.append(self._wrap(ctrl, (cls, n)))
+        return wrapped
+
+    def window_handle(self, dlg):
+        return self.inner.window_handle(dlg)
+
+    def layout_fingerprint(self, dlg):
+        return self.inner.layout_fingerprint(dlg)
+
+    def find(self, dlg, spec, timeout=2):
+        return self._wrap(self.inner.find(dlg, spec, timeout), spec_key(spec))
+
+    def resolve(self, dlg, spec):
+        return self._wrap(self.inner.resolve(dlg, spec), spec_key(spec))
+
+    def send_keys(self, keys):
+        self.key_times.append(time.perf_counter())
+        self.inner.send_keys(keys)
+
+    # ---- 快照 ----
+
+    def _grid_rows(self):
+        """按按键顺序返回手术列表的各行文本（OPERATION_KEYS 顺序）。"""
+        keys = [spec_key(CONTROLS_QC[k]) for k in OPERATION_KEYS]
+        rows = []
+        for presses in sorted(self.grid_reads):
+            row = self.grid_reads[presses]
+            rows.append([row.get(k, "") for k in keys])
+        return rows
+
+    def _key_latency(self):
+        # 只统计内容确实发生变化的行：到达列表末尾后的按键不会刷新界面
+        latencies = []
+        for (presses, key), seen in self._row_seen.items():
+            previous = self.grid_reads.get(presses - 1, {}).get(key, self.texts.get(key))
+            if self.grid_reads[presses].get(key) == previous:
+                continue
+            latencies.append(seen - self.key_times[presses - 1])
+        return statistics.median(latencies) if latencies else 0.0
+
+    def snapshot(self, dlg, extracted=None, redact=None):
+        """
+        生成当前录制内容的快照（可直接序列化为 JSON 的字典）。
+
+        :param dlg: 录制时的窗口，用于读取标题和各类名的控件数量
+        :param extracted: 可选，本次的提取结果，回放时用于比对
+        :param redact: 是否对 REDACTED_KEYS 中的字段脱敏，默认为 REDACT_SNAPSHOTS
+        """
+        redact = REDACT_SNAPSHOTS if redact is None else redact
+        redacted = {spec_key(CONTROLS_QC[k]) for k in REDACTED_KEYS if k in CONTROLS_QC} if redact else set()
+        classes = dict(self.inner.layout_fingerprint(dlg))
+        for cls, idx in self.texts:
+            classes[cls] = max(classes.get(cls, 0), idx + 1)
+        try:
+            title = dlg.window_text()
+        except Exception:
+            title = "首页录入"
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "title": title,
+            "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "classes": classes,
+            # 只保存非空文本，未读取或为空的控件回放时文本为空
+            "texts": [[cls, idx, redact_text(text) if (cls, idx) in redacted else text]
+                      for (cls, idx), text in sorted(self.texts.items()) if text],
+            "grid": {
+                "controls": [list(spec_key(CONTROLS_QC[k])) for k in OPERATION_KEYS],
+                "rows": self._grid_rows(),
+            },
+            "timings": {
+                "read": statistics.mean(self.read_times) if self.read_times else 0.0,
+                "enum": statistics.mean(self.enum_times) if self.enum_times else 0.0,
+                "key": self._key_latency(),
+            },
+        }
+        if redact:
+            snapshot["redacted"] = [k for k in REDACTED_KEYS if k in CONTROLS_QC]
+        if extracted is not None:
+            snapshot["extracted"] = {
+                k: None if v is NOT_READ else redact_text(v) if redact and k in REDACTED_KEYS else v
+                for k, v in extracted.items()
+            }
+            snapshot["unread"] = [k for k, v in extracted.items() if v is NOT_READ]
+        return snapshot
+
+
+def save_snapshot(snapshot, path):
+    """保存快照；文件名以 .gz 结尾时使用 gzip 压缩。"""
+    data = json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if str(path).endswith(".gz"):
+        data = gzip.compress(data)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def load_snapshot(path):
+    """读取 save_snapshot() 保存的快照。"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if str(path).endswith(".gz"):
+        data = gzip.decompress(data)
+    snapshot = json.loads(data.decode("utf-8"))
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"不支持的快照版本: {snapshot.get('version')}")
+    return snapshot
+
+
+def build_replay_window(snapshot, speed=1.0, handle=1):
+    """
+    根据快照构建模拟窗口。
+
+    :param snapshot: load_snapshot() 返回的快照
+    :param speed: 回放速度倍数：1 为录制时的速度，10 为加快 10 倍，0 为不加延迟
+    :param handle: 模拟的窗口句柄
+    """
+    texts = {}
+    for cls, count in snapshot["classes"].items():
+        for idx in range(count):
+            texts[(cls, idx)] = ""
+    for cls, idx, text in snapshot["texts"]:
+        texts[(cls, idx)] = text
+    grid_keys = [tuple(k) for k in snapshot["grid"]["controls"]]
+    key_names = {spec_key(CONTROLS_QC[k]): k for k in OPERATION_KEYS}
+    operations = [
+        {key_names[k]: text for k, text in zip(grid_keys, row) if k in key_names}
+        for row in snapshot["grid"]["rows"]
+    ]
+
+    timings = snapshot.get("timings", {})
+
+    def scaled(value):
+        return Latency(base=value / speed) if speed and value else NO_LATENCY
+
+    return SimulatedWindow(
+        None,
+        call_latency=scaled(timings.get("read", 0.0)),
+        enum_latency=scaled(timings.get("enum", 0.0)),
+        key_latency=timings.get("key", 0.0) / speed if speed else 0.0,
+        handle=handle,
+        title=snapshot.get("title", "首页录入"),
+        texts=texts,
+        operations=operations,
+    )
+
+
+def load_replay(path, speed=1.0, handle=1):
+    """读取快照并返回 (窗口, 后端, 快照)，可直接传给 extract_all_data 或 run_quality_control。"""
+    snapshot = load_snapshot(path)
+    window = build_replay_window(snapshot, speed=speed, handle=handle)
+    return window, SimulatedBackend([window]), snapshot
@@ -1,14 +1,26 @@
 # reporter_qc.py
 from output import info, success, warning, error, step, add_counts
+from extractor_qc import get_friendly_name
 
-def generate_report(validation_results, case_number=None, total_checks=None):
-    """
-    根据校验结果生成并打印一份可读的报告。
+LEVEL_ORDER = {"错误": 0, "逻辑错误": 1, "警告": 2, "注意": 3}
 
-    :param validation_results: 从 validator_qc.validate_data() 获取的问题列表
-    :param case_number: 病案号
-    :param total_checks: 总检查项数
-    """
+def report_skipped_rules(skipped_rules):
+    """列出因字段未读取而跳过的规则。"""
+    if not skipped_rules:
+        return
+    info(f"以下 {len(skipped_rules)} 条规则因数据未读取而跳过：")
+    for name, fields in skipped_rules:
+        info(f"  【跳过】 {name}（未读取: {'、'.join(get_friendly_name(f) for f in fields)}）")
+
+def report_rule_reuse(rule_reuse):
+    """输出增量校验的统计 (沿用的规则数, 重新计算的规则数)。"""
+    if not rule_reuse:
+        return
+    reused, recomputed = rule_reuse
+    info(f"增量校验：沿用上次结果 {reused} 条规则，重新计算 {recomputed} 条。")
+
+def begin_report(case_number=None):
+    """输出报告抬头。流式质控在校验开始前调用，之后每发现一个问题调用 report_issue。"""
     if case_number:
         step(f"--- 首页质控报告 [病案号: {case_number}] ---")
     else:
@@ -16,30 +28,34 @@ def generate_report(validation_results, case_number=None, total_checks=None):
     
     info("--------------------")
 
+def report_issue(item):
+    """立即输出单个问题。"""
+    level = item['level']
+    field = item['field']
+    message = item['message']
+    
+    if level in ["错误", "逻辑错误"]:
+        error(f"【{level}】 {field}: {message}")
+    elif level == "警告":
+        warning(f"【{level}】 {field}: {message}")
+    else:
+        # “注意”级别也用普通info输出，不计入问题统计
+        info(f"【{level}】 {field}: {message}")
+
+def finish_report(validation_results, total_checks=None, skipped_rules=None, rule_reuse=None):
+    """输出报告总结并更新计数器。"""
     if not validation_results:
         success("未发现明显的缺漏或逻辑错误。")
+        report_skipped_rules(skipped_rules)
+        report_rule_reuse(rule_reuse)
         info("--------------------")
         # 即使没有问题，也要确保计数器被正确设置
         if total_checks is not None:
             add_counts(int(total_checks), 0)
         return
 
-    level_order = {"错误": 0, "逻辑错误": 1, "警告": 2, "注意": 3}
-    sorted_results = sorted(validation_results, key=lambda x: level_order.get(x['level'], 99))
-
-    for item in sorted_results:
-        level = item['level']
-        field = item['field']
-        message = item['message']
-        
-        if level in ["错误", "逻辑错误"]:
-            error(f"【{level}】 {field}: {message}")
-        elif level == "警告":
-            warning(f"【{level}】 {field}: {message}")
-        else:
-            # “注意”级别也用普通info输出，不计入问题统计
-            info(f"【{level}】 {field}: {message}")
-    
+    report_skipped_rules(skipped_rules)
+    report_rule_reuse(rule_reuse)
     info("--------------------")
     # 重新统计问题数，因为"注意"级别不应算作错误
     issue_count = sum(1 for item in validation_results if item['level'] in ["错误", "逻辑错误", "警告"])
@@ -50,3 +66,21 @@ def generate_report(validation_results, case_number=None, total_checks=None):
 
     if total_checks is not None:
         add_counts(int(total_checks), int(issue_count))
+
+def generate_report(validation_results, case_number=None, total_checks=None, skipped_rules=None, rule_reuse=None):
+    """
+    根据校验结果生成并打印一份可读的报告。
+
+    :param validation_results: 从 validator_qc.validate_data() 获取的问题列表
+    :param case_number: 病案号
+    :param total_checks: 总检查项数
+    :param skipped_rules: 因数据未读取而跳过的规则，每项为 (规则名称, 未读取字段列表)
+    :param rule_reuse: 增量校验的统计 (沿用的规则数, 重新计算的规则数)，None 表示未做增量校验
+    """
+    begin_report(case_number)
+
+    sorted_results = sorted(validation_results or [], key=lambda x: LEVEL_ORDER.get(x['level'], 99))
+    for item in sorted_results:
+        report_issue(item)
+
+    finish_report(validation_results, total_checks, skipped_rules, rule_reuse)
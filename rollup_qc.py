@@ -0,0 +1,325 @@
+# rollup_qc.py
+"""
+Incrementally maintained QC aggregates, so management questions can be answered
+without loading the raw history.
+
+Every saved run adds to the rollup table. Counts are kept per day, per grouping, and per
+item:
+
+- groupings: all runs, each operation_department, and each staff member
+  (resident_physician, surgeon, coder, ...)
+- items: the run itself, each rule that applied to the run, and each checked field
+
+Each (day, grouping, item) row stores how many runs it covered and how many of them
+failed. Some example questions:
+
+    failure_rates('rule', '麻醉信息', group_dim='operation_department', start='2025-09-01')
+    top_failures('field', group_dim='resident_physician', group_key='张三')
+
+If the rollups drift from the history (restored backup, edited CSV, changed rules),
+rebuild them with `python rollup_qc.py rebuild`.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from output import info, set_quiet
+from extractor_qc import get_friendly_name
+
+DB_FILE_NAME = 'rollups.db'
+
+# 按人员统计的字段：首页上的医护人员，以及手术列表中的人员
+STAFF_FIELDS = [
+    "department_director", "chief_physician", "attending_physician", "resident_physician",
+    "responsible_nurse", "quality_control_physician", "quality_control_nurse", "coder",
+]
+OPERATION_STAFF_FIELDS = ["surgeon", "first_assistant", "anesthesiologist"]
+DEPARTMENT_FIELD = "operation_department"
+
+# 计入失败的问题级别（“注意”不计入，与报告一致）
+FAILURE_LEVELS = ("错误", "逻辑错误", "警告")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup (
+    day TEXT NOT NULL,
+    group_dim TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    item_dim TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    PRIMARY KEY (group_dim, group_key, item_dim, item_key, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rollup_item ON rollup (item_dim, item_key, group_dim, day);
+"""
+
+
+def get_rollup_path() -> str:
+    """返回汇总库的路径（与 records.csv 在同一 autoqc 目录下）。"""
+    from history_qc import get_csv_path
+    return os.path.join(os.path.dirname(get_csv_path()), DB_FILE_NAME)
+
+
+def rule_outcomes(rule_results: Optional[Dict[str, Any]]) -> Optional[Dict[str, bool]]:
+    """
+    由 validator_qc.validate_data() 收集的 rule_results 得出 {规则名称: 是否失败}。
+    没有检查任何内容也没有发现问题的规则（本病案不适用）不计入。
+    """
+    if rule_results is None:
+        return None
+    outcomes = {}
+    for name, (items, checks, _) in rule_results.items():
+        if checks or items:
+            outcomes[name] = any(item['level'] in FAILURE_LEVELS for item in items)
+    return outcomes
+
+
+def run_facts(header: List[str], row: List[str], outcomes: Optional[Dict[str, bool]] = None):
+    """
+    把一次运行（history_qc.format_row() 生成的一行）分解为汇总用的事实。
+
+    :param outcomes: rule_outcomes() 的结果，None 表示不统计规则
+    :return: (日期, [(分组维度, 分组值), ...], [(项目维度, 项目, 是否失败), ...])
+    """
+    from history_qc import decode_operations
+    columns = {name: i for i, name in enumerate(header)}
+
+    def cell(name):
+        i = columns.get(name)
+        return row[i] if i is not None and i < len(row) else ''
+
+    try:
+        day = datetime.strptime(cell('运行日期'), '%d-%m-%Y %H:%M:%S').strftime('%Y-%m-%d')
+    except ValueError:
+        day = time.strftime('%Y-%m-%d')
+
+    groups = {('all', '')}
+    for key in STAFF_FIELDS:
+        value = cell(get_friendly_name(key)).strip()
+        if value and value != '未读取':
+            groups.add((key, value))
+    try:
+        operations = decode_operations(cell('手术操作'))
+    except ValueError:
+        operations = []
+    for operation in operations:
+        for key in OPERATION_STAFF_FIELDS + [DEPARTMENT_FIELD]:
+            value = (operation.get(key) or '').strip()
+            if value:
+                groups.add((key, value))
+
+    items = [('run', '', False)]
+    # 表头为 病案号, 运行日期, 字段, 字段质控, 字段, 字段质控, ...
+    for i in range(2, len(header) - 1, 2):
+        status = row[i + 1] if i + 1 < len(row) else ''
+        if status in ('通过', '未通过'):
+            items.append(('field', header[i], status == '未通过'))
+    for name, failed in (outcomes or {}).items():
+        items.append(('rule', name, failed))
+    return day, sorted(groups), items
+
+
+class RollupStore:
+    """
+    汇总表（SQLite）。add_runs() 在一个事务中累加多次运行的计数。
+
+    :param path: 数据库路径，默认为 get_rollup_path()
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or get_rollup_path()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def add_runs(self, facts: List[Tuple]) -> None:
+        """累加若干次运行（run_facts() 的结果）。"""
+        counts: Dict[Tuple, List[int]] = {}
+        for day, groups, items in facts:
+            for group_dim, group_key in groups:
+                for item_dim, item_key, failed in items:
+                    entry = counts.setdefault((day, group_dim, group_key, item_dim, item_key), [0, 0])
+                    entry[0] += 1
+                    entry[1] += 1 if failed else 0
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO rollup (day, group_dim, group_key, item_dim, item_key, runs, failures) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (group_dim, group_key, item_dim, item_key, day) '
+                'DO UPDATE SET runs = runs + excluded.runs, failures = failures + excluded.failures',
+                [key + tuple(value) for key, value in counts.items()])
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM rollup')
+
+    # ---- 查询 ----
+
+    def _query(self, sql: str, params) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _range(start: Optional[str], end: Optional[str]):
+        # 日期格式为 'YYYY-MM-DD'，end 也可以只写到月份，例如 '2025-09'
+        return start or '', (end or '9999') + '~'
+
+    def failure_rates(self, item_dim: str = 'rule', item_prefix: str = '', group_dim: str = 'all',
+                      start: Optional[str] = None, end: Optional[str] = None) -> List[Tuple[str, str, int, int, float]]:
+        """
+        各分组中名称以 item_prefix 开头的规则（或字段）的失败率，按失败率从高到低排列。
+
+        :param item_dim: 'rule' 或 'field'
+        :param item_prefix: 规则或字段名称前缀，例如 '麻醉信息'、'必填项'
+        :param group_dim: 'all'、'operation_department' 或 STAFF_FIELDS / OPERATION_STAFF_FIELDS 中的字段
+        :param start: 起始日期（含），'YYYY-MM-DD'
+        :param end: 结束日期（含），'YYYY-MM-DD' 或 'YYYY-MM'
+        :return: [(分组值, 项目, 适用次数, 失败次数, 失败率), ...]
+        """
+        low, high = self._range(start, end)
+        rows = self._query(
+            'SELECT group_key, item_key, SUM(runs), SUM(failures) FROM rollup '
+            'WHERE item_dim = ? AND item_key >= ? AND item_key < ? AND group_dim = ? AND day >= ? AND day <= ? '
+            'GROUP BY group_key, item_key',
+            (item_dim, item_prefix, item_prefix + '\U0010ffff', group_dim, low, high))
+        result = [(g, k, runs, failures, failures / runs if runs else 0.0) for g, k, runs, failures in rows]
+        return sorted(result, key=lambda r: (-r[4], -r[3], r[0], r[1]))
+
+    def top_failures(self, item_dim: str = 'field', group_dim: str = 'all', group_key: str = '',
+                     start: Optional[str] = None, end: Optional[str] = None, limit: int = 10) -> List[Tuple[str, int, int]]:
+        """
+        某个分组（例如某位住院医师）中失败次数最多的字段（或规则）。
+
+        :return: [(项目, 失败次数, 适用次数), ...]
+        """
+        low, high = self._range(start, end)
+        return self._query(
+            'SELECT item_key, SUM(failures) AS f, SUM(runs) FROM rollup '
+            'WHERE group_dim = ? AND group_key = ? AND item_dim = ? AND day >= ? AND day <= ? '
+            'GROUP BY item_key HAVING f > 0 ORDER BY f DESC, item_key LIMIT ?',
+            (group_dim, group_key, item_dim, low, high, limit))
+
+    def run_counts(self, group_dim: str = 'all', start: Optional[str] = None,
+                   end: Optional[str] = None) -> List[Tuple[str, int]]:
+        """各分组的质控次数，按次数从多到少排列：[(分组值, 次数), ...]"""
+        low, high = self._range(start, end)
+        return self._query(
+            'SELECT group_key, SUM(runs) AS n FROM rollup '
+            "WHERE item_dim = 'run' AND group_dim = ? AND day >= ? AND day <= ? "
+            'GROUP BY group_key ORDER BY n DESC, group_key',
+            (group_dim, low, high))
+
+    def daily_counts(self, start: Optional[str] = None, end: Optional[str] = None) -> List[Tuple[str, int]]:
+        """每天的质控次数：[(日期, 次数), ...]"""
+        low, high = self._range(start, end)
+        return self._query(
+            "SELECT day, runs FROM rollup WHERE group_dim = 'all' AND group_key = '' AND item_dim = 'run' "
+            "AND item_key = '' AND day >= ? AND day <= ? ORDER BY day",
+            (low, high))
+
+
+_ROLLUP_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_rollup_store() -> RollupStore:
+    """返回汇总库（首次调用时打开）。"""
+    global _ROLLUP_STORE
+    with _STORE_LOCK:
+        if _ROLLUP_STORE is None:
+            _ROLLUP_STORE = RollupStore()
+    return _ROLLUP_STORE
+
+
+def update_rollups(header: List[str], rows: List[List[str]], outcomes: List[Optional[Dict[str, bool]]]) -> None:
+    """把刚写入历史的若干次运行累加到汇总表（由 history_qc 在写入历史后调用）。"""
+    get_rollup_store().add_runs([run_facts(header, [str(v) for v in row], o) for row, o in zip(rows, outcomes)])
+
+
+def rebuild_rollups(store: Optional[RollupStore] = None, batch_size: int = 500) -> int:
+    """
+    清空汇总表并根据全部历史重新计算。每条记录用当前规则重新校验，以得到各规则的结果。
+
+    :return: 统计的运行次数
+    """
+    from history_qc import record_from_row, format_row, iter_history_rows
+    from validator_qc import validate_data
+    store = store or get_rollup_store()
+    start = time.perf_counter()
+    previous = set_quiet(True)
+    count = 0
+    facts = []
+    try:
+        store.clear()
+        for header, row in iter_history_rows():
+            record = record_from_row(row, header)
+            rule_results = {}
+            validation_results, case_number, _ = validate_data(record, rule_results=rule_results)
+            new_header, new_row = format_row(record, validation_results, case_number)
+            new_row[1] = row[1] if len(row) > 1 else new_row[1]
+            facts.append(run_facts(new_header, [str(v) for v in new_row], rule_outcomes(rule_results)))
+            count += 1
+            if len(facts) >= batch_size:
+                store.add_runs(facts)
+                facts = []
+        if facts:
+            store.add_runs(facts)
+    finally:
+        set_quiet(previous)
+    elapsed = time.perf_counter() - start
+    info(f"汇总表已重建：共 {count} 次运行，耗时 {elapsed:.1f} 秒。")
+    return count
+
+
+# ================= 命令行 =================
+
+def _print_rows(rows):
+    for row in rows:
+        print('\t'.join(f"{v:.1%}" if isinstance(v, float) else str(v) for v in row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="质控汇总统计")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="根据全部历史重新计算汇总表")
+
+    rates = sub.add_parser("rates", help="各分组的规则/字段失败率")
+    rates.add_argument("--item", choices=["rule", "field"], default="rule")
+    rates.add_argument("--prefix", default="", help="规则或字段名称前缀，例如 麻醉信息")
+    rates.add_argument("--by", default="operation_department", help="分组维度，例如 operation_department、resident_physician")
+
+    top = sub.add_parser("top", help="某个分组中失败最多的字段/规则")
+    top.add_argument("--item", choices=["rule", "field"], default="field")
+    top.add_argument("--by", default="all", help="分组维度")
+    top.add_argument("--key", default="", help="分组值，例如某位住院医师的姓名")
+    top.add_argument("--limit", type=int, default=10)
+
+    for p in (rates, top):
+        p.add_argument("--start", help="起始日期 YYYY-MM-DD")
+        p.add_argument("--end", help="结束日期 YYYY-MM-DD 或 YYYY-MM")
+    args = parser.parse_args(argv)
+
+    store = get_rollup_store()
+    if args.command == "rebuild":
+        rebuild_rollups(store)
+    elif args.command == "rates":
+        _print_rows(store.failure_rates(args.item, args.prefix, args.by, args.start, args.end))
+    else:
+        _print_rows(store.top_failures(args.item, args.by, args.key, args.start, args.end, args.limit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+# sim_qc.py
+# 模拟的“首页录入”窗口，用于在没有 HIS 的 Linux 机器上测量提取吞吐量与尾延迟。
+# 窗口由 CONTROLS_QC 与 test_data 中的记录构建，每次 UI 调用都可以配置延迟，
+# 手术列表与真实界面一样只能通过键盘（点击“离院方式”后按“上”键）逐行浏览。
+import random
+import time
+
+from ui_map_qc import CONTROLS_QC
+from backend_qc import FakeBackend, FakeControl, FakeWindow, spec_key
+from extractor_qc import OPERATION_KEYS
+
+
+class Latency:
+    """
+    UI 调用延迟模型：固定延迟加上指数分布的抖动，并以一定概率出现长尾停顿。
+
+    :param base: 每次调用的固定延迟（秒）
+    :param jitter: 抖动的平均值（秒），0 表示无抖动
+    :param stall_prob: 出现停顿的概率
+    :param stall: 停顿时额外增加的延迟（秒）
+    :param seed: 随机数种子，便于复现
+    """
+
+    def __init__(self, base=0.0, jitter=0.0, stall_prob=0.0, stall=0.0, seed=None):
+        self.base = base
+        self.jitter = jitter
+        self.stall_prob = stall_prob
+        self.stall = stall
+        self._rng = random.Random(seed)
+
+    def sample(self):
+        delay = self.base
+        if self.jitter:
+            delay += self._rng.expovariate(1.0 / self.jitter)
+        if self.stall_prob and self._rng.random() < self.stall_prob:
+            delay += self.stall
+        return delay
+
+    def wait(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+
+NO_LATENCY = Latency()
+
+
+class SimulatedControl(FakeControl):
+    """模拟控件：读取文本时产生调用延迟，手术列表控件的文本随当前行变化。"""
+
+    def __init__(self, class_name, text="", window=None, operation_key=None):
+        super().__init__(class_name, text, window)
+        self.operation_key = operation_key
+
+    def window_text(self):
+        self._window.call_latency.wait()
+        if self.operation_key is not None:
+            return self._window.operation_text(self.operation_key)
+        return self._text
+
+    def click_input(self):
+        self._window.call_latency.wait()
+        super().click_input()
+
+    def set_focus(self):
+        self._window.call_latency.wait()
+        super().set_focus()
+
+
+class SimulatedWindow(FakeWindow):
+    """
+    由一条质控记录构建的模拟“首页录入”窗口。
+
+    :param record: 与 extract_all_data 返回值结构相同的字典（例如 test_data.get_test_data()）
+    :param call_latency: 每次读取/点击控件的延迟模型
+    :param enum_latency: 枚举时每个控件的延迟模型
+    :param key_latency: 按键后界面刷新所需的时间（秒），在此之前手术列表仍显示旧行
+    :param handle: 模拟的窗口句柄
+    :param texts: 可选，直接指定控件文本 {(class_name, found_index): text}，此时忽略 record
+                  （用于回放录制的界面快照，见 replay_qc）
+    :param operations: 与 texts 一起使用的手术列表，每行为 {OPERATION_KEYS 中的键: 文本}
+    """
+
+    def __init__(self, record, call_latency=NO_LATENCY, enum_latency=NO_LATENCY,
+                 key_latency=0.0, handle=1, title="首页录入", texts=None, operations=None):
+        operation_specs = {spec_key(CONTROLS_QC[k]): k for k in OPERATION_KEYS}
+        if texts is None:
+            texts = {}
+            for key, spec in CONTROLS_QC.items():
+                if key in OPERATION_KEYS:
+                    continue
+                value = record.get(key)
+                texts.setdefault(spec_key(spec), "" if value is None else str(value))
+            case_number = record.get("case_number_verify")
+            if case_number is not None:
+                texts[spec_key(CONTROLS_QC["case_number"])] = str(case_number)
+            operations = record.get("operations")
+        else:
+            texts = dict(texts)
+        for k in operation_specs:
+            texts.setdefault(k, "")
+
+        super().__init__(texts, title=title, handle=handle)
+        self.call_latency = call_latency
+        self.enum_latency = enum_latency
+        self.key_latency = key_latency
+        self.operations = [op for op in (operations or []) if isinstance(op, dict)]
+        self._row = 0            # 当前显示的手术行
+        self._pending = None     # (生效时间, 目标行)：按键后尚未刷新到界面的行
+        self.in_grid = False
+        self.keys_sent = 0
+
+        # 用模拟控件替换基类创建的控件，保持枚举顺序不变
+        counters = {}
+        controls = []
+        for ctrl in self._controls:
+            cls = ctrl.class_name()
+            n = counters.get(cls, 0)
+            counters[cls] = n + 1
+            controls.append(SimulatedControl(cls, ctrl._text, self, operation_specs.get((cls, n))))
+        self._controls = controls
+        self._discharge_method = self._control_at(spec_key(CONTROLS_QC["discharge_method"]))
+
+    def _control_at(self, key):
+        cls, wanted = key
+        n = 0
+        for ctrl in self._controls:
+            if ctrl.class_name() == cls:
+                if n == wanted:
+                    return ctrl
+                n += 1
+        return None
+
+    def _current_row(self):
+        if self._pending is not None and time.monotonic() >= self._pending[0]:
+            self._row = self._pending[1]
+            self._pending = None
+        return self._row
+
+    def operation_text(self, key):
+        if not self.operations:
+            return ""
+        value = self.operations[self._current_row()].get(key)
+        return "" if value is None else str(value)
+
+    def descendants(self):
+        for _ in self._controls:
+            self.enum_latency.wait()
+        return list(self._controls)
+
+    def send_keys(self, keys):
+        """只模拟提取用到的 {UP}：从“离院方式”进入手术列表，之后每按一次移动到下一条记录。"""
+        self.keys_sent += 1
+        if keys != "{UP}":
+            return
+        if not self.in_grid:
+            if self.focused is not self._discharge_method:
+                return
+            self.in_grid = True
+            target = 0
+        else:
+            # 到达最后一条后继续按键，界面停留在最后一条
+            target = min(self._current_row() + 1, max(len(self.operations) - 1, 0))
+        self._pending = (time.monotonic() + self.key_latency, target)
+        if not self.key_latency:
+            self._current_row()
+
+
+class SimulatedBackend(FakeBackend):
+    """
+    驱动模拟窗口的后端。find() 与 pywinauto 一样每次都重新遍历控件树（并产生枚举延迟），
+    layout_fingerprint() 读取类名时同样按控件计入枚举延迟。
+
+    :param windows: SimulatedWindow 列表
+    """
+
+    def __init__(self, windows=None):
+        super().__init__(enum_delay=0.0, windows=windows)
+
+    def _walk(self, dlg):
+        for ctrl in dlg._controls:
+            self.enumerated += 1
+            dlg.enum_latency.wait()
+            yield ctrl
+
+
+def build_window(record, **kwargs):
+    """根据一条记录创建模拟窗口，参数同 SimulatedWindow。"""
+    return SimulatedWindow(record, **kwargs)
@@ -1,55 +1,71 @@
 # validator_qc.py
 import re
+import time
 from output import info
-from extractor_qc import get_friendly_name
+from extractor_qc import get_friendly_name, NOT_READ
+import region_qc
 
 # 正则表达式常量
 ID_CARD_REGEX = re.compile(r'^\d{17}(\d|X)$', re.IGNORECASE)
 PHONE_REGEX = re.compile(r'^((1[3-9]\d{9})|((0\d{2,3}-?)?\d{7,8}))$')
 ZIP_CODE_REGEX = re.compile(r'^\d{6}$')
 
+# 身份证号校验码（GB 11643，ISO 7064 MOD 11-2）：前17位的加权和模11，按余数取校验字符
+ID_CARD_WEIGHTS = (7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2)
+ID_CARD_CHECK_CHARS = "10X98765432"
+
+NON_DIGIT_REGEX = re.compile(r'\D')
+
 def is_simple_sequence(phone_str: str, threshold: int = 6) -> bool:
     """
     检查电话号码字符串是否包含简单的数字序列。
 
+    只提取数字后单次扫描，分别记录“相同数字”“逐位加一”“逐位减一”三种连续段的长度，
+    任一段长度达到 threshold 即为简单序列（等价于存在长度为 threshold 的重复/升序/降序子串）。
+
     :param phone_str: 要检查的电话号码字符串。
     :param threshold: 判断为序列的最小连续数字长度，默认为6。
     :return: 如果包含简单序列，返回 True，否则返回 False。
     """
     if not phone_str:
         return False
+    if threshold < 1:
+        return _is_simple_sequence_windowed(phone_str, threshold)
 
     # 只提取数字进行判断
-    digits_only = re.sub(r'\D', '', phone_str)
-    
+    digits_only = NON_DIGIT_REGEX.sub('', phone_str)
     if len(digits_only) < threshold:
         return False
+    if threshold == 1:
+        return True
+
+    # ASCII 数字直接按字节比较；其他 Unicode 数字（如全角数字）按其数值比较，与 int() 一致
+    values = digits_only.encode() if digits_only.isascii() else [int(c) for c in digits_only]
+    chars = digits_only
+    same = up = down = 1
+    for j in range(1, len(values)):
+        step = values[j] - values[j - 1]
+        # 重复数字按字符判断（例如“5”与全角“５”不算重复），升降序按数值判断
+        same = same + 1 if chars[j] == chars[j - 1] else 1
+        up = up + 1 if step == 1 else 1
+        down = down + 1 if step == -1 else 1
+        if same >= threshold or up >= threshold or down >= threshold:
+            return True
+    return False
 
+def _is_simple_sequence_windowed(phone_str: str, threshold: int) -> bool:
+    """逐个窗口检查的原始实现，只用于 threshold < 1 这种退化参数，以保持原有行为。"""
+    digits_only = NON_DIGIT_REGEX.sub('', phone_str)
+    if len(digits_only) < threshold:
+        return False
     for i in range(len(digits_only) - threshold + 1):
         sub_seq = digits_only[i:i+threshold]
-
-        # 1. 检查是否为重复数字 (e.g., "888888")
         if len(set(sub_seq)) == 1:
             return True
-
-        # 2. 检查是否为连续升序数字 (e.g., "123456")
-        is_ascending = True
-        for j in range(len(sub_seq) - 1):
-            if int(sub_seq[j+1]) != int(sub_seq[j]) + 1:
-                is_ascending = False
-                break
-        if is_ascending:
+        if all(int(sub_seq[j+1]) == int(sub_seq[j]) + 1 for j in range(len(sub_seq) - 1)):
             return True
-
-        # 3. 检查是否为连续降序数字 (e.g., "765432")
-        is_descending = True
-        for j in range(len(sub_seq) - 1):
-            if int(sub_seq[j+1]) != int(sub_seq[j]) - 1:
-                is_descending = False
-                break
-        if is_descending:
+        if all(int(sub_seq[j+1]) == int(sub_seq[j]) - 1 for j in range(len(sub_seq) - 1)):
             return True
-
     return False
 
 def is_strange_text(text: str, min_len: int = 2, placeholders: list = None) -> bool:
@@ -92,33 +108,77 @@ def is_strange_zip(zip_code: str) -> bool:
         return True
     return False
 
-def validate_data(data):
+# ================= 校验规则 =================
+# 每条规则是一个函数 rule(data, report_items) -> int：把发现的问题追加到 report_items，
+# 返回实际适用的检查项数量（前提不满足时为 0）。RULES 是规则注册表，按原有的校验顺序列出
+# Rule 对象（名称、输入字段、严重程度、开销类别、是否启用），validate_data 依次执行；
+# 输入字段中有未读取的值（NOT_READ）时整条规则跳过。
+
+# 严重程度（即规则可能给出的最高问题级别），按从高到低排列
+SEVERITY_LEVELS = ["错误", "逻辑错误", "警告", "注意"]
+
+# 开销类别：普通字段只读取单个控件；手术列表需要键盘逐行遍历，是提取中最慢的部分
+COST_CHEAP = "cheap"
+COST_GRID = "grid"
+
+class Rule:
     """
-    校验提取出的数据，检查缺失和逻辑错误。
+    注册表中的一条校验规则。
 
-    :param data: 从 extractor_qc.extract_all_data() 获取的字典
-    :return: tuple (validation_results, case_number)
-        - validation_results: 一个包含所有发现问题的列表，每个问题是一个字典
-        - case_number: 病案号
+    :param name: 规则名称（用于报告“跳过的规则”和统计）
+    :param fields: 规则读取的输入字段
+    :param func: 规则函数 func(data, report_items) -> int
+    :param severity: 规则可能给出的最高问题级别，取值见 SEVERITY_LEVELS
+    :param cost: 开销类别，COST_CHEAP 或 COST_GRID
+    :param enabled: 是否启用；停用的规则不执行、不计入检查项，也不读取其输入字段
+    :param reusable: 结果是否只取决于输入字段；依赖外部状态（例如身份索引）的规则为 False，增量校验时总是重新计算
     """
-    info("▶ 开始数据校验...")
-    report_items = []
-    # 统计已执行的检查项数量（用于总检查数统计）
-    check_count = 0
 
-    # --- 1. 必填项检查 ---
-    # 定义哪些字段是必须填写的
-    required_staff = [
+    def __init__(self, name, fields, func, severity, cost=COST_CHEAP, enabled=True, reusable=True):
+        if severity not in SEVERITY_LEVELS:
+            raise ValueError(f"未知的严重程度: {severity}")
+        self.name = name
+        self.fields = tuple(fields)
+        self.func = func
+        self.severity = severity
+        self.cost = cost
+        self.enabled = enabled
+        self.reusable = reusable
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.runs = 0        # 执行次数
+        self.checks = 0      # 累计检查项数量
+        self.issues = 0      # 累计发现的问题数
+        self.elapsed = 0.0   # 累计耗时（秒），包括按需读取输入字段的时间
+
+    def run(self, data, report_items):
+        """执行规则并累计统计，返回检查项数量。"""
+        start = time.perf_counter()
+        before = len(report_items)
+        checks = self.func(data, report_items)
+        self.elapsed += time.perf_counter() - start
+        self.runs += 1
+        self.checks += checks
+        self.issues += len(report_items) - before
+        return checks
+
+    def __repr__(self):
+        state = "" if self.enabled else ", 已停用"
+        return f"Rule({self.name!r}, {self.fields!r}, {self.severity}, {self.cost}{state})"
+
+# 必填项
+REQUIRED_FIELDS = [
     "name", "gender", "id_card_number", "birth_date", "marriage_status",
     "nationality", "occupation", "current_address", "contact_name",
     "contact_relationship", "contact_phone",
     "tcm_outpatient_syndrome_code", "tcm_discharge_treatment_principle_code", "tcm_discharge_treatment_principle_name",
     'department_director', 'chief_physician', 'attending_physician',
     'resident_physician', 'quality_control_physician', 'responsible_nurse', 'quality_control_nurse'
-    ]
-    for staff_key in required_staff:
-        # 每个必填项视为一项检查
-        check_count += 1
+]
+
+def _required_rule(staff_key):
+    def rule(data, report_items):
         val = data.get(staff_key)
         if not val or val in (None, '', '-', '无'):
             report_items.append({
@@ -126,340 +186,452 @@ def validate_data(data):
                 'field': get_friendly_name(staff_key),
                 'message': f"{get_friendly_name(staff_key)} 不能为空，请补充。"
             })
+        # 每个必填项视为一项检查
+        return 1
+    return rule
 
-    # 国籍检查
+def _check_nationality(data, report_items):
     nationality = data.get("nationality")
     if nationality and nationality not in ["中国", "156"]: # 156是中国国籍代码
-        check_count += 1
         report_items.append({
             "level": "警告",
             "field": get_friendly_name("nationality"),
             "message": f"国籍为 '{nationality}'，不是'中国'，请核实。"
         })
+        return 1
+    return 0
 
+def _check_id_card(data, report_items):
     # 身份证号格式检查
     id_card = data.get("id_card_number")
     if id_card and not ID_CARD_REGEX.match(id_card):
-        check_count += 1
         report_items.append({
             "level": "错误",
             "field": get_friendly_name("id_card_number"),
             "message": f"身份证号 '{id_card}' 格式不正确，应为18位。"
         })
+        return 1
+    return 0
 
-    # 手机号格式检查
-    if data.get("work_unit_phone") == "不详" or data.get("work_unit_phone") == "无":
-        phone_fields = ["current_address_phone", "contact_phone", "household_address_phone"]
-    else:
-        phone_fields = ["current_address_phone", "contact_phone", "household_address_phone", "work_unit_phone"]
-    for field_key in phone_fields:
+def id_card_check_char(id_card: str) -> str:
+    """
+    按前17位计算身份证号的校验字符。
+
+    :param id_card: 至少17位数字的身份证号（只使用前17位）
+    :return: '0'-'9' 或 'X'
+    """
+    total = sum(int(c) * w for c, w in zip(id_card[:17], ID_CARD_WEIGHTS))
+    return ID_CARD_CHECK_CHARS[total % 11]
+
+def _id_card_birth(id_card: str):
+    """身份证号中的出生日期（YYYYMMDD），日期无效时返回 None。"""
+    text = id_card[6:14]
+    if not text.isascii():
+        return None
+    try:
+        time.strptime(text, "%Y%m%d")
+    except ValueError:
+        return None
+    return text
+
+def _normalize_birth_date(birth_date: str):
+    """把出生日期（例如 1990-01-01、1990/1/1、19900101）规范化为 YYYYMMDD，无法识别时返回 None。"""
+    parts = re.findall(r'[0-9]+', birth_date)
+    if len(parts) == 1 and len(parts[0]) == 8:
+        return parts[0]
+    if len(parts) >= 3 and len(parts[0]) == 4 and len(parts[1]) <= 2 and len(parts[2]) <= 2:
+        return f"{parts[0]}{int(parts[1]):02d}{int(parts[2]):02d}"
+    return None
+
+# 性别取值（GB/T 2261.1：1-男，2-女）-> 身份证号第17位的奇偶（奇数为男）
+GENDER_PARITY = {"男": 1, "1": 1, "女": 0, "2": 0}
+
+def _check_id_card_checksum(data, report_items):
+    # 格式正确的身份证号，校验码必须与前17位一致
+    id_card = data.get("id_card_number")
+    if not id_card or not ID_CARD_REGEX.match(id_card):
+        return 0
+    expected = id_card_check_char(id_card)
+    if id_card[17].upper() != expected:
+        report_items.append({
+            "level": "错误",
+            "field": get_friendly_name("id_card_number"),
+            "message": f"身份证号 '{id_card}' 校验码不正确（按前17位应为 '{expected}'），请核对号码是否录入有误。"
+        })
+    return 1
+
+def _check_id_card_birth(data, report_items):
+    # 身份证号第7-14位为出生日期，应为有效日期并与“出生日期”一致
+    id_card = data.get("id_card_number")
+    if not id_card or not ID_CARD_REGEX.match(id_card):
+        return 0
+    embedded = _id_card_birth(id_card)
+    if embedded is None:
+        report_items.append({
+            "level": "逻辑错误",
+            "field": get_friendly_name("id_card_number"),
+            "message": f"身份证号 '{id_card}' 中的出生日期 '{id_card[6:14]}' 不是有效日期，请核实。"
+        })
+        return 1
+    birth_date = data.get("birth_date")
+    birth = _normalize_birth_date(birth_date) if birth_date else None
+    if birth and birth != embedded:
+        report_items.append({
+            "level": "逻辑错误",
+            "field": f"{get_friendly_name('id_card_number')}/{get_friendly_name('birth_date')}",
+            "message": f"身份证号中的出生日期为 '{embedded[:4]}-{embedded[4:6]}-{embedded[6:]}'，"
+                       f"与出生日期 '{birth_date}' 不一致，请核实。"
+        })
+    return 1
+
+def _check_id_card_gender(data, report_items):
+    # 身份证号第17位奇数为男、偶数为女，应与“性别”一致
+    id_card = data.get("id_card_number")
+    gender = data.get("gender")
+    if not id_card or not ID_CARD_REGEX.match(id_card) or gender not in GENDER_PARITY:
+        return 0
+    if int(id_card[16]) % 2 != GENDER_PARITY[gender]:
+        report_items.append({
+            "level": "逻辑错误",
+            "field": f"{get_friendly_name('id_card_number')}/{get_friendly_name('gender')}",
+            "message": f"身份证号 '{id_card}' 第17位表示的性别与性别 '{gender}' 不一致，请核实。"
+        })
+    return 1
+
+def _phone_rule(field_key):
+    def rule(data, report_items):
         phone = data.get(field_key)
+        # 工作单位电话为“不详”或“无”时不做校验
+        if field_key == "work_unit_phone" and phone in ("不详", "无"):
+            return 0
         # 只有当字段有值时才进行校验；将该字段视为一项检查
-        if phone:
-            check_count += 1
-            # 检查1: 基本格式校验
-            if not PHONE_REGEX.match(phone):
-                report_items.append({
-                    "level": "警告",
-                    "field": get_friendly_name(field_key),
-                    "message": f"电话号码 '{phone}' 格式似乎不正确，请核实。"
-                })
-            # 检查2: 简单序列校验 (如连续、重复数字)
-            if is_simple_sequence(phone):
-                report_items.append({
-                    "level": "警告",
-                    "field": get_friendly_name(field_key),
-                    "message": f"电话号码 '{phone}' 包含连续或重复数字，请核实其有效性。"
-                })
-
-    # 婚姻状况与联系人关系逻辑检查
-    # 假设：婚姻状况代码 '1'=未婚, '2'=已婚。 联系人关系代码 '2'=配偶
-    relationship = data.get("contact_relationship")
-    marriage_status = data.get("marriage_status")
-    if relationship in ["配偶", "2"]:
-        check_count += 1
-        if marriage_status and marriage_status not in ["已婚", "2"]:
+        if not phone:
+            return 0
+        # 检查1: 基本格式校验
+        if not PHONE_REGEX.match(phone):
             report_items.append({
-                "level": "逻辑错误",
-                "field": f"{get_friendly_name('marriage_status')}/{get_friendly_name('contact_relationship')}",
-                "message": "联系人关系为'配偶'，但患者婚姻状况不是'已婚'，请核实。"
+                "level": "警告",
+                "field": get_friendly_name(field_key),
+                "message": f"电话号码 '{phone}' 格式似乎不正确，请核实。"
             })
-    
-    if marriage_status in ["未婚", "1"]:
-        check_count += 1
-        if relationship and relationship in ["配偶", "2"]:
+        # 检查2: 简单序列校验 (如连续、重复数字)
+        if is_simple_sequence(phone):
             report_items.append({
-                "level": "逻辑错误",
-                "field": f"{get_friendly_name('marriage_status')}/{get_friendly_name('contact_relationship')}",
-                "message": "患者婚姻状况为'未婚'，但联系人关系为'配偶'，请核实。"
-            })           
-
-    # 是否使用医疗机构中药制剂
-    tcm_prep_fee_str = data.get("tcm_preparation_fee")
-    tcm_prep_usage = data.get("tcm_preparation_usage")
-    if tcm_prep_fee_str:
-        try:
-            # 视为一项检查
-            check_count += 1
-            fee = float(tcm_prep_fee_str)
-            # 假设"是"的代码为"1"
-            if fee > 0 and tcm_prep_usage not in ["是", "1"]:
-                report_items.append({
-                    "level": "逻辑错误",
-                    "field": f"{get_friendly_name('tcm_preparation_fee')}/{get_friendly_name('tcm_preparation_usage')}",
-                    "message": f"有'{get_friendly_name('tcm_preparation_fee')}'({fee})，但'{get_friendly_name('tcm_preparation_usage')}'不为'是'。"
-                })
-        except ValueError:
-            # 如果费用不是有效数字，则忽略此项检查
-            pass
+                "level": "警告",
+                "field": get_friendly_name(field_key),
+                "message": f"电话号码 '{phone}' 包含连续或重复数字，请核实其有效性。"
+            })
+        return 1
+    return rule
+
+# 婚姻状况与联系人关系逻辑检查
+# 假设：婚姻状况代码 '1'=未婚, '2'=已婚。 联系人关系代码 '2'=配偶
+def _check_spouse_marriage(data, report_items):
+    relationship = data.get("contact_relationship")
+    marriage_status = data.get("marriage_status")
+    if relationship not in ["配偶", "2"]:
+        return 0
+    if marriage_status and marriage_status not in ["已婚", "2"]:
+        report_items.append({
+            "level": "逻辑错误",
+            "field": f"{get_friendly_name('marriage_status')}/{get_friendly_name('contact_relationship')}",
+            "message": "联系人关系为'配偶'，但患者婚姻状况不是'已婚'，请核实。"
+        })
+    return 1
 
-    # 是否使用中医诊疗技术
-    tcm_treat_fee_str = data.get("tcm_treatment_fee")
-    tcm_tech_usage = data.get("tcm_technique_usage")
-    if tcm_treat_fee_str:
+def _check_unmarried_spouse(data, report_items):
+    relationship = data.get("contact_relationship")
+    marriage_status = data.get("marriage_status")
+    if marriage_status not in ["未婚", "1"]:
+        return 0
+    if relationship and relationship in ["配偶", "2"]:
+        report_items.append({
+            "level": "逻辑错误",
+            "field": f"{get_friendly_name('marriage_status')}/{get_friendly_name('contact_relationship')}",
+            "message": "患者婚姻状况为'未婚'，但联系人关系为'配偶'，请核实。"
+        })
+    return 1
+
+def _fee_usage_rule(fee_key, usage_key):
+    """有某项中医费用时，对应的“是否使用”应为“是”。"""
+    def rule(data, report_items):
+        fee_str = data.get(fee_key)
+        usage = data.get(usage_key)
+        if not fee_str:
+            return 0
         try:
-            # 视为一项检查
-            check_count += 1
-            fee = float(tcm_treat_fee_str)
-            # 假设"是"的代码为"1"
-            if fee > 0 and tcm_tech_usage not in ["是", "1"]:
-                report_items.append({
-                    "level": "逻辑错误",
-                    "field": f"{get_friendly_name('tcm_treatment_fee')}/{get_friendly_name('tcm_technique_usage')}",
-                    "message": f"有'{get_friendly_name('tcm_treatment_fee')}'({fee})，但'{get_friendly_name('tcm_technique_usage')}'不为'是'。"
-                })
+            fee = float(fee_str)
         except ValueError:
-            pass
+            # 如果费用不是有效数字，则忽略此项检查（仍计为一项检查）
+            return 1
+        # 假设"是"的代码为"1"
+        if fee > 0 and usage not in ["是", "1"]:
+            report_items.append({
+                "level": "逻辑错误",
+                "field": f"{get_friendly_name(fee_key)}/{get_friendly_name(usage_key)}",
+                "message": f"有'{get_friendly_name(fee_key)}'({fee})，但'{get_friendly_name(usage_key)}'不为'是'。"
+            })
+        return 1
+    return rule
 
-    # 是否死亡患者尸检
+def _check_death_autopsy(data, report_items):
     discharge_method = data.get("discharge_method")
     autopsy = data.get("autopsy")
     # 离院方式: 5-死亡; 尸检: 1-是, 2-否, 3/- 为空
-    if discharge_method in ["死亡", "5"]:
-        check_count += 1
-        if autopsy in [None, "", "-", "3"]:
+    if discharge_method not in ["死亡", "5"]:
+        return 0
+    if autopsy in [None, "", "-", "3"]:
+        report_items.append({
+            "level": "逻辑错误",
+            "field": f"{get_friendly_name('discharge_method')}/{get_friendly_name('autopsy')}",
+            "message": "离院方式为'死亡'，但'死亡患者尸检'状态未明确填写为'是'或'否'。"
+        })
+    return 1
+
+def _check_blood_fee(data, report_items):
+    blood_fee_str = data.get("blood_fee")
+    if not blood_fee_str:
+        return 0
+    try:
+        fee = float(blood_fee_str)
+    except ValueError:
+        return 1
+    if fee > 0:
+        blood_type = data.get("blood_type")
+        rh = data.get("rh")
+        # 血型: 6-未查; RH: 4-未查
+        blood_type_invalid = blood_type in [None, "", "-", "未查", "6"]
+        rh_invalid = rh in [None, "", "-", "未查", "4"]
+
+        if blood_type_invalid or rh_invalid:
+            invalid_fields = []
+            if blood_type_invalid:
+                invalid_fields.append(get_friendly_name('blood_type'))
+            if rh_invalid:
+                invalid_fields.append(get_friendly_name('rh'))
+
             report_items.append({
                 "level": "逻辑错误",
-                "field": f"{get_friendly_name('discharge_method')}/{get_friendly_name('autopsy')}",
-                "message": "离院方式为'死亡'，但'死亡患者尸检'状态未明确填写为'是'或'否'。"
+                "field": f"{get_friendly_name('blood_fee')}/{'/'.join(invalid_fields)}",
+                "message": f"有'血费'产生，但 { ' 和 '.join(invalid_fields) } 信息为'未查'或空。"
             })
+    return 1
 
-    # 血型
-    blood_fee_str = data.get("blood_fee")
-    if blood_fee_str:
-        try:
-            check_count += 1
-            fee = float(blood_fee_str)
-            if fee > 0:
-                blood_type = data.get("blood_type")
-                rh = data.get("rh")
-                # 血型: 6-未查; RH: 4-未查
-                blood_type_invalid = blood_type in [None, "", "-", "未查", "6"]
-                rh_invalid = rh in [None, "", "-", "未查", "4"]
-                
-                if blood_type_invalid or rh_invalid:
-                    invalid_fields = []
-                    if blood_type_invalid:
-                        invalid_fields.append(get_friendly_name('blood_type'))
-                    if rh_invalid:
-                        invalid_fields.append(get_friendly_name('rh'))
-                    
-                    report_items.append({
-                        "level": "逻辑错误",
-                        "field": f"{get_friendly_name('blood_fee')}/{'/'.join(invalid_fields)}",
-                        "message": f"有'血费'产生，但 { ' 和 '.join(invalid_fields) } 信息为'未查'或空。"
-                    })
-        except ValueError:
-            pass
-    
-    # 检查地址和邮编是否“奇怪”
-    address_fields = {
-        "current_address": "current_address_zip",
-        "household_address": "household_address_zip",
-        "contact_address": None, # 联系人地址没有独立的邮编字段
-        "work_unit_address": "work_unit_zip"
-    }
-    for addr_key, zip_key in address_fields.items():
+def _address_rule(addr_key):
+    """地址是否“奇怪”。"""
+    def rule(data, report_items):
         address = data.get(addr_key)
-        # 每个地址字段视为一项检查（存在时）
-        if address:
-            check_count += 1
-        if address and is_strange_text(address, min_len=5, placeholders=["测试", "地址", "同上"]) and address != "不详" and address != "无":
+        if not address:
+            return 0
+        if is_strange_text(address, min_len=5, placeholders=["测试", "地址", "同上"]) and address != "不详" and address != "无":
             report_items.append({
                 "level": "注意",
                 "field": get_friendly_name(addr_key),
                 "message": f"地址 '{address}' 看起来过短或为通用占位符，请核实。"
             })
-        
-        if zip_key:
-            zip_code = data.get(zip_key)
-            if zip_code:
-                check_count += 1
-            if zip_code and is_strange_zip(zip_code) and zip_code != "不详" and zip_code != "无":
-                report_items.append({
-                    "level": "警告",
-                    "field": get_friendly_name(zip_key),
-                    "message": f"邮编 '{zip_code}' 格式不正确或为简单序列，请核实。"
-                })
+        # 每个地址字段视为一项检查（存在时）
+        return 1
+    return rule
+
+def _zip_rule(zip_key):
+    """邮编是否“奇怪”。"""
+    def rule(data, report_items):
+        zip_code = data.get(zip_key)
+        if not zip_code:
+            return 0
+        if is_strange_zip(zip_code) and zip_code != "不详" and zip_code != "无":
+            report_items.append({
+                "level": "警告",
+                "field": get_friendly_name(zip_key),
+                "message": f"邮编 '{zip_code}' 格式不正确或为简单序列，请核实。"
+            })
+        return 1
+    return rule
+
+def _check_patient_source(data, report_items):
     # "病人来源" 是否和 "现住址" 匹配
     patient_source = data.get("patient_source")
     current_address = data.get("current_address")
-    if patient_source and current_address:
-        # 病人来源: 1-本区, 2-本市, 3-外地
-        # 假设医院在上海市徐汇区或浦东新区
-        check_count += 1
-        is_shanghai = "上海" in current_address
-        is_district = "徐汇" in current_address or "浦东" in current_address
-        
-        if patient_source in ["本区", "1"] and not is_district:
-            report_items.append({
-                "level": "注意",
-                "field": f"{get_friendly_name('patient_source')}/{get_friendly_name('current_address')}",
-                "message": f"病人来源为'本区'，但现住址'{current_address}'中未找到'徐汇'或'浦东'，请核实。"
-            })
-        elif patient_source in ["本市", "2"] and not is_shanghai:
-            report_items.append({
-                "level": "注意",
-                "field": f"{get_friendly_name('patient_source')}/{get_friendly_name('current_address')}",
-                "message": f"病人来源为'本市'，但现住址'{current_address}'中未找到'上海'，请核实。"
-            })
-        elif patient_source in ["外地", "3"] and is_shanghai:
+    if not (patient_source and current_address):
+        return 0
+    # 病人来源: 1-本区, 2-本市, 3-外地；医院所在的区县/城市见 region_qc 中的配置
+    index = region_qc.get_region_index()
+    city = region_qc.HOSPITAL_CITY_CODE
+    region = index.resolve(current_address, prefer=city)
+    in_city = region is not None and region_qc.is_within(region, city)
+    in_district = region is not None and any(region_qc.is_within(region, d) for d in region_qc.HOSPITAL_DISTRICT_CODES)
+    district_names = "或".join(f"'{index.short_name(d)}'" for d in region_qc.HOSPITAL_DISTRICT_CODES)
+    city_name = index.short_name(city)
+
+    if patient_source in ["本区", "1"] and not in_district:
+        report_items.append({
+            "level": "注意",
+            "field": f"{get_friendly_name('patient_source')}/{get_friendly_name('current_address')}",
+            "message": f"病人来源为'本区'，但现住址'{current_address}'中未找到{district_names}，请核实。"
+        })
+    elif patient_source in ["本市", "2"] and not in_city:
+        report_items.append({
+            "level": "注意",
+            "field": f"{get_friendly_name('patient_source')}/{get_friendly_name('current_address')}",
+            "message": f"病人来源为'本市'，但现住址'{current_address}'中未找到'{city_name}'，请核实。"
+        })
+    elif patient_source in ["外地", "3"] and in_city:
+        report_items.append({
+            "level": "注意",
+            "field": f"{get_friendly_name('patient_source')}/{get_friendly_name('current_address')}",
+            "message": f"病人来源为'外地'，但现住址'{current_address}'似乎是{city_name}地址，请核实。"
+        })
+    return 1
+
+def _zip_region_rule(zip_key, addr_key):
+    """
+    格式正确的邮编是否与地址所属区划的邮编前缀一致。
+    只由简称（例如“北京”而非“北京市”）解析出的区划不够可靠，不做检查。
+    """
+    def rule(data, report_items):
+        zip_code = data.get(zip_key)
+        address = data.get(addr_key)
+        if not (zip_code and address) or not ZIP_CODE_REGEX.match(zip_code):
+            return 0
+        index = region_qc.get_region_index()
+        region, certain = index.locate(address, prefer=region_qc.HOSPITAL_CITY_CODE)
+        prefixes = index.zip_prefixes(region) if region and certain else ()
+        if not prefixes:
+            return 0
+        if not zip_code.startswith(prefixes):
             report_items.append({
                 "level": "注意",
-                "field": f"{get_friendly_name('patient_source')}/{get_friendly_name('current_address')}",
-                "message": f"病人来源为'外地'，但现住址'{current_address}'似乎是上海地址，请核实。"
+                "field": f"{get_friendly_name(zip_key)}/{get_friendly_name(addr_key)}",
+                "message": f"邮编 '{zip_code}' 与地址 '{address}'（{index.full_name(region)}）不符，"
+                           f"该地区邮编应以 {'/'.join(prefixes)} 开头，请核实。"
             })
+        return 1
+    return rule
+
+def _check_contact_name(data, report_items):
     # "联系人姓名" 是否“奇怪”或与患者同名
     contact_name = data.get("contact_name")
     patient_name = data.get("name")
-    
-    if contact_name:
-        # 检查是否为奇怪的文本
-        # 联系人姓名检查计为一项
-        check_count += 1
-        if is_strange_text(contact_name, min_len=2, placeholders=["无", "不详", "测试", "联系人", "家属"]):
-             report_items.append({
-                "level": "注意",
-                "field": get_friendly_name('contact_name'),
-                "message": f"联系人姓名 '{contact_name}' 看起来像占位符或过短，请核实。"
-            })
-        # 检查是否与患者同名
-        elif patient_name and contact_name == patient_name:
-            report_items.append({
-                "level": "注意",
-                "field": f"{get_friendly_name('contact_name')}/{get_friendly_name('name')}",
-                "message": "联系人姓名与患者本人姓名相同，请核实。"
-            })
+    if not contact_name:
+        return 0
+    # 检查是否为奇怪的文本
+    if is_strange_text(contact_name, min_len=2, placeholders=["无", "不详", "测试", "联系人", "家属"]):
+        report_items.append({
+            "level": "注意",
+            "field": get_friendly_name('contact_name'),
+            "message": f"联系人姓名 '{contact_name}' 看起来像占位符或过短，请核实。"
+        })
+    # 检查是否与患者同名
+    elif patient_name and contact_name == patient_name:
+        report_items.append({
+            "level": "注意",
+            "field": f"{get_friendly_name('contact_name')}/{get_friendly_name('name')}",
+            "message": "联系人姓名与患者本人姓名相同，请核实。"
+        })
+    # 联系人姓名检查计为一项
+    return 1
 
-    # 出生地 and 籍贯: 如为占位符或过短则提示（不强制为必填）
-    birth_place = data.get('birth_place')
-    native_place = data.get('native_place')
-    if birth_place:
-        check_count += 1
-        if is_strange_text(birth_place, min_len=2, placeholders=["无", "不详", "测试"]):
+def _place_rule(key):
+    """出生地、籍贯: 如为占位符或过短则提示（不强制为必填）。"""
+    def rule(data, report_items):
+        value = data.get(key)
+        if not value:
+            return 0
+        if is_strange_text(value, min_len=2, placeholders=["无", "不详", "测试"]):
             report_items.append({
                 'level': '注意',
-                'field': get_friendly_name('birth_place'),
-                'message': f"出生地 '{birth_place}' 看起来像占位符或过短，请核实。"
+                'field': get_friendly_name(key),
+                'message': f"{get_friendly_name(key)} '{value}' 看起来像占位符或过短，请核实。"
             })
+        return 1
+    return rule
+
+def _check_work_unit(data, report_items):
+    # 工作单位: 允许为空或为'无'/'不详'，但若有内容也检查是否为占位符或过短
+    work_unit = data.get('work_unit')
+    if not work_unit:
+        return 0
+    if work_unit not in ["无", "不详"] and is_strange_text(work_unit, min_len=2, placeholders=["无", "不详", "测试"]):
+        report_items.append({
+            'level': '注意',
+            'field': get_friendly_name('work_unit'),
+            'message': f"工作单位 '{work_unit}' 看起来像占位符或过短，请核实。"
+        })
+    return 1
 
-    if native_place:
-        check_count += 1
-        if is_strange_text(native_place, min_len=2, placeholders=["无", "不详", "测试"]):
+def _check_coder(data, report_items):
+    coder = data.get('coder')
+    if not coder:
+        return 0
+    # 假设系统中“超级用户”会被标注为字符串 '超级用户'
+    try:
+        if coder in ['超级用户', 'admin']:
             report_items.append({
-                'level': '注意',
-                'field': get_friendly_name('native_place'),
-                'message': f"籍贯 '{native_place}' 看起来像占位符或过短，请核实。"
+                'level': '警告',
+                'field': get_friendly_name('coder'),
+                'message': f"编码员不应是'{coder}'"
             })
+    except Exception:
+        # 如果 coder 非字符串则忽略该特定警告，但已计入检查数
+        pass
+    return 1
 
-    # 工作单位: 允许为空或为'无'/'不详'，但若有内容也检查是否为占位符或过短
-    work_unit = data.get('work_unit')
-    if work_unit:
-        check_count += 1
-        if work_unit not in ["无", "不详"] and is_strange_text(work_unit, min_len=2, placeholders=["无", "不详", "测试"]):
+def _admission_condition_rule(key, label):
+    """出院主要诊断的入院病情不应为 '无'。"""
+    def rule(data, report_items):
+        cond = data.get(key)
+        if cond and cond == '无':
             report_items.append({
-                'level': '注意',
-                'field': get_friendly_name('work_unit'),
-                'message': f"工作单位 '{work_unit}' 看起来像占位符或过短，请核实。"
+                'level': '错误',
+                'field': get_friendly_name(key),
+                'message': f"{label}入院病情不应为'无'，请核实"
             })
+        return 0
+    return rule
 
-    coder = data.get('coder')
-    if coder:
-        # 假设系统中“超级用户”会被标注为字符串 '超级用户' 
-        check_count += 1
-        try:
-            if coder in ['超级用户', 'admin']:
+def _check_operation_surgeon(data, report_items):
+    # 有手术编码但无主刀医生
+    checks = 0
+    for i, op in enumerate(data.get('operations') or []):
+        operation_code = op.get('operation_code')
+        surgeon = op.get('surgeon')
+        if operation_code and operation_code not in (None, '', '-', '无'):
+            checks += 1
+            if not surgeon or surgeon in (None, '', '-', '无'):
                 report_items.append({
                     'level': '警告',
-                    'field': get_friendly_name('coder'),
-                    'message': f"编码员不应是'{coder}'"
+                    'field': f"手术及操作 {i+1} - {get_friendly_name('surgeon')}",
+                    'message': "存在手术或操作编码，但主刀医师为空，请核实。"
                 })
-        except Exception:
-            # 如果 coder 非字符串则忽略该特定警告，但已计入检查数
-            pass
-
-    # 出院西医主要诊断入院病情 (admission_condition) 不应为 '无'
-    adm_cond = data.get('admission_condition')
-    tcm_adm_cond = data.get('tcm_discharge_condition')
-    if adm_cond and adm_cond == '无':
-        report_items.append({
-            'level': '错误',
-            'field': get_friendly_name('admission_condition'),
-            'message': "出院西医主要诊断入院病情不应为'无'，请核实"
-        })
-    if tcm_adm_cond and tcm_adm_cond == '无':
-        report_items.append({
-            'level': '错误',
-            'field': get_friendly_name('tcm_discharge_condition'),
-            'message': "出院中医诊断入院病情不应为'无'，请核实"
-        })
+    return checks
 
-    # ================== CODE MODIFICATION START ==================
-    # --- 手术和麻醉相关校验 (重构逻辑) ---
-
-    # 1. 初始化状态变量，用于在遍历所有操作后进行全局判断
+def _check_anesthesia(data, report_items):
+    # 1. 收集每个操作的麻醉信息状态，用于在遍历所有操作后进行全局判断
     any_op_has_anesthesia_info = False
     any_op_has_incomplete_anesthesia_info = False
     ops_with_incomplete_info = []
 
-    if data.get('operations'):
-        for i, op in enumerate(data['operations']):
-            # 校验1：有手术编码但无主刀医生
-            operation_code = op.get('operation_code')
-            surgeon = op.get('surgeon')
-            if operation_code and operation_code not in (None, '', '-', '无'):
-                check_count += 1
-                if not surgeon or surgeon in (None, '', '-', '无'):
-                    report_items.append({
-                        'level': '警告',
-                        'field': f"手术及操作 {i+1} - {get_friendly_name('surgeon')}",
-                        'message': "存在手术或操作编码，但主刀医师为空，请核实。"
-                    })
-
-            # 2. 收集每个操作的麻醉信息状态
-            method_present = op.get('anesthesia_method') not in (None, '', '-', '无')
-            anesthetist_present = op.get('anesthesiologist') not in (None, '', '-', '无')
-
-            # 如果方式或医师任一存在，则标记为“有麻醉信息”
-            if method_present or anesthetist_present:
-                any_op_has_anesthesia_info = True
-
-            # 如果两者中只有一个存在 (XOR)，则标记为“信息不完整”
-            if method_present != anesthetist_present:
-                any_op_has_incomplete_anesthesia_info = True
-                ops_with_incomplete_info.append(str(i + 1))
-
-    # 3. 全局麻醉逻辑判断 (在遍历所有操作之后)
-    # 整个麻醉逻辑作为一个检查项
-    check_count += 1
-    
+    for i, op in enumerate(data.get('operations') or []):
+        method_present = op.get('anesthesia_method') not in (None, '', '-', '无')
+        anesthetist_present = op.get('anesthesiologist') not in (None, '', '-', '无')
+
+        # 如果方式或医师任一存在，则标记为“有麻醉信息”
+        if method_present or anesthetist_present:
+            any_op_has_anesthesia_info = True
+
+        # 如果两者中只有一个存在 (XOR)，则标记为“信息不完整”
+        if method_present != anesthetist_present:
+            any_op_has_incomplete_anesthesia_info = True
+            ops_with_incomplete_info.append(str(i + 1))
+
+    # 2. 全局麻醉逻辑判断，整个麻醉逻辑作为一个检查项
     # 首先，安全地解析麻醉费用
     anesthesia_fee_str = data.get('anesthesia_fee', '0')
     try:
         # 移除可能的逗号分隔符并转换为浮点数
         fee_val = float(anesthesia_fee_str.replace(',', ''))
         fee_present = fee_val > 0
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, AttributeError):
         fee_present = False
 
     # 场景一：信息不完整 (最高优先级错误)
@@ -471,7 +643,7 @@ def validate_data(data):
             'field': f"手术及操作 {op_list_str}",
             'message': f"有填写不完整的麻醉信息，请核实。"
         })
-    
+
     # 场景二：费用与信息有无的逻辑矛盾
     # (此分支仅在信息完整或全无时进入)
     elif fee_present and not any_op_has_anesthesia_info:
@@ -488,8 +660,8 @@ def validate_data(data):
             'field': f"{get_friendly_name('anesthesia_fee')}/手术操作",
             'message': "没有麻醉费用，但有手术/操作填写了麻醉信息，请核实。"
         })
-        
-    # 场景三：逻辑上一致，但需要人工核实（您提到的难点）
+
+    # 场景三：逻辑上一致，但需要人工核实
     # (有费用，且有完整的麻醉信息)
     elif fee_present and any_op_has_anesthesia_info:
         report_items.append({
@@ -498,9 +670,9 @@ def validate_data(data):
             'message': "检测到麻醉费用和对应的麻醉信息。请人工核实，确保麻醉信息填写在正确的手术/操作条目下。"
         })
     # 最后一种情况 (not fee_present and not any_op_has_anesthesia_info) 是正确的，无需报告。
+    return 1
 
-    # ================== CODE MODIFICATION END ==================
-
+def _check_admission_times(data, report_items):
     #住院次数
     admission_times = data.get('admission_times')
     try:
@@ -515,17 +687,21 @@ def validate_data(data):
     except Exception:
         # 如果不是数字则忽略该检查
         pass
+    return 0
 
+def _check_transfer(data, report_items):
     discharge_method = data.get('discharge_method')
     if discharge_method in ['医嘱转院', '2', '医嘱转社区']:
-        # 检查是否有相关填写（例如转院去向之类字段），此处没有明确字段，查看 readmission_purpose 和 readmission_plan
+        # 检查是否填写了转院/转社区接收机构
         if not data.get('transferring_institution') and not data.get('transferring_institution_Community'):
             report_items.append({
                 'level': '警告',
                 'field': get_friendly_name('discharge_method'),
                 'message': "离院方式为'医嘱转院'，但无填写内容，请核实。"
             })
+    return 0
 
+def _check_rescue(data, report_items):
     #抢救次数和“是否危重”与“是否急症”匹配
     rescue_times = data.get('rescue_times')
     critical = data.get('critical_condition')
@@ -534,20 +710,315 @@ def validate_data(data):
         rescue_num = float(rescue_times) if rescue_times not in (None, '', '-', '无') else 0
     except Exception:
         rescue_num = 0
-    if rescue_num > 0:
-        # 判断 critical/emergency 是否存在 '是' 或 对应代码 '1'
-        # 抢救相关检查视为一项
-        check_count += 1
-        critical_yes = str(critical).strip() in ['是', '1', 'true', 'True'] if critical is not None else False
-        emergency_yes = str(emergency).strip() in ['是', '1', 'true', 'True'] if emergency is not None else False
-        if not (critical_yes or emergency_yes):
-            report_items.append({
-                'level': '逻辑错误',
-                'field': f"{get_friendly_name('rescue_times')}/{get_friendly_name('critical_condition')}/{get_friendly_name('emergency_case')}",
-                'message': '记录有抢救次数，但“是否危重”与“是否急症”均未标识为是，请核实。'
-            })
+    if rescue_num <= 0:
+        return 0
+    # 判断 critical/emergency 是否存在 '是' 或 对应代码 '1'
+    # 抢救相关检查视为一项
+    critical_yes = str(critical).strip() in ['是', '1', 'true', 'True'] if critical is not None else False
+    emergency_yes = str(emergency).strip() in ['是', '1', 'true', 'True'] if emergency is not None else False
+    if not (critical_yes or emergency_yes):
+        report_items.append({
+            'level': '逻辑错误',
+            'field': f"{get_friendly_name('rescue_times')}/{get_friendly_name('critical_condition')}/{get_friendly_name('emergency_case')}",
+            'message': '记录有抢救次数，但“是否危重”与“是否急症”均未标识为是，请核实。'
+        })
+    return 1
+
+# 跨病案的身份一致性检查使用的索引（identity_qc.IdentityIndex），为 None 时该规则不做检查。
+# 交互质控时由 main_qc 设置；批量校验、回填等离线场景默认不启用。
+_IDENTITY_INDEX = None
+
+def set_identity_index(index):
+    """设置身份一致性规则使用的索引，返回之前的索引。"""
+    global _IDENTITY_INDEX
+    previous = _IDENTITY_INDEX
+    _IDENTITY_INDEX = index
+    return previous
+
+def _check_identity(data, report_items):
+    # 与历史中其他病案比较身份证号、姓名、出生日期、性别和住院次数，只查哈希索引
+    if _IDENTITY_INDEX is None:
+        return 0
+    report_items.extend(_IDENTITY_INDEX.conflicts(data))
+    return 1
+
+def _rule(name, fields, func, severity, cost=COST_CHEAP, reusable=True):
+    return Rule(name, fields, func, severity, cost, reusable=reusable)
+
+RULES = (
+    [_rule(f"必填项:{get_friendly_name(k)}", (k,), _required_rule(k), "错误") for k in REQUIRED_FIELDS]
+    + [
+        _rule("国籍", ("nationality",), _check_nationality, "警告"),
+        _rule("身份证号格式", ("id_card_number",), _check_id_card, "错误"),
+        _rule("身份证号校验码", ("id_card_number",), _check_id_card_checksum, "错误"),
+        _rule("身份证号与出生日期", ("id_card_number", "birth_date"), _check_id_card_birth, "逻辑错误"),
+        _rule("身份证号与性别", ("id_card_number", "gender"), _check_id_card_gender, "逻辑错误"),
+    ]
+    + [_rule(f"电话号码:{get_friendly_name(k)}", (k,), _phone_rule(k), "警告")
+       for k in ["current_address_phone", "contact_phone", "household_address_phone", "work_unit_phone"]]
+    + [
+        _rule("联系人为配偶时婚姻状况", ("contact_relationship", "marriage_status"),
+              _check_spouse_marriage, "逻辑错误"),
+        _rule("未婚时联系人关系", ("marriage_status", "contact_relationship"),
+              _check_unmarried_spouse, "逻辑错误"),
+        _rule("中药制剂费与使用情况", ("tcm_preparation_fee", "tcm_preparation_usage"),
+              _fee_usage_rule("tcm_preparation_fee", "tcm_preparation_usage"), "逻辑错误"),
+        _rule("中医治疗费与诊疗技术", ("tcm_treatment_fee", "tcm_technique_usage"),
+              _fee_usage_rule("tcm_treatment_fee", "tcm_technique_usage"), "逻辑错误"),
+        _rule("死亡患者尸检", ("discharge_method", "autopsy"), _check_death_autopsy, "逻辑错误"),
+        _rule("血费与血型/RH", ("blood_fee", "blood_type", "rh"), _check_blood_fee, "逻辑错误"),
+        _rule("地址:现住址", ("current_address",), _address_rule("current_address"), "注意"),
+        _rule("邮编:现住址邮编", ("current_address_zip",), _zip_rule("current_address_zip"), "警告"),
+        _rule("地址:户口地址", ("household_address",), _address_rule("household_address"), "注意"),
+        _rule("邮编:户口地址邮编", ("household_address_zip",), _zip_rule("household_address_zip"), "警告"),
+        _rule("地址:联系人地址", ("contact_address",), _address_rule("contact_address"), "注意"),
+        _rule("地址:工作单位地址", ("work_unit_address",), _address_rule("work_unit_address"), "注意"),
+        _rule("邮编:工作单位邮编", ("work_unit_zip",), _zip_rule("work_unit_zip"), "警告"),
+        _rule("病人来源与现住址", ("patient_source", "current_address"), _check_patient_source, "注意"),
+        _rule("邮编与地址:现住址", ("current_address_zip", "current_address"),
+              _zip_region_rule("current_address_zip", "current_address"), "注意"),
+        _rule("邮编与地址:户口地址", ("household_address_zip", "household_address"),
+              _zip_region_rule("household_address_zip", "household_address"), "注意"),
+        _rule("联系人姓名", ("contact_name", "name"), _check_contact_name, "注意"),
+        _rule("出生地", ("birth_place",), _place_rule("birth_place"), "注意"),
+        _rule("籍贯", ("native_place",), _place_rule("native_place"), "注意"),
+        _rule("工作单位", ("work_unit",), _check_work_unit, "注意"),
+        _rule("编码员", ("coder",), _check_coder, "警告"),
+        _rule("西医主要诊断入院病情", ("admission_condition",),
+              _admission_condition_rule("admission_condition", "出院西医主要诊断"), "错误"),
+        _rule("中医主病入院病情", ("tcm_discharge_condition",),
+              _admission_condition_rule("tcm_discharge_condition", "出院中医诊断"), "错误"),
+        _rule("手术主刀医师", ("operations",), _check_operation_surgeon, "警告", COST_GRID),
+        _rule("麻醉信息与麻醉费用", ("operations", "anesthesia_fee"), _check_anesthesia, "错误", COST_GRID),
+        _rule("住院次数", ("admission_times",), _check_admission_times, "注意"),
+        _rule("医嘱转院接收机构", ("discharge_method", "transferring_institution", "transferring_institution_Community"),
+              _check_transfer, "警告"),
+        _rule("抢救与危重/急症", ("rescue_times", "critical_condition", "emergency_case"), _check_rescue, "逻辑错误"),
+        _rule("身份一致性", ("case_number_verify", "id_card_number", "name", "birth_date", "gender", "admission_times"),
+              _check_identity, "警告", reusable=False),
+    ]
+)
+
+def get_rule(name):
+    """按名称返回注册表中的规则，找不到时抛出 KeyError。"""
+    for rule in RULES:
+        if rule.name == name:
+            return rule
+    raise KeyError(name)
+
+def set_rule_enabled(name, enabled=True):
+    """启用或停用一条规则。"""
+    get_rule(name).enabled = enabled
+
+def enabled_rules(rules=None):
+    """返回启用的规则（保持注册表顺序）。"""
+    return [rule for rule in (RULES if rules is None else rules) if rule.enabled]
+
+def checked_fields(rules=None):
+    """返回启用的规则检查的全部字段集合（历史记录据此标记“通过/未质控”）。"""
+    fields = set()
+    for rule in enabled_rules(rules):
+        fields.update(rule.fields)
+    return fields
+
+def rule_input_fields():
+    """返回启用的规则需要读取的字段集合（用于“仅质控”提取方案），包括用于校验的病案号。"""
+    return checked_fields() | {"case_number_verify"}
+
+def rule_stats(rules=None):
+    """返回各规则的累计统计（执行次数、检查项、问题数、耗时），按累计耗时从高到低排列。"""
+    stats = [
+        {
+            'name': rule.name,
+            'severity': rule.severity,
+            'cost': rule.cost,
+            'enabled': rule.enabled,
+            'runs': rule.runs,
+            'checks': rule.checks,
+            'issues': rule.issues,
+            'elapsed': rule.elapsed,
+        }
+        for rule in (RULES if rules is None else rules)
+    ]
+    stats.sort(key=lambda x: x['elapsed'], reverse=True)
+    return stats
+
+def reset_rule_stats(rules=None):
+    for rule in (RULES if rules is None else rules):
+        rule.reset_stats()
+
+def validate_data(data, skipped_rules=None, previous=None, rule_results=None):
+    """
+    校验提取出的数据，检查缺失和逻辑错误。
+
+    输入字段中有未读取的值（extractor_qc.NOT_READ，例如提取超时）时，只跳过依赖这些字段的规则，
+    其余规则照常执行。
+
+    提供上一次运行的快照（history_qc.get_last_snapshot()）时做增量校验：对同一病案号，
+    输入字段与上次完全相同的规则直接沿用上次的结果，只重新计算输入字段有变化的规则。
+
+    :param data: 从 extractor_qc.extract_all_data() 获取的字典
+    :param skipped_rules: 可选列表，用于收集因数据未读取而跳过的规则，每项为 (规则名称, 未读取字段列表)
+    :param previous: 可选，上一次运行的快照，需包含 'extracted'、'case_number' 与 'rule_results'
+    :param rule_results: 可选字典，用于收集各规则的结果 {规则名称: (问题列表, 检查项数量, 是否沿用)}，
+                         保存到快照中供下一次增量校验使用
+    :return: tuple (validation_results, case_number, check_count)
+        - validation_results: 一个包含所有发现问题的列表，每个问题是一个字典
+        - case_number: 病案号
+        - check_count: 已执行的检查项数量
+    """
+    info("▶ 开始数据校验...")
+    report_items = []
+    # 统计已执行的检查项数量（用于总检查数统计）
+    check_count = 0
 
+    for rule in RULES:
+        check_count += _apply_rule(rule, data, report_items, skipped_rules, previous, rule_results)
 
     info("✔ 数据校验完成。")
     case_number = data.get("case_number_verify", "")
     return report_items, case_number, check_count
+
+def _apply_rule(rule, data, report_items, skipped_rules=None, previous=None, rule_results=None):
+    """
+    执行单条规则并返回检查项数量。停用的规则直接返回 0；
+    输入字段有未读取的值时跳过该规则并记录到 skipped_rules；
+    输入字段与上一次运行相同时沿用上一次的结果（见 validate_data 的 previous 参数）。
+    """
+    if not rule.enabled:
+        return 0
+    unread = [f for f in rule.fields if data.get(f) is NOT_READ]
+    if unread:
+        if skipped_rules is not None:
+            skipped_rules.append((rule.name, unread))
+        return 0
+    reused = _reusable_result(rule, data, previous)
+    if reused is not None:
+        items, checks = reused
+        report_items.extend(items)
+    else:
+        before = len(report_items)
+        checks = rule.run(data, report_items)
+        items = report_items[before:]
+    if rule_results is not None:
+        rule_results[rule.name] = (items, checks, reused is not None)
+    return checks
+
+def _reusable_result(rule, data, previous):
+    """
+    同一病案号下，规则的输入字段与上一次运行完全相同时，返回上一次的 (问题列表, 检查项数量)，否则返回 None。
+    规则只依赖声明的输入字段，因此沿用的结果与重新计算的结果相同。
+    """
+    if not previous or not rule.reusable:
+        return None
+    entry = (previous.get('rule_results') or {}).get(rule.name)
+    if entry is None or previous.get('case_number') != data.get('case_number_verify', ''):
+        return None
+    extracted = previous.get('extracted') or {}
+    for field in rule.fields:
+        if field not in extracted:
+            return None
+        old = extracted[field]
+        if old is NOT_READ or data.get(field) != old:
+            return None
+    return list(entry[0]), entry[1]
+
+def summarize_reuse(rule_results):
+    """返回增量校验的统计 (沿用的规则数, 重新计算的规则数)。"""
+    reused = sum(1 for entry in rule_results.values() if entry[2])
+    return reused, len(rule_results) - reused
+
+class StreamingValidator:
+    """
+    流式校验：字段逐个到达，某条规则的输入字段全部到齐后立即执行该规则。
+    提供 previous 时与 validate_data 一样做增量校验（病案号需先于其他字段提供）。
+
+    最终的问题列表、检查项数量与跳过的规则均按 RULES 顺序汇总，与 validate_data() 的结果完全一致，
+    区别只在于问题可以在提取尚未完成时就输出。
+
+    用法::
+
+        stream = StreamingValidator()
+        for field in stream.field_order():
+            for item in stream.feed(field, record[field]):
+                report_issue(item)
+        validation_results, case_number, check_count, _ = stream.finish(record)
+    """
+
+    def __init__(self, rules=None, previous=None):
+        self.rules = enabled_rules(rules)
+        self.previous = previous
+        self.rule_results = {}  # 同 validate_data 的 rule_results
+        self.data = {}
+        self._results = [None] * len(self.rules)  # 每条规则发现的问题；None 表示尚未执行
+        self._checks = [0] * len(self.rules)
+        self._skipped = [None] * len(self.rules)
+        self._missing = [len(set(rule.fields)) for rule in self.rules]
+        self._waiting = {}  # {字段: [依赖该字段的规则序号]}
+        for i, rule in enumerate(self.rules):
+            for f in set(rule.fields):
+                self._waiting.setdefault(f, []).append(i)
+
+    def field_order(self):
+        """按规则顺序返回需要读取的字段（去重），先读取的字段能让靠前的规则尽早执行。"""
+        order = []
+        for rule in self.rules:
+            for f in rule.fields:
+                if f not in order:
+                    order.append(f)
+        return order
+
+    def pending_fields(self):
+        """返回尚未到达、但仍有规则在等待的字段。"""
+        return [f for f in self.field_order() if f not in self.data]
+
+    def _run(self, i):
+        items = []
+        skipped = []
+        self._checks[i] = _apply_rule(self.rules[i], self.data, items, skipped,
+                                      self.previous, self.rule_results)
+        self._results[i] = items
+        self._skipped[i] = skipped
+        return items
+
+    def feed(self, field, value):
+        """
+        提供一个字段的值。
+
+        :param field: 字段键
+        :param value: 字段值（可以是 extractor_qc.NOT_READ）
+        :return: 因此字段到达而新执行的规则所发现的问题列表
+        """
+        if field in self.data:
+            return []
+        self.data[field] = value
+        new_items = []
+        for i in self._waiting.pop(field, ()):
+            self._missing[i] -= 1
+            if self._missing[i] == 0:
+                new_items.extend(self._run(i))
+        return new_items
+
+    def finish(self, data=None):
+        """
+        结束流式校验。仍在等待输入的规则以 data 中的值（缺省视为 None）补齐后执行。
+
+        :param data: 可选的完整记录，用于补齐未通过 feed() 提供的字段
+        :return: tuple (validation_results, case_number, check_count, new_items)
+            - new_items: 本次补齐字段后才发现的问题
+        """
+        new_items = []
+        for field in self.pending_fields():
+            value = data.get(field) if data is not None else None
+            new_items.extend(self.feed(field, value))
+        validation_results = [item for items in self._results if items for item in items]
+        check_count = sum(self._checks)
+        if "case_number_verify" in self.data:
+            case_number = self.data["case_number_verify"]
+        else:
+            case_number = data.get("case_number_verify", "") if data is not None else ""
+        return validation_results, case_number, check_count, new_items
+
+    def skipped_rules(self):
+        """返回因数据未读取而跳过的规则，按 RULES 顺序排列。"""
+        return [entry for skipped in self._skipped if skipped for entry in skipped]